@@ -1,5 +1,8 @@
 import cv2
 import torch
+import queue
+import threading
+import time
 import requests
 from ultralytics import YOLO
 
@@ -14,15 +17,88 @@ FOCAL_LENGTH = 700  # Adjust this for your setup
 KNOWN_HEIGHT = 1.5  # Object height in meters
 ESP32_IP = "http://192.168.4.1/distance"
 
+# Distance push settings
+MIN_DISTANCE_CHANGE = 0.25  # Meters, smaller changes are not sent to the ESP32
+HEARTBEAT_INTERVAL = 2.0  # Seconds, resend the current value this often even if unchanged
+SEND_TIMEOUT = (0.5, 1.0)  # Connect / read timeout for each request
+NO_DISTANCE = -1  # Sent when nothing is detected, same as estimate_distance() for invalid boxes
+
+
 def estimate_distance(focal_length, real_height, bbox_height):
     return (focal_length * real_height) / bbox_height if bbox_height else -1
 
+
+class DistanceSender(threading.Thread):
+    """
+    Pushes the closest distance to the ESP32 from a background thread.
+
+    The detection loop calls update() once per frame; it never blocks. Only
+    the newest value is kept (a queue of one), and it is sent over a
+    keep-alive session when it changed meaningfully or the heartbeat is due.
+    """
+
+    def __init__(self, url):
+        super().__init__(daemon=True)
+        self.url = url
+        self.session = requests.Session()
+        self.pending = queue.Queue(maxsize=1)
+        self.failing = False
+
+    def update(self, distance):
+        # Replace any value the sender has not picked up yet
+        try:
+            self.pending.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.pending.put_nowait(distance)
+        except queue.Full:
+            pass
+
+    def run(self):
+        current = None
+        last_sent = None
+        last_send_time = 0.0
+
+        while True:
+            try:
+                current = self.pending.get(timeout=HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                pass
+            if current is None:
+                continue
+
+            changed = (last_sent is None
+                       or (current == NO_DISTANCE) != (last_sent == NO_DISTANCE)
+                       or abs(current - last_sent) >= MIN_DISTANCE_CHANGE)
+            if not changed and time.time() - last_send_time < HEARTBEAT_INTERVAL:
+                continue
+
+            try:
+                self.session.get(self.url, params={"distance": f"{current:.2f}"}, timeout=SEND_TIMEOUT)
+                if self.failing:
+                    print("Sending distance to ESP32 recovered")
+                self.failing = False
+            except requests.exceptions.RequestException as e:
+                # Report once per outage rather than on every attempt
+                if not self.failing:
+                    print("Failed to send data:", e)
+                self.failing = True
+
+            last_sent = current
+            last_send_time = time.time()
+
+
+sender = DistanceSender(ESP32_IP)
+sender.start()
+
 while cap.isOpened():
     ret, frame = cap.read()
     if not ret:
         break
 
     results = model(frame)  # Run YOLOv8 inference
+    closest_distance = None
     for result in results:
         for box in result.boxes.xyxy:  # Extract bounding boxes
             x1, y1, x2, y2 = map(int, box[:4])
@@ -31,17 +107,17 @@ while cap.isOpened():
             distance = estimate_distance(FOCAL_LENGTH, KNOWN_HEIGHT, obj_height)
             print(f"Detected object at {distance:.2f} meters")
 
-            # Send distance to ESP32
-            try:
-                requests.get(ESP32_IP, params={"distance": f"{distance:.2f}"})
-            except Exception as e:
-                print("Failed to send data:", e)
+            if distance > 0 and (closest_distance is None or distance < closest_distance):
+                closest_distance = distance
 
             # Draw bounding box and distance
             cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
             cv2.putText(frame, f"{distance:.2f}m", (x1, y1 - 10),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
 
+    # Send only the closest distance for this frame to the ESP32
+    sender.update(closest_distance if closest_distance is not None else NO_DISTANCE)
+
     cv2.imshow("YOLOv8 Detection", frame)
     if cv2.waitKey(1) & 0xFF == ord('q'):
         break
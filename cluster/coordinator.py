@@ -0,0 +1,183 @@
+"""
+Coordinator of a sharded deployment (see espcam/cluster.py).
+
+Hands the cameras out to the workers that register, moves them when a
+worker dies or is overloaded, and serves what the workers report as one
+/data (cam1 and cam2 fused as in test-1, every camera under 'cameras') and
+one /video_feed/<cam> per camera, whichever worker runs it.
+
+On one machine, with two workers:
+
+    python cluster/coordinator.py --port 6000 \\
+        --camera cam1=http://127.0.0.1:9001/stream --camera cam2=http://127.0.0.1:9003/stream
+    python cluster/worker.py --coordinator http://127.0.0.1:6000 --port 6001 --capacity 1
+    python cluster/worker.py --coordinator http://127.0.0.1:6000 --port 6002 --capacity 1
+
+(python -m espcam.loadgen test-1/detections --cameras 2 --print-env starts
+simulated cameras on those ports.)
+"""
+import argparse
+import os
+import sys
+import threading
+
+from flask import Flask, Response, jsonify, request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from espcam.cluster import Coordinator, StreamGateway
+from espcam.fusion import FusionEngine
+from espcam.payload import FULL, PayloadCache
+
+CAM1_URL = os.environ.get("CAM1_URL", "http://192.168.212.194:81/stream")
+CAM2_URL = os.environ.get("CAM2_URL", "http://192.168.212.100:81/stream")
+
+CAMERA_DISTANCE = 1.0
+OBSTACLE_CLASSES = [0, 1, 2, 3, 5, 7]  # person, bicycle, car, motorcycle, bus, truck
+VEHICLE_CLASSES = [2, 3, 5, 7]  # car, motorcycle, bus, truck
+
+app = Flask(__name__)
+
+coordinator = None
+gateway = None
+fusion = FusionEngine('cam1', 'cam2', CAMERA_DISTANCE)
+reports = {}            # camera -> latest report
+reports_version = 0
+reports_lock = threading.Lock()
+
+
+def camera_config(name, url):
+    """
+    cam2 looks for vehicles, every other camera for obstacles
+    """
+    return {'url': url, 'classes': VEHICLE_CLASSES if name == 'cam2' else OBSTACLE_CLASSES}
+
+
+def snapshot():
+    data = fusion.snapshot()
+    with reports_lock:
+        data['cameras'] = {camera: dict(report) for camera, report in reports.items()}
+    data['assignments'] = coordinator.owners()
+    return data
+
+
+data_payloads = PayloadCache(
+    lambda: (reports_version, tuple(fusion.stale_cameras()), tuple(sorted(coordinator.owners().items()))),
+    snapshot)
+
+
+@app.route('/cluster/register', methods=['POST'])
+def register():
+    body = request.get_json(silent=True) or {}
+    try:
+        cameras = coordinator.register(str(body['worker']), str(body['url']), int(body['capacity']))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': "worker, url and capacity are required"}), 400
+    return jsonify({'cameras': cameras})
+
+
+@app.route('/cluster/heartbeat', methods=['POST'])
+def heartbeat():
+    body = request.get_json(silent=True) or {}
+    cameras = coordinator.heartbeat(str(body.get('worker')), body.get('load') or {})
+    if cameras is None:
+        return jsonify({'error': "unknown worker, register first"}), 404
+    return jsonify({'cameras': cameras})
+
+
+@app.route('/cluster/report', methods=['POST'])
+def report():
+    global reports_version
+
+    body = request.get_json(silent=True) or {}
+    worker, camera = body.get('worker'), body.get('camera')
+    if not coordinator.accepts(worker, camera):
+        # The camera moved, results still in flight from its old worker are dropped
+        return jsonify({'error': f"{camera} is not assigned to {worker}"}), 409
+
+    try:
+        capture_time = float(body['capture_time'])
+        detections = list(body['detections'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': "capture_time and detections are required"}), 400
+
+    if camera in (fusion.obstacle_camera, fusion.vehicle_camera):
+        fusion.update(camera, capture_time, detections)
+    with reports_lock:
+        reports[camera] = {'worker': worker, 'timestamp': capture_time, 'detections': detections,
+                           'frame': body.get('frame')}
+        reports_version += 1
+    return '', 204
+
+
+@app.route('/cluster/status')
+def cluster_status():
+    return jsonify(coordinator.status())
+
+
+@app.route('/data')
+def get_data():
+    """
+    Latest detections of every camera, with the same formats, ETag and gzip
+    as test-1's /data
+    """
+    try:
+        payload = data_payloads.get(request.args.get('format', FULL),
+                                    gzip_ok='gzip' in request.headers.get('Accept-Encoding', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except ImportError:
+        return jsonify({'error': "msgpack is not installed on the server"}), 501
+
+    response = Response(payload.body, content_type=payload.content_type)
+    response.set_etag(payload.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    if payload.encoding:
+        response.headers['Content-Encoding'] = payload.encoding
+    return response.make_conditional(request)
+
+
+def generate_frames(latest):
+    seq = 0
+    while True:
+        seq, jpeg = latest.read(seq, timeout=1.0)
+        if jpeg is None:
+            continue
+        yield (b'--frame\r\n'
+               b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+
+
+@app.route('/video_feed/<cam>')
+def video_feed(cam):
+    """
+    A camera's annotated stream, relayed from the worker running it
+    """
+    if cam not in coordinator.cameras:
+        return jsonify({'error': f"unknown camera {cam}"}), 404
+    return Response(generate_frames(gateway.latest(cam)), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+def main(argv=None):
+    global coordinator, gateway
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=6000)
+    parser.add_argument('--camera', action='append', metavar='NAME=URL',
+                        help="camera to hand out (default cam1 and cam2 from CAM1_URL/CAM2_URL)")
+    args = parser.parse_args(argv)
+
+    cameras = {}
+    for spec in args.camera or [f'cam1={CAM1_URL}', f'cam2={CAM2_URL}']:
+        name, _, url = spec.partition('=')
+        if not name or not url:
+            parser.error(f"--camera expects NAME=URL, got {spec}")
+        cameras[name] = camera_config(name, url)
+
+    coordinator = Coordinator(cameras).start()
+    gateway = StreamGateway(coordinator.stream_url)
+
+    app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Inference worker of a sharded deployment (see espcam/cluster.py).
+
+Runs capture -> detect -> publish for the cameras the coordinator assigns
+it, reports each camera's detections back to the coordinator and serves
+the annotated streams the coordinator's gateway reads.
+
+    python cluster/worker.py --coordinator http://10.0.0.2:6000 --port 6001 --capacity 2
+
+Several workers can run on one machine for testing, with different ports.
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+
+from flask import Flask, Response, jsonify, request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from espcam import metrics, stages, tracing
+from espcam.camera import get_camera, release_camera
+from espcam.cluster import OVERLOAD_DROP_RATIO, WorkerAgent
+from espcam.model_loader import LazyModel
+from espcam.pipeline import DROP_OLDEST, LATEST_ONLY, Pipeline
+from espcam.streams import StreamHub, parse_variant
+
+MODEL_PATH = "yolov8n.pt"
+BOX_COLOR = (0, 0, 255)
+
+app = Flask(__name__)
+
+model = None
+agent = None
+pipelines = {}      # camera -> running Pipeline
+stream_hubs = {}    # camera -> StreamHub, kept when a camera moves away
+_stopped = {}       # camera -> Event ending its capture loop
+_previous = {}      # camera -> (processed, dropped) of the detect stage at the last heartbeat
+_lock = threading.Lock()
+
+
+def annotate(frame, detections):
+    stages.draw_detections(frame, detections, BOX_COLOR)
+
+
+def capture(cam_name, cam_url, stopped):
+    """
+    Frames of one camera until it is taken away from this worker
+    """
+    camera = get_camera(cam_name, cam_url)
+    seq = 0
+    while not stopped.is_set():
+        seq, frame, stamps = camera.read_stamped(seq, timeout=1.0)
+        if frame is None:
+            continue
+        frame = stages.resize_frame(frame)
+        yield {'capture_time': stamps['capture_time'], 'frame': frame, 'stamps': stamps}
+
+
+def detector(cam_name, classes):
+    inference_time = metrics.STAGE_SECONDS.labels(cam_name, 'inference')
+    distance_fn = stages.DISTANCE_FUNCTIONS.get(cam_name, stages.cam1_distance)
+
+    def detect(item):
+        if not model.wait(1.0):
+            return None  # still loading, the frame is dropped
+        with inference_time.time():
+            results = stages.run_inference(model, item['frame'], verbose=False)
+        item['detections'] = stages.extract_detections(results, model.names, classes, distance_fn)
+        tracing.mark(item['stamps'], 'detect', cam_name)
+        return item
+
+    return detect
+
+
+def publisher(cam_name, hub, report):
+    frames_processed = metrics.FRAMES_PROCESSED.labels(cam_name)
+
+    def publish(item):
+        stamps = tracing.mark(item['stamps'], 'publish', cam_name)
+        frames_processed.inc()
+        hub.publish(item['frame'], item['detections'], dict(stamps))
+        if not report({'capture_time': item['capture_time'], 'detections': item['detections'],
+                       'frame': tracing.summary(stamps)}):
+            agent.drop(cam_name)  # the camera moved, stop it before the next heartbeat says so
+
+    return publish
+
+
+def start_camera(cam_name, config):
+    with _lock:
+        hub = stream_hubs.get(cam_name)
+        if hub is None:
+            hub = stream_hubs[cam_name] = StreamHub(cam_name, annotate)
+        stopped = _stopped[cam_name] = threading.Event()
+        _previous[cam_name] = (0, 0)
+        pipelines[cam_name] = (Pipeline(cam_name)
+                               .source('capture', lambda: capture(cam_name, config['url'], stopped))
+                               .stage('detect', detector(cam_name, config.get('classes')), policy=DROP_OLDEST)
+                               .stage('publish', publisher(cam_name, hub, agent.reporter(cam_name)),
+                                      policy=LATEST_ONLY)
+                               .start())
+
+
+def stop_camera(cam_name):
+    with _lock:
+        pipeline = pipelines.pop(cam_name, None)
+        stopped = _stopped.pop(cam_name, None)
+    if stopped is not None:
+        stopped.set()
+    if pipeline is not None:
+        pipeline.stop()
+    release_camera(cam_name)
+
+
+def load():
+    """
+    Per camera load for the heartbeat: frames detected and dropped in front
+    of detection since the last heartbeat. A camera dropping most of its
+    frames is reported overloaded so the coordinator can move it.
+    """
+    report = {}
+    with _lock:
+        for cam_name, pipeline in pipelines.items():
+            detect = pipeline.stages[0]
+            processed, dropped = detect.processed, detect.dropped
+            last_processed, last_dropped = _previous[cam_name]
+            _previous[cam_name] = (processed, dropped)
+
+            processed, dropped = processed - last_processed, dropped - last_dropped
+            drop_ratio = dropped / (processed + dropped) if processed + dropped else 0.0
+            report[cam_name] = {'processed': processed, 'dropped': dropped, 'drop_ratio': round(drop_ratio, 3),
+                                'overloaded': model.ready and drop_ratio > OVERLOAD_DROP_RATIO}
+    return report
+
+
+def generate_frames(hub, variant_key):
+    viewers = metrics.VIEWERS.labels(hub.name)
+    viewers.inc()
+    variant = hub.subscribe(*variant_key)
+    try:
+        seq = 0
+        while True:
+            seq, frame_bytes, stamps = variant.read(seq, timeout=1.0)
+            if frame_bytes is None:
+                continue
+            stamps = tracing.mark(dict(stamps) if stamps else None, 'send', hub.name)
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n' + tracing.part_headers(stamps) + b'\r\n' + frame_bytes + b'\r\n')
+    finally:
+        hub.unsubscribe(variant)
+        viewers.dec()
+
+
+@app.route('/video_feed/<cam>')
+def video_feed(cam):
+    hub = stream_hubs.get(cam)
+    if hub is None:
+        return jsonify({'error': f"{cam} is not running on this worker"}), 404
+    try:
+        variant_key = parse_variant(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return Response(generate_frames(hub, variant_key), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+@app.route('/status')
+def status():
+    with _lock:
+        running = {cam_name: pipeline.status() for cam_name, pipeline in pipelines.items()}
+    return jsonify({'worker': agent.worker_id, 'registered': agent.registered, 'model': model.status(),
+                    'pipelines': running})
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+
+def main(argv=None):
+    global model, agent
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--coordinator', default=os.environ.get('COORDINATOR_URL', 'http://127.0.0.1:6000'))
+    parser.add_argument('--port', type=int, default=6001)
+    parser.add_argument('--url', help="URL the coordinator reaches this worker at "
+                                      "(default http://<hostname>:<port>)")
+    parser.add_argument('--id', help="worker id (default <hostname>:<port>)")
+    parser.add_argument('--capacity', type=int, default=2, help="cameras this worker can run")
+    parser.add_argument('--model', default=MODEL_PATH)
+    args = parser.parse_args(argv)
+
+    hostname = socket.gethostname()
+    worker_id = args.id or f"{hostname}:{args.port}"
+    url = args.url or f"http://{hostname}:{args.port}"
+
+    model = LazyModel(args.model).start()
+    agent = WorkerAgent(args.coordinator, worker_id, url, args.capacity, start_camera, stop_camera, load).start()
+
+    app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+"""
+Shared helpers for the ESP32-CAM YOLOv8 detection servers and tools.
+
+The scripts in the sub-directories (test-1, websoc, ...) are run from their
+own folder, so they add the repository root to ``sys.path`` before importing
+this package.
+"""
+import os
+
+# On-disk cache for tuned settings and exported models
+CACHE_DIR = os.environ.get('ESPCAM_CACHE_DIR', os.path.expanduser('~/.cache/espcam'))
@@ -0,0 +1,171 @@
+"""
+Accident alerts as a Server-Sent Events channel, separate from the video.
+
+The inference loop reports whether the warning condition holds on every
+frame. An alert is raised after it held for raise_frames frames in a row and
+cleared only after it has been absent for clear_seconds, so a flickering
+detection neither floods clients nor makes the alert blink. An alert whose
+camera stops delivering verdicts altogether clears as well, with reason
+"no frames", once none arrived for no_frames_seconds (checked by a watchdog
+thread while the alert is active, whether or not anyone is subscribed). Events are
+pushed to subscribers the moment they are decided and carry the frame's
+capture time, the inference-done time and the time they were sent:
+
+    alerts = AlertChannel('cam1')
+    alerts.update(active, capture_time, inference_done, distance=2.4)
+
+    @app.route('/alerts')
+    def alert_stream():
+        return Response(alerts.stream(), mimetype='text/event-stream')
+
+Browsers subscribe with `new EventSource('/alerts')` and listen for the
+alert_raised / alert_cleared events.
+"""
+import json
+import queue
+import threading
+import time
+
+from espcam import metrics
+
+RAISE_FRAMES = 2       # consecutive frames the condition must hold
+CLEAR_SECONDS = 1.0    # how long it must be absent before clearing
+NO_FRAMES_SECONDS = 10.0  # how long without any verdict before an active alert clears
+HEARTBEAT_SECONDS = 15.0
+SUBSCRIBER_QUEUE_SIZE = 64
+
+
+class AlertChannel:
+    """
+    Debounced alert state of one camera, broadcast to SSE subscribers
+    """
+
+    def __init__(self, camera, raise_frames=RAISE_FRAMES, clear_seconds=CLEAR_SECONDS,
+                 no_frames_seconds=NO_FRAMES_SECONDS):
+        self.camera = camera
+        self.raise_frames = raise_frames
+        self.clear_seconds = clear_seconds
+        self.no_frames_seconds = no_frames_seconds
+
+        self.active = False
+        self.last_event = None
+        self._event_id = 0
+        self._streak = 0
+        self._last_seen = None
+        self._last_capture = None
+        self._last_verdict = None     # arrival time of the newest verdict, by our clock
+        self._watchdog = None
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._latency = metrics.ALERT_LATENCY.labels(camera)
+
+    def update(self, condition, capture_time, inference_done, **detail):
+        """
+        Feed one frame's verdict, returns the event if it raised or cleared
+        the alert. Extra keyword arguments (distance, label...) are sent with
+        the event.
+
+        Frames reported twice, or older than one already seen, are ignored.
+        """
+        with self._lock:
+            if self._last_capture is not None and capture_time <= self._last_capture:
+                return None
+            self._last_capture = capture_time
+            self._last_verdict = time.time()
+
+            if condition:
+                self._streak += 1
+                self._last_seen = capture_time
+                if not self.active and self._streak >= self.raise_frames:
+                    self.active = True
+                    self._watch()
+                    return self._publish('alert_raised', capture_time, inference_done, detail)
+            else:
+                self._streak = 0
+                if self.active and capture_time - self._last_seen >= self.clear_seconds:
+                    self.active = False
+                    return self._publish('alert_cleared', capture_time, inference_done, detail)
+        return None
+
+    def expire(self, now=None):
+        """
+        Clear an active alert when no verdict arrived for no_frames_seconds,
+        returns the event if it cleared
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if self.active and now - self._last_verdict >= self.no_frames_seconds:
+                self.active = False
+                self._streak = 0
+                return self._publish('alert_cleared', None, None, {'reason': "no frames"})
+        return None
+
+    def _watch(self):
+        """
+        Start the watchdog expiring the active alert (called with the lock held)
+        """
+        if self._watchdog is not None and self._watchdog.is_alive():
+            return
+        self._watchdog = threading.Thread(target=self._run_watchdog, name=f"alerts-{self.camera}")
+        self._watchdog.daemon = True
+        self._watchdog.start()
+
+    def _run_watchdog(self):
+        interval = min(1.0, self.no_frames_seconds / 4)
+        while self.active:
+            time.sleep(interval)
+            self.expire()
+
+    def _publish(self, kind, capture_time, inference_done, detail):
+        self._event_id += 1
+        event = dict(detail, id=self._event_id, type=kind, camera=self.camera,
+                     capture_time=capture_time, inference_done_time=inference_done,
+                     decided_time=time.time())
+        self.last_event = event
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # A stalled client loses its oldest event, never the newest
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+                subscriber.put_nowait(event)
+        return event
+
+    def state(self):
+        return {'camera': self.camera, 'active': self.active, 'last_event': self.last_event}
+
+    def format_event(self, event):
+        """
+        SSE wire format, stamped with the time it leaves the server
+        """
+        sent = time.time()
+        if event.get('capture_time') is not None:
+            self._latency.observe(sent - event['capture_time'])
+        payload = json.dumps(dict(event, sent_time=sent))
+        return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+    def stream(self):
+        """
+        Generator of SSE messages for one subscriber, starting with the
+        current state so late joiners know whether an alert is active
+        """
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.append(subscriber)
+            current = self.state()
+        try:
+            yield f"event: alert_state\ndata: {json.dumps(dict(current, sent_time=time.time()))}\n\n"
+            while True:
+                try:
+                    event = subscriber.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    # Comment line, keeps proxies from closing an idle stream
+                    yield ": heartbeat\n\n"
+                    continue
+                yield self.format_event(event)
+        finally:
+            with self._lock:
+                self._subscribers.remove(subscriber)
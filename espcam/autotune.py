@@ -0,0 +1,211 @@
+"""
+Startup auto-tuner for the inference workers.
+
+Benchmarks combinations of torch intra-op threads, inference worker count and
+CPU affinity on a few warm-up frames and keeps the fastest. The result is
+saved per host, model and core count, so later starts reuse it without
+benchmarking again:
+
+    config = autotune.load_or_tune("yolov8n.pt", frames, cameras=2)
+    autotune.apply_process_settings(config)
+    # in each inference worker thread:
+    autotune.pin_worker(config, worker_index)
+
+A config looks like {"torch_threads": 2, "workers": 2, "affinity": "compact"},
+where workers is the number of inference threads per camera.
+"""
+import itertools
+import json
+import os
+import platform
+import threading
+import time
+
+import numpy as np
+
+from espcam import CACHE_DIR
+
+CACHE_FILE = os.path.join(CACHE_DIR, 'autotune.json')
+
+WARMUP_RUNS = 2       # runs per worker before timing, not measured
+TIMED_RUNS = 8        # runs per worker that are timed
+
+# 'none' leaves scheduling to the OS, 'compact' pins each worker to its own
+# block of torch_threads cores and keeps the remaining cores for capture/Flask
+AFFINITY_MODES = ('none', 'compact')
+
+DEFAULT_CONFIG = {'torch_threads': None, 'workers': 1, 'affinity': 'none'}
+
+
+def cache_key(model_path, cameras):
+    return f"{platform.node()}|{os.path.basename(model_path)}|{os.cpu_count()}|{cameras}"
+
+
+def load_cached(model_path, cameras):
+    """
+    Return the saved config for this host and model, or None
+    """
+    try:
+        with open(CACHE_FILE, 'r') as f:
+            return json.load(f).get(cache_key(model_path, cameras))
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def save_cached(model_path, cameras, config):
+    try:
+        with open(CACHE_FILE, 'r') as f:
+            cache = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        cache = {}
+
+    cache[cache_key(model_path, cameras)] = config
+    os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+    tmp_path = CACHE_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, CACHE_FILE)
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def worker_cpus(config, worker_index, cpus=None):
+    """
+    Cores a worker should run on under the config's affinity mode (None = any)
+    """
+    if config.get('affinity') != 'compact' or not config.get('torch_threads'):
+        return None
+    cpus = cpus or available_cpus()
+    threads = config['torch_threads']
+    start = (worker_index * threads) % len(cpus)
+    return {cpus[(start + i) % len(cpus)] for i in range(threads)}
+
+
+def pin_worker(config, worker_index):
+    """
+    Pin the calling thread to its cores (Linux applies affinity per thread)
+    """
+    cores = worker_cpus(config, worker_index)
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+
+
+def apply_process_settings(config):
+    """
+    Apply the process-wide part of a config (torch's intra-op pool size)
+    """
+    import torch
+
+    if config.get('torch_threads'):
+        torch.set_num_threads(config['torch_threads'])
+
+
+def candidate_configs(cpu_count, cameras):
+    """
+    Thread / worker / affinity combinations that fit on this machine
+    """
+    thread_options = sorted({t for t in (1, 2, 4, 8, cpu_count) if t <= cpu_count})
+    worker_options = [w for w in (1, 2, 4) if w <= cpu_count]
+
+    for threads, workers, affinity in itertools.product(thread_options, worker_options, AFFINITY_MODES):
+        # Do not oversubscribe the cores (the smallest config is always tried)
+        if threads * workers * cameras > cpu_count and (threads, workers) != (1, 1):
+            continue
+        yield {'torch_threads': threads, 'workers': workers, 'affinity': affinity}
+
+
+def measure(model_factory, frames, config, cameras):
+    """
+    Aggregate frames/s and p95 latency of one config with every camera's workers busy
+    """
+    apply_process_settings(config)
+    total_workers = config['workers'] * cameras
+    models = [model_factory() for _ in range(total_workers)]
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(index):
+        pin_worker(config, index)
+        model = models[index]
+        for i in range(WARMUP_RUNS):
+            model(frames[i % len(frames)], verbose=False)
+        for i in range(TIMED_RUNS):
+            start = time.perf_counter()
+            model(frames[i % len(frames)], verbose=False)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(total_workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'fps': len(latencies) / elapsed,
+        'p95_ms': float(np.percentile(latencies, 95)) * 1000.0,
+    }
+
+
+def tune(model_path, frames, cameras):
+    """
+    Benchmark every candidate config and return the one with the best throughput
+    """
+    from ultralytics import YOLO
+
+    cpu_count = len(available_cpus())
+    best = None
+
+    for config in candidate_configs(cpu_count, cameras):
+        result = measure(lambda: YOLO(model_path), frames, config, cameras)
+        print(f"Autotune {config}: {result['fps']:.2f} fps, p95 {result['p95_ms']:.1f} ms")
+        if best is None or result['fps'] > best[1]['fps']:
+            best = (config, result)
+
+    config = dict(best[0], fps=round(best[1]['fps'], 3), p95_ms=round(best[1]['p95_ms'], 3),
+                  tuned_at=time.time())
+    print(f"Autotune selected {config}")
+    return config
+
+
+def load_or_tune(model_path, frames, cameras=1, retune=False):
+    """
+    Reuse the saved config for this host and model, benchmarking on first start
+    """
+    config = None if retune else load_cached(model_path, cameras)
+    if config is None:
+        config = tune(model_path, frames, cameras)
+        save_cached(model_path, cameras, config)
+    else:
+        print(f"Autotune using saved config {config}")
+    return config
+
+
+def collect_frames(cameras, count=4, timeout=10.0):
+    """
+    Grab warm-up frames from running CameraConnections.
+
+    Falls back to random frames at the standard resolution when the cameras
+    do not deliver in time, so tuning never blocks startup indefinitely.
+    """
+    frames = []
+    deadline = time.time() + timeout
+    seqs = {camera.name: 0 for camera in cameras}
+
+    while len(frames) < count and time.time() < deadline:
+        for camera in cameras:
+            seq, frame = camera.read(seqs[camera.name], timeout=0.5)
+            if frame is not None:
+                seqs[camera.name] = seq
+                frames.append(frame.copy())
+
+    if not frames:
+        print("Autotune: no camera frames, tuning on synthetic frames")
+        frames = [np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8) for _ in range(count)]
+    return frames[:count]
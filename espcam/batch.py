@@ -0,0 +1,376 @@
+"""
+Batch offline detection over stored images, MJPEG dumps and videos.
+
+Runs the CAM1 obstacle profile over recorded material (test-1/detections,
+clips saved by server.py, video files) without a camera or a window. A
+thread pool reads, decodes and resizes frames ahead of the model (video
+files are decoded in order on a reader thread of their own), frames are
+sent to YOLO in batches, and one record per frame is written as JSONL or,
+with pyarrow installed, Parquet:
+
+    {"source": "clips/cam1-.../segment-000.mjpeg", "frame": 12,
+     "detections": [{"class": "car", "confidence": 0.81,
+                     "bbox": [x1, y1, x2, y2], "distance": 3.42}]}
+
+Frames are resized to the standard 640x480 first, as the live servers do,
+so boxes and distances (calibrated in that pixel space) match what they
+report for the same frame; boxes are in 640x480 coordinates.
+
+Records are flushed as batches finish, and running the same command again
+skips frames that are already in the output, so an interrupted run resumes
+where it stopped.
+
+Usage:
+    python -m espcam.batch test-1/detections clips/ --output audit.jsonl
+    python -m espcam.batch drive.mp4 --output audit.parquet --batch 16
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from espcam import stages
+from espcam.benchmark import IMAGE_EXTENSIONS, MJPEG_EXTENSIONS, OBSTACLE_CLASSES, split_mjpeg
+
+PARQUET_PART_ROWS = 1000
+VIDEO_QUEUE_SIZE = 32   # decoded video frames waiting for the model at most
+
+
+def list_sources(paths):
+    """
+    Expand folders into the image, MJPEG and video files they contain
+    """
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in sorted(os.walk(path)):
+                for name in sorted(names):
+                    if name.lower().endswith(IMAGE_EXTENSIONS + MJPEG_EXTENSIONS):
+                        sources.append(os.path.join(root, name))
+        else:
+            sources.append(path)
+    return sources
+
+
+def read_video(source, done, depth=VIDEO_QUEUE_SIZE):
+    """
+    Yield (index, frame) of a video's frames not in done, decoded on a
+    reader thread into a bounded queue; frames already done are skipped
+    with grab(), without decoding
+    """
+    frames = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                frames.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        cap = cv2.VideoCapture(source)
+        try:
+            index = 0
+            while cap.isOpened():
+                if (source, index) in done:
+                    if not cap.grab():
+                        break
+                else:
+                    ret, frame = cap.read()
+                    if not ret or not put((index, frame)):
+                        break
+                index += 1
+        finally:
+            cap.release()
+            put(None)
+
+    thread = threading.Thread(target=read, name=f"video-{os.path.basename(source)}")
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is None:
+                return
+            yield item
+    finally:
+        stopped.set()  # the consumer stopped early, let the reader finish
+
+
+def iter_frames(sources, done):
+    """
+    Yield (source, frame index, loader) for every frame not in done.
+
+    Loaders run in the decode pool. Video frames can only be decoded in
+    order, so read_video decodes them ahead on a thread of their own and
+    their loader just returns them.
+    """
+    for source in sources:
+        lower = source.lower()
+        if lower.endswith(IMAGE_EXTENSIONS):
+            if (source, 0) not in done:
+                yield source, 0, lambda path=source: cv2.imread(path, cv2.IMREAD_COLOR)
+        elif lower.endswith(MJPEG_EXTENSIONS):
+            with open(source, 'rb') as f:
+                images = split_mjpeg(f.read())
+            for index, data in enumerate(images):
+                if (source, index) not in done:
+                    yield source, index, lambda data=data: stages.decode_jpeg(data)
+        else:
+            for index, frame in read_video(source, done):
+                yield source, index, lambda frame=frame: frame
+
+
+def load_standard(loader):
+    """
+    Run a loader and bring its frame to the standard resolution
+    """
+    frame = loader()
+    if frame is not None and frame.shape[:2] != (stages.STANDARD_HEIGHT, stages.STANDARD_WIDTH):
+        frame = stages.resize_frame(frame)
+    return frame
+
+
+def prefetch(frames, workers, depth):
+    """
+    Run the loaders in a thread pool, keeping up to depth frames in flight,
+    and yield (source, index, image) in order, at the standard resolution
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for source, index, loader in frames:
+            pending.append((source, index, pool.submit(load_standard, loader)))
+            if len(pending) >= depth:
+                source, index, future = pending.popleft()
+                yield source, index, future.result()
+        while pending:
+            source, index, future = pending.popleft()
+            yield source, index, future.result()
+
+
+def batches(frames, size):
+    batch = []
+    for item in frames:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def to_record(source, index, detections):
+    return {
+        'source': source,
+        'frame': index,
+        'detections': [{
+            'class': detection['class'],
+            'confidence': round(detection['confidence'], 4),
+            'bbox': list(detection['bbox']),
+            'distance': round(detection['adjusted_distance'], 3),
+        } for detection in detections],
+    }
+
+
+class JsonlWriter:
+    """
+    Appends one JSON line per frame, flushed after every batch
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def done(self):
+        """
+        (source, frame) of every complete line; a line cut short by an
+        interruption is dropped so it is processed again
+        """
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+
+        valid_bytes = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                done.add((record['source'], record['frame']))
+                valid_bytes += len(line)
+        if valid_bytes != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_bytes)
+        return done
+
+    def open(self):
+        self._file = open(self.path, 'a')
+
+    def write(self, records):
+        for record in records:
+            self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def parquet_schema():
+    """
+    Schema of every part, fixed so parts without detections (or with only
+    whole-number values) read back as one dataset
+    """
+    import pyarrow as pa
+
+    detection = pa.struct([
+        ('class', pa.string()),
+        ('confidence', pa.float64()),
+        ('bbox', pa.list_(pa.int32())),
+        ('distance', pa.float64()),
+    ])
+    return pa.schema([
+        ('source', pa.string()),
+        ('frame', pa.int64()),
+        ('detections', pa.list_(detection)),
+    ])
+
+
+class ParquetWriter:
+    """
+    Writes numbered part files into a directory; each part is renamed into
+    place once complete, so an interrupted run leaves only whole parts
+    """
+
+    def __init__(self, path, part_rows=PARQUET_PART_ROWS):
+        self.schema = parquet_schema()  # fails early with a clear ImportError without pyarrow
+        self.path = path
+        self.part_rows = part_rows
+        self._rows = []
+
+    def _parts(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if name.endswith('.parquet'))
+
+    def done(self):
+        import pyarrow.parquet as pq
+
+        done = set()
+        for name in self._parts():
+            table = pq.read_table(os.path.join(self.path, name), columns=['source', 'frame'])
+            done.update(zip(table.column('source').to_pylist(), table.column('frame').to_pylist()))
+        return done
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._next_part = len(self._parts())
+
+    def write(self, records):
+        self._rows.extend(records)
+        if len(self._rows) >= self.part_rows:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self._rows:
+            return
+        part = os.path.join(self.path, f"part-{self._next_part:05d}.parquet")
+        pq.write_table(pa.Table.from_pylist(self._rows, schema=self.schema), part + '.tmp')
+        os.replace(part + '.tmp', part)
+        self._next_part += 1
+        self._rows = []
+
+    def close(self):
+        self._flush()
+
+
+def make_writer(path, output_format=None):
+    output_format = output_format or ('parquet' if path.endswith('.parquet') else 'jsonl')
+    if output_format == 'parquet':
+        return ParquetWriter(path)
+    return JsonlWriter(path)
+
+
+def run(model, frames, writer, batch_size, predict_kwargs):
+    """
+    Detect over the frames in batches, returns the number of frames written
+    """
+    count = 0
+    for batch in batches(frames, batch_size):
+        images = [image for _, _, image in batch if image is not None]
+        results = iter(stages.run_inference(model, images, **predict_kwargs) if images else [])
+
+        records = []
+        for source, index, image in batch:
+            if image is None:
+                print(f"Warning: could not decode {source} frame {index}")
+                records.append(to_record(source, index, []))
+                continue
+            detections = stages.extract_detections([next(results)], model.names, None, stages.cam1_distance)
+            records.append(to_record(source, index, detections))
+
+        writer.write(records)
+        count += len(records)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run detection over stored images, MJPEG dumps and videos")
+    parser.add_argument('sources', nargs='+', help="image folders, image files, MJPEG dumps or video files")
+    parser.add_argument('--output', required=True, help="JSONL file, or a .parquet directory")
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], help="defaults from the output name")
+    parser.add_argument('--model', default='yolov8n.pt', help="model weights")
+    parser.add_argument('--imgsz', type=int, default=640, help="inference input size")
+    parser.add_argument('--conf', type=float, default=0.25, help="confidence threshold")
+    parser.add_argument('--all-classes', action='store_true', help="keep every class, not just obstacles")
+    parser.add_argument('--batch', type=int, default=8, help="frames per inference call")
+    parser.add_argument('--decode-workers', type=int, default=max(2, (os.cpu_count() or 1) // 4),
+                        help="threads reading and decoding frames ahead of the model")
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help="torch threads for inference")
+    args = parser.parse_args(argv)
+
+    try:
+        writer = make_writer(args.output, args.format)
+    except ImportError:
+        print("Error: Parquet output needs pyarrow (pip install pyarrow)", file=sys.stderr)
+        return 2
+
+    done = writer.done()
+    if done:
+        print(f"Resuming, {len(done)} frames already in {args.output}")
+
+    import torch
+    from ultralytics import YOLO
+
+    torch.set_num_threads(args.threads)
+    model = YOLO(args.model)
+    predict_kwargs = {'imgsz': args.imgsz, 'conf': args.conf, 'verbose': False,
+                      'classes': None if args.all_classes else OBSTACLE_CLASSES}
+
+    frames = prefetch(iter_frames(list_sources(args.sources), done), args.decode_workers,
+                      depth=args.batch * 2)
+    writer.open()
+    try:
+        count = run(model, frames, writer, args.batch, predict_kwargs)
+    finally:
+        writer.close()
+
+    print(f"Wrote {count} frames to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+Offline replay benchmark for the detection pipeline.
+
+Replays recorded frames (image folders such as test-1/detections, MJPEG
+dumps or video files) through the same stages the servers run and reports
+per-stage p50/p95/p99 latency and end-to-end FPS as JSON, so performance
+regressions can be caught on a CPU-only machine without an ESP32.
+
+Usage:
+    python -m espcam.benchmark test-1/detections --models yolov8n.pt yolov8m.pt
+    python -m espcam.benchmark dump.mjpeg --imgsz 640 320 --output bench.json
+    python -m espcam.benchmark test-1/detections --compare bench.json
+    python -m espcam.benchmark test-1/detections --preallocated   # test-1's input path
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from espcam import stages
+from espcam.preprocess import LetterboxBuffer
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+MJPEG_EXTENSIONS = ('.mjpeg', '.mjpg')
+
+STAGES = ['decode', 'resize', 'preprocess', 'inference', 'postprocess', 'draw', 'encode', 'serialize']
+
+# Same obstacle profile and distance estimate as CAM1 in test-1/test.py
+OBSTACLE_CLASSES = [0, 1, 2, 3, 5, 7]
+
+
+def split_mjpeg(data):
+    """
+    Split a raw MJPEG dump into individual JPEG images using SOI/EOI markers
+    """
+    frames = []
+    start = data.find(b'\xff\xd8')
+    while start != -1:
+        end = data.find(b'\xff\xd9', start + 2)
+        if end == -1:
+            break
+        frames.append(data[start:end + 2])
+        start = data.find(b'\xff\xd8', end + 2)
+    return frames
+
+
+def read_video(path):
+    """
+    Read a video file and re-encode its frames as JPEG, like an ESP32 stream
+    """
+    frames = []
+    cap = cv2.VideoCapture(path)
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if not ret:
+            break
+        data = stages.encode_jpeg(frame)
+        if data is not None:
+            frames.append(data)
+    cap.release()
+    return frames
+
+
+def load_frames(paths, limit=None):
+    """
+    Load JPEG bytes from image folders, image files, MJPEG dumps and videos
+    """
+    frames = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    with open(os.path.join(path, name), 'rb') as f:
+                        frames.append(f.read())
+        elif path.lower().endswith(MJPEG_EXTENSIONS):
+            with open(path, 'rb') as f:
+                frames.extend(split_mjpeg(f.read()))
+        elif path.lower().endswith(IMAGE_EXTENSIONS):
+            with open(path, 'rb') as f:
+                frames.append(f.read())
+        else:
+            frames.extend(read_video(path))
+
+    if limit:
+        frames = frames[:limit]
+    return frames
+
+
+def percentiles(samples):
+    """
+    Summarise a list of durations in seconds as milliseconds, None for
+    an empty list
+    """
+    if len(samples) == 0:
+        return None
+    values = np.asarray(samples) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'mean_ms': round(float(values.mean()), 3),
+    }
+
+
+def process_frame(model, data, timings, imgsz, input_buffer=None):
+    """
+    Run one frame through every stage, appending each stage's duration.
+    Returns False, recording nothing, for a frame that does not decode.
+
+    Without an input buffer ultralytics preprocesses the frame inside the
+    inference stage; with one the frame is letterboxed into it first.
+    """
+    t0 = time.perf_counter()
+    frame = stages.decode_jpeg(data)
+    if frame is None:
+        return False
+    t1 = time.perf_counter()
+    frame = stages.resize_frame(frame)
+    t2 = time.perf_counter()
+    model_input = frame if input_buffer is None else input_buffer.fill(frame)
+    t3 = time.perf_counter()
+    results = stages.run_inference(model, model_input, imgsz=imgsz, classes=OBSTACLE_CLASSES, verbose=False)
+    t4 = time.perf_counter()
+    detections = stages.extract_detections(results, model.names, None, stages.cam1_distance,
+                                           scale_box=input_buffer.scale_box if input_buffer else None)
+    t5 = time.perf_counter()
+    stages.draw_detections(frame, detections, (0, 0, 255))
+    t6 = time.perf_counter()
+    stages.encode_jpeg(frame)
+    t7 = time.perf_counter()
+    stages.serialize_detections(detections)
+    t8 = time.perf_counter()
+
+    marks = [t0, t1, t2, t3, t4, t5, t6, t7, t8]
+    for i, stage in enumerate(STAGES):
+        timings[stage].append(marks[i + 1] - marks[i])
+    timings['end_to_end'].append(t8 - t0)
+    return True
+
+
+def run_config(model_path, imgsz, frames, warmup, preallocated=False):
+    """
+    Benchmark one model / input size combination over the loaded frames
+    """
+    from ultralytics import YOLO
+
+    model = YOLO(model_path)
+    # Exported models only take the square input they were exported at
+    input_buffer = LetterboxBuffer(imgsz, square=not model_path.endswith('.pt')) if preallocated else None
+    timings = {stage: [] for stage in STAGES + ['end_to_end']}
+
+    # Warm-up frames are run but not recorded
+    scratch = {stage: [] for stage in STAGES + ['end_to_end']}
+    for data in frames[:warmup]:
+        process_frame(model, data, scratch, imgsz, input_buffer)
+
+    # Corrupt frames (truncated MJPEG parts) are skipped and counted
+    corrupt = 0
+    for data in frames:
+        if not process_frame(model, data, timings, imgsz, input_buffer):
+            corrupt += 1
+    if corrupt:
+        print(f"Warning: skipped {corrupt} frames that could not be decoded", file=sys.stderr)
+    if corrupt == len(frames):
+        print(f"Warning: no valid frames for {model_path}@{imgsz}", file=sys.stderr)
+
+    processed = len(frames) - corrupt
+    total = sum(timings['end_to_end'])
+    return {
+        'model': model_path,
+        'imgsz': imgsz,
+        'preallocated': preallocated,
+        'frames': processed,
+        'corrupt_frames': corrupt,
+        'fps': round(processed / total, 3) if total else 0.0,
+        'stages': {stage: percentiles(samples) for stage, samples in timings.items()},
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Compare a report against a baseline, returning a list of regressions
+    """
+    regressions = []
+    previous = {(run['model'], run['imgsz'], run.get('preallocated', False)): run
+                for run in baseline.get('runs', [])}
+
+    for run in report['runs']:
+        old = previous.get((run['model'], run['imgsz'], run.get('preallocated', False)))
+        if old is None:
+            continue
+
+        if not run['frames']:
+            if old.get('frames'):
+                regressions.append(f"{run['model']}@{run['imgsz']}: no valid frames")
+            continue
+        if run['fps'] < old['fps'] * (1 - tolerance):
+            regressions.append(f"{run['model']}@{run['imgsz']}: fps {old['fps']} -> {run['fps']}")
+
+        for stage, stats in run['stages'].items():
+            old_stats = old['stages'].get(stage)
+            if stats and old_stats and stats['p95_ms'] > old_stats['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{run['model']}@{run['imgsz']} {stage}: "
+                                   f"p95 {old_stats['p95_ms']}ms -> {stats['p95_ms']}ms")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded frames through the detection pipeline")
+    parser.add_argument('sources', nargs='+', help="image folders, image files, MJPEG dumps or video files")
+    parser.add_argument('--models', nargs='+', default=['yolov8n.pt'], help="model weights to benchmark")
+    parser.add_argument('--imgsz', nargs='+', type=int, default=[640], help="inference input sizes")
+    parser.add_argument('--preallocated', action='store_true',
+                        help="letterbox into a reusable input tensor, like test-1/test.py")
+    parser.add_argument('--frames', type=int, default=None, help="limit the number of frames replayed")
+    parser.add_argument('--warmup', type=int, default=5, help="frames run before timing starts")
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    parser.add_argument('--compare', help="baseline JSON report, exit 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    frames = load_frames(args.sources, args.frames)
+    if not frames:
+        print("Error: no frames found in the given sources", file=sys.stderr)
+        return 2
+
+    report = {
+        'host': platform.node(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.time(),
+        'runs': [run_config(model_path, imgsz, frames, args.warmup, args.preallocated)
+                 for model_path in args.models for imgsz in args.imgsz],
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""
+Shared camera connection manager.
+
+One CameraConnection per camera owns the cv2.VideoCapture in a background
+thread. When the stream drops it releases the capture and reconnects with
+exponential backoff and jitter, sleeping on an Event so an outage costs no
+CPU. Consumers wait for the next frame on a Condition instead of polling:
+
+    camera = get_camera('cam1', CAM1_URL)
+    seq = 0
+    while True:
+        frame_seq, frame = camera.read(seq, timeout=1.0)
+        if frame is None:
+            continue  # nothing new yet, the camera may be down
+        seq = frame_seq
+
+health() reports one of the states below for the API.
+"""
+import random
+import threading
+import time
+
+import cv2
+
+from espcam import metrics, tracing
+
+CONNECTING = 'connecting'
+LIVE = 'live'
+STALLED = 'stalled'
+DOWN = 'down'
+
+MIN_BACKOFF = 0.5       # seconds before the first reconnect attempt
+MAX_BACKOFF = 30.0      # upper bound for the reconnect delay
+STALL_TIMEOUT = 5.0     # seconds without a frame before a live camera is stalled
+OPEN_TIMEOUT_MS = 5000  # how long FFmpeg may take to open the stream
+READ_TIMEOUT_MS = 5000  # how long FFmpeg may block on a read
+
+
+def open_capture(url):
+    """
+    Open a VideoCapture with open/read timeouts when OpenCV supports them
+    """
+    if isinstance(url, int):
+        return cv2.VideoCapture(url)
+
+    open_timeout = getattr(cv2, 'CAP_PROP_OPEN_TIMEOUT_MSEC', None)
+    read_timeout = getattr(cv2, 'CAP_PROP_READ_TIMEOUT_MSEC', None)
+    if open_timeout is None or read_timeout is None:
+        return cv2.VideoCapture(url)
+    return cv2.VideoCapture(url, cv2.CAP_FFMPEG, [open_timeout, OPEN_TIMEOUT_MS, read_timeout, READ_TIMEOUT_MS])
+
+
+class CameraConnection:
+    """
+    Keeps one camera stream open and publishes its latest frame
+    """
+
+    def __init__(self, name, url, min_backoff=MIN_BACKOFF, max_backoff=MAX_BACKOFF,
+                 stall_timeout=STALL_TIMEOUT):
+        self.name = name
+        self.url = url
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stall_timeout = stall_timeout
+
+        self.state = CONNECTING
+        self.failures = 0
+        self.reconnects = 0
+        self.next_retry = None
+        self.fps = 0.0
+        self.frame_size = None      # (width, height) the stream actually delivers
+
+        self._frame = None
+        self._seq = 0
+        self._last_frame_time = None
+        self._last_frame_monotonic = None
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._reopen = threading.Event()
+        self._thread = None
+
+        self._frames_captured = metrics.FRAMES_CAPTURED.labels(name)
+        self._reconnects = metrics.CAPTURE_RECONNECTS.labels(name)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"camera-{self.name}")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def reopen(self):
+        """
+        Reconnect without backoff, e.g. after the camera's framesize changed
+        (FFmpeg keeps decoding to the size the stream was opened with)
+        """
+        self._reopen.set()
+
+    def backoff_delay(self):
+        """
+        Exponential backoff with jitter, so many cameras do not retry in lockstep
+        """
+        delay = min(self.max_backoff, self.min_backoff * (2 ** max(self.failures - 1, 0)))
+        return random.uniform(delay / 2, delay)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.state = CONNECTING
+            self.frame_size = None  # may change with the camera's framesize
+            cap = open_capture(self.url)
+
+            if cap.isOpened():
+                self._read_until_failure(cap)
+            else:
+                print(f"Error: Unable to open camera feed at {self.url}")
+            cap.release()
+
+            if self._stop.is_set():
+                break
+            if self._reopen.is_set():
+                self._reopen.clear()
+                continue
+
+            self.failures += 1
+            self.state = DOWN
+            delay = self.backoff_delay()
+            self.next_retry = time.time() + delay
+            self._stop.wait(delay)
+            self.next_retry = None
+            self.reconnects += 1
+            self._reconnects.inc()
+
+    def _read_until_failure(self, cap):
+        while not self._stop.is_set() and not self._reopen.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                print(f"Error: Could not read frame from {self.url}")
+                return
+
+            now = time.time()
+            with self._condition:
+                if self._last_frame_time is not None:
+                    interval = now - self._last_frame_time
+                    if interval > 0:
+                        self.fps = 0.9 * self.fps + 0.1 / interval
+                self._frame = frame
+                self.frame_size = (frame.shape[1], frame.shape[0])
+                self._seq += 1
+                self._last_frame_time = now
+                self._last_frame_monotonic = time.monotonic()
+                self._condition.notify_all()
+
+            self._frames_captured.inc()
+            self.state = LIVE
+            self.failures = 0
+
+    def read(self, last_seq=0, timeout=None):
+        """
+        Wait for a frame newer than last_seq.
+
+        Returns (seq, frame), or (last_seq, None) if nothing new arrived
+        within the timeout.
+        """
+        seq, frame, _ = self.read_timed(last_seq, timeout)
+        return seq, frame
+
+    def read_timed(self, last_seq=0, timeout=None):
+        """
+        Like read(), but returns (seq, frame, capture_time)
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._seq > last_seq, timeout):
+                return last_seq, None, None
+            return self._seq, self._frame, self._last_frame_time
+
+    def read_stamped(self, last_seq=0, timeout=None):
+        """
+        Like read(), but returns (seq, frame, stamps) with the frame's
+        tracing stamps (see espcam.tracing)
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._seq > last_seq, timeout):
+                return last_seq, None, None
+            return (self._seq, self._frame,
+                    tracing.new_stamps(self._seq, self._last_frame_time, self._last_frame_monotonic))
+
+    def health(self):
+        state = self.state
+        age = None
+        if self._last_frame_time is not None:
+            age = time.time() - self._last_frame_time
+            if state == LIVE and age > self.stall_timeout:
+                state = STALLED
+
+        return {
+            'name': self.name,
+            'url': self.url,
+            'state': state,
+            'fps': round(self.fps, 2),
+            'frame_size': self.frame_size,
+            'last_frame_age': round(age, 3) if age is not None else None,
+            'failures': self.failures,
+            'reconnects': self.reconnects,
+            'next_retry_in': round(max(self.next_retry - time.time(), 0), 3) if self.next_retry else None,
+        }
+
+
+_cameras = {}
+_cameras_lock = threading.Lock()
+
+
+def get_camera(name, url, **kwargs):
+    """
+    Return the running connection for a camera, starting it on first use
+    """
+    with _cameras_lock:
+        camera = _cameras.get(name)
+        if camera is None:
+            camera = _cameras[name] = CameraConnection(name, url, **kwargs).start()
+        return camera
+
+
+def release_camera(name):
+    """
+    Stop a camera's connection and forget it, e.g. when it moved to another host
+    """
+    with _cameras_lock:
+        camera = _cameras.pop(name, None)
+    if camera is not None:
+        camera.stop()
+
+
+def health():
+    """
+    Health of every managed camera, keyed by name
+    """
+    return {name: camera.health() for name, camera in list(_cameras.items())}
@@ -0,0 +1,328 @@
+"""
+Sharded inference across hosts.
+
+One CPU host runs YOLO for only a couple of cameras. With a coordinator,
+any number of worker hosts share the cameras:
+
+- workers register with the coordinator (POST /cluster/register) and send a
+  heartbeat every second (POST /cluster/heartbeat) with the load of each
+  camera they run; the answer to both is the set of cameras the worker
+  should be running, and the worker starts or stops pipelines to match;
+- the coordinator gives unassigned cameras to the worker with the most free
+  capacity, takes the cameras of workers that stop sending heartbeats away,
+  and moves a camera off a worker that reports it overloaded (dropping most
+  frames before inference) when another worker has room;
+- workers send their detections back (POST /cluster/report), and the
+  coordinator serves them as one /data, fusing cam1/cam2 as test-1 does;
+- the coordinator's /video_feed/<cam> is a gateway: one connection to the
+  worker currently running the camera, shared by every viewer, following
+  the camera when it moves.
+
+See cluster/coordinator.py and cluster/worker.py. Reports carry the
+worker's capture timestamps, so the hosts' clocks should be synchronised
+(NTP) for the fusion to pair frames.
+"""
+import threading
+import time
+
+import requests
+
+from espcam.pipeline import Latest
+
+HEARTBEAT_INTERVAL = 1.0
+WORKER_TIMEOUT = 5.0        # seconds without a heartbeat before a worker is dropped
+MOVE_COOLDOWN = 30.0        # seconds a moved camera stays put
+OVERLOAD_DROP_RATIO = 0.5   # share of frames dropped before inference that means overloaded
+REQUEST_TIMEOUT = 3.0
+
+JPEG_START = b'\xff\xd8'
+JPEG_END = b'\xff\xd9'
+
+
+class Coordinator:
+    """
+    Workers, their heartbeats and the camera -> worker assignments
+    """
+
+    def __init__(self, cameras, worker_timeout=WORKER_TIMEOUT, move_cooldown=MOVE_COOLDOWN):
+        self.cameras = cameras      # name -> {'url': ..., 'classes': [...]}
+        self.worker_timeout = worker_timeout
+        self.move_cooldown = move_cooldown
+
+        self.workers = {}           # id -> {'url', 'capacity', 'last_seen', 'load'}
+        self.assignments = {}       # camera -> worker id
+        self._moved = {}            # camera -> time it last moved
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+
+    def start(self):
+        """
+        Check for dead workers even when no heartbeat arrives
+        """
+        thread = threading.Thread(target=self._monitor, name="coordinator")
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def _monitor(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            self.rebalance()
+
+    def register(self, worker_id, url, capacity):
+        with self._lock:
+            self.workers[worker_id] = {'url': url.rstrip('/'), 'capacity': capacity,
+                                       'last_seen': time.monotonic(), 'load': {}}
+            print(f"Worker {worker_id} registered at {url} for {capacity} cameras")
+            self.rebalance()
+            return self.assigned(worker_id)
+
+    def heartbeat(self, worker_id, load):
+        """
+        Record a worker's load, returns its cameras or None if the worker
+        is unknown (it timed out and must register again)
+        """
+        with self._lock:
+            worker = self.workers.get(worker_id)
+            if worker is None:
+                return None
+            worker['last_seen'] = time.monotonic()
+            worker['load'] = load
+            self.rebalance()
+            return self.assigned(worker_id)
+
+    def assigned(self, worker_id):
+        with self._lock:
+            return {camera: self.cameras[camera] for camera, owner in self.assignments.items()
+                    if owner == worker_id}
+
+    def owners(self):
+        """
+        Camera -> worker id
+        """
+        with self._lock:
+            return dict(self.assignments)
+
+    def accepts(self, worker_id, camera):
+        """
+        Whether a report comes from the worker the camera is assigned to
+        """
+        return self.assignments.get(camera) == worker_id
+
+    def stream_url(self, camera):
+        """
+        Video feed of the camera on the worker running it, or None
+        """
+        with self._lock:
+            worker = self.workers.get(self.assignments.get(camera))
+            return f"{worker['url']}/video_feed/{camera}" if worker else None
+
+    def _free(self, worker_id):
+        used = sum(1 for owner in self.assignments.values() if owner == worker_id)
+        return self.workers[worker_id]['capacity'] - used
+
+    def _least_loaded(self, exclude=None):
+        candidates = [(self._free(worker_id), worker_id) for worker_id in self.workers if worker_id != exclude]
+        candidates = [candidate for candidate in candidates if candidate[0] > 0]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda candidate: (candidate[0], candidate[1]))[1]
+
+    def rebalance(self):
+        now = time.monotonic()
+        with self._lock:
+            # Workers that stopped sending heartbeats lose their cameras
+            for worker_id, worker in list(self.workers.items()):
+                if now - worker['last_seen'] > self.worker_timeout:
+                    print(f"Worker {worker_id} timed out")
+                    del self.workers[worker_id]
+            for camera, owner in list(self.assignments.items()):
+                if owner not in self.workers:
+                    del self.assignments[camera]
+
+            # One overloaded camera per worker moves to a worker with room
+            for worker_id, worker in list(self.workers.items()):
+                for camera, load in sorted(worker['load'].items()):
+                    if not load.get('overloaded') or self.assignments.get(camera) != worker_id:
+                        continue
+                    if now - self._moved.get(camera, -self.move_cooldown) < self.move_cooldown:
+                        continue
+                    target = self._least_loaded(exclude=worker_id)
+                    if target is not None:
+                        print(f"Moving {camera} from overloaded {worker_id} to {target}")
+                        self.assignments[camera] = target
+                        self._moved[camera] = now
+                        break
+
+            # Unassigned cameras go to the worker with the most room
+            for camera in self.cameras:
+                if camera not in self.assignments:
+                    target = self._least_loaded()
+                    if target is None:
+                        break
+                    print(f"Assigning {camera} to {target}")
+                    self.assignments[camera] = target
+                    self._moved[camera] = now
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'workers': {worker_id: {'url': worker['url'], 'capacity': worker['capacity'],
+                                        'last_seen': round(now - worker['last_seen'], 3), 'load': worker['load']}
+                            for worker_id, worker in self.workers.items()},
+                'assignments': dict(self.assignments),
+                'unassigned': [camera for camera in self.cameras if camera not in self.assignments],
+            }
+
+
+class WorkerAgent:
+    """
+    Worker side: registers, sends heartbeats and keeps the assigned cameras
+    running through start_camera(name, config) / stop_camera(name)
+    """
+
+    def __init__(self, coordinator_url, worker_id, url, capacity, start_camera, stop_camera, load,
+                 interval=HEARTBEAT_INTERVAL):
+        self.coordinator_url = coordinator_url.rstrip('/')
+        self.worker_id = worker_id
+        self.url = url
+        self.capacity = capacity
+        self.start_camera = start_camera
+        self.stop_camera = stop_camera
+        self.load = load            # load() -> {camera: {...}} for the heartbeat
+        self.interval = interval
+
+        self.cameras = {}
+        self.registered = False
+        self._lock = threading.Lock()   # the agent thread and drop() both change self.cameras
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name="worker-agent")
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def _post(self, session, path, payload):
+        return session.post(f"{self.coordinator_url}{path}", json=payload, timeout=REQUEST_TIMEOUT)
+
+    def _run(self):
+        session = requests.Session()
+        while True:
+            try:
+                if not self.registered:
+                    response = self._post(session, '/cluster/register', {
+                        'worker': self.worker_id, 'url': self.url, 'capacity': self.capacity})
+                else:
+                    response = self._post(session, '/cluster/heartbeat', {
+                        'worker': self.worker_id, 'load': self.load()})
+
+                if response.status_code == 404:
+                    self.registered = False  # the coordinator forgot us, register again
+                    continue
+                response.raise_for_status()
+                self.registered = True
+                self._reconcile(response.json()['cameras'])
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                # Keep running the current cameras until the coordinator is back
+                print(f"Coordinator unreachable: {e}")
+            time.sleep(self.interval)
+
+    def _reconcile(self, cameras):
+        with self._lock:
+            for name in list(self.cameras):
+                if name not in cameras or cameras[name] != self.cameras[name]:
+                    print(f"Stopping {name}")
+                    self.stop_camera(name)
+                    del self.cameras[name]
+            for name, config in cameras.items():
+                if name not in self.cameras:
+                    print(f"Starting {name}")
+                    self.start_camera(name, config)
+                    self.cameras[name] = config
+
+    def drop(self, name):
+        """
+        Stop a camera the coordinator refused results of, without waiting
+        for the next heartbeat; it starts again if it is assigned back
+        """
+        with self._lock:
+            if self.cameras.pop(name, None) is not None:
+                print(f"Stopping {name}, it moved to another worker")
+                self.stop_camera(name)
+
+    def reporter(self, camera):
+        """
+        Function sending one camera's results to the coordinator, with its
+        own connection; returns False if the camera is no longer ours, the
+        caller should drop() it then
+        """
+        session = requests.Session()
+
+        def report(payload):
+            try:
+                response = self._post(session, '/cluster/report', dict(payload, worker=self.worker_id,
+                                                                       camera=camera))
+            except requests.exceptions.RequestException as e:
+                print(f"Error reporting {camera}: {e}")
+                return True
+            return response.status_code != 409
+
+        return report
+
+
+class StreamGateway:
+    """
+    One upstream MJPEG connection per camera, to whichever worker runs it,
+    shared by every viewer of the coordinator
+    """
+
+    def __init__(self, locate):
+        self.locate = locate        # locate(camera) -> stream URL or None
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def latest(self, camera):
+        """
+        Latest JPEG of a camera, connecting upstream on first use
+        """
+        with self._lock:
+            latest = self._latest.get(camera)
+            if latest is None:
+                latest = self._latest[camera] = Latest()
+                thread = threading.Thread(target=self._relay, args=(camera, latest), name=f"gateway-{camera}")
+                thread.daemon = True
+                thread.start()
+            return latest
+
+    def _relay(self, camera, latest):
+        while True:
+            url = self.locate(camera)
+            if url is None:
+                time.sleep(HEARTBEAT_INTERVAL)
+                continue
+            try:
+                self._read_stream(camera, url, latest)
+            except requests.exceptions.RequestException as e:
+                print(f"Gateway lost {camera} at {url}: {e}")
+                time.sleep(HEARTBEAT_INTERVAL)
+
+    def _read_stream(self, camera, url, latest):
+        with requests.get(url, stream=True, timeout=(REQUEST_TIMEOUT, REQUEST_TIMEOUT)) as response:
+            response.raise_for_status()
+            buffer = b''
+            checked = time.monotonic()
+            for chunk in response.iter_content(chunk_size=16384):
+                buffer += chunk
+                start = buffer.find(JPEG_START)
+                end = buffer.find(JPEG_END, start + 2) if start != -1 else -1
+                while start != -1 and end != -1:
+                    latest.publish(buffer[start:end + 2])
+                    buffer = buffer[end + 2:]
+                    start = buffer.find(JPEG_START)
+                    end = buffer.find(JPEG_END, start + 2) if start != -1 else -1
+
+                if time.monotonic() - checked >= HEARTBEAT_INTERVAL:
+                    # Follow the camera when it moves to another worker
+                    if self.locate(camera) != url:
+                        return
+                    checked = time.monotonic()
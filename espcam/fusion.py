@@ -0,0 +1,186 @@
+"""
+Time-aligned fusion of the two cameras' closest distances.
+
+Each camera pushes its detections with the frame's capture timestamp. The
+closest distance is computed once when the frame arrives and kept in a small
+per-camera ring buffer. The fused total_distance pairs the newest frame with
+the other camera's frame nearest in time, as long as the two are no more
+than max_skew seconds apart, and ignores cameras whose newest frame is older
+than max_age seconds.
+
+Each camera's part of the result also carries the trace of the frame it
+came from (sequence number, capture time and its age at each point, see
+espcam.tracing) as cam1_frame / cam2_frame.
+
+A camera can also have a range sensor next to it: measured(camera) returns
+its fresh reading (e.g. from an espcam.telemetry.LatestTable) or None, and
+snapshot() uses a reading instead of the vision estimate, marking it in
+cam1_distance_source / cam2_distance_source.
+"""
+import threading
+import time
+from collections import deque
+
+from espcam import tracing
+
+MAX_SKEW = 0.5     # seconds two frames may be apart to be fused
+MAX_AGE = 2.0      # seconds after which a camera's detections are stale
+HISTORY = 32       # frames kept per camera
+
+
+def closest_distance(detections):
+    """
+    Smallest adjusted distance in a list of detections (None if empty)
+    """
+    closest = None
+    for detection in detections:
+        distance = detection['adjusted_distance']
+        if closest is None or distance < closest:
+            closest = distance
+    return closest
+
+
+class FusionEngine:
+    """
+    Keeps per-camera rings of (timestamp, closest_distance, detections, trace)
+    """
+
+    def __init__(self, obstacle_camera, vehicle_camera, camera_distance,
+                 max_skew=MAX_SKEW, max_age=MAX_AGE, history=HISTORY, measured=None):
+        self.obstacle_camera = obstacle_camera
+        self.vehicle_camera = vehicle_camera
+        self.camera_distance = camera_distance
+        self.max_skew = max_skew
+        self.max_age = max_age
+        self.measured = measured    # measured(camera) -> range sensor distance or None
+
+        self._rings = {obstacle_camera: deque(maxlen=history), vehicle_camera: deque(maxlen=history)}
+        self._lock = threading.Lock()
+        self._fused = self._combine(None, None, time.time())
+        self.version = 0  # bumped whenever the fused result changes
+
+    def _nearest(self, camera, timestamp):
+        """
+        Entry of a camera nearest to timestamp within max_skew, or None
+        """
+        best = None
+        for entry in reversed(self._rings[camera]):
+            skew = abs(entry[0] - timestamp)
+            if skew <= self.max_skew and (best is None or skew < abs(best[0] - timestamp)):
+                best = entry
+            if entry[0] < timestamp - self.max_skew:
+                break  # the ring is in time order, older entries are further away
+        return best
+
+    def _latest(self, camera, now):
+        ring = self._rings[camera]
+        if ring and now - ring[-1][0] <= self.max_age:
+            return ring[-1]
+        return None
+
+    def update(self, camera, timestamp, detections, stamps=None):
+        """
+        Add one processed frame and return the new fused result
+        """
+        entry = (timestamp, closest_distance(detections), detections, tracing.summary(stamps))
+        now = time.time()
+
+        with self._lock:
+            ring = self._rings[camera]
+            if ring and timestamp < ring[-1][0]:
+                # With several inference workers frames can finish out of
+                # order. Late frames are kept for pairing, in capture order,
+                # but do not replace a newer result
+                position = len(ring)
+                while position > 0 and ring[position - 1][0] > timestamp:
+                    position -= 1
+                if len(ring) == ring.maxlen:
+                    ring.popleft()
+                    position -= 1
+                if position >= 0:
+                    ring.insert(position, entry)
+                return self._fused
+            ring.append(entry)
+            self.version += 1
+
+            other = self.vehicle_camera if camera == self.obstacle_camera else self.obstacle_camera
+            partner = self._nearest(other, timestamp)
+            paired = partner is not None
+            if not paired:
+                # Nothing close enough in time, fall back to the other camera's
+                # newest frame if it is still fresh
+                partner = self._latest(other, now)
+
+            if camera == self.obstacle_camera:
+                self._fused = self._combine(entry, partner, now, paired)
+            else:
+                self._fused = self._combine(partner, entry, now, paired)
+            return self._fused
+
+    def _combine(self, obstacle, vehicle, now, paired=False):
+        obstacle_distance = obstacle[1] if obstacle and obstacle[1] is not None else 0
+        vehicle_distance = vehicle[1] if vehicle and vehicle[1] is not None else 0
+
+        return {
+            'cam1_detections': obstacle[2] if obstacle else [],
+            'cam2_detections': vehicle[2] if vehicle else [],
+            'closest_obstacle_distance': obstacle_distance,
+            'closest_vehicle_distance': vehicle_distance,
+            'camera_distance': self.camera_distance,
+            'total_distance': obstacle_distance + vehicle_distance + self.camera_distance,
+            'cam1_timestamp': obstacle[0] if obstacle else None,
+            'cam2_timestamp': vehicle[0] if vehicle else None,
+            'cam1_frame': obstacle[3] if obstacle else None,
+            'cam2_frame': vehicle[3] if vehicle else None,
+            'skew': abs(obstacle[0] - vehicle[0]) if obstacle and vehicle else None,
+            'paired': paired,
+            'timestamp': now
+        }
+
+    def _stale(self, fused, now):
+        return [camera for camera, key in ((self.obstacle_camera, 'cam1_timestamp'),
+                                           (self.vehicle_camera, 'cam2_timestamp'))
+                if fused[key] is None or now - fused[key] > self.max_age]
+
+    def stale_cameras(self):
+        """
+        Cameras whose newest fused frame is older than max_age
+        """
+        return self._stale(self._fused, time.time())
+
+    def measured_distances(self):
+        """
+        (camera, distance) of each camera with a fresh range sensor reading
+        """
+        if self.measured is None:
+            return ()
+        readings = ((camera, self.measured(camera)) for camera in (self.obstacle_camera, self.vehicle_camera))
+        return tuple((camera, distance) for camera, distance in readings if distance is not None)
+
+    def snapshot(self):
+        """
+        Latest fused result, with cameras marked stale if they stopped updating
+        """
+        now = time.time()
+        with self._lock:
+            fused = dict(self._fused)
+
+        stale = self._stale(fused, now)
+        fused['stale'] = stale
+        if self.obstacle_camera in stale:
+            fused['closest_obstacle_distance'] = 0
+            fused['cam1_detections'] = []
+        if self.vehicle_camera in stale:
+            fused['closest_vehicle_distance'] = 0
+            fused['cam2_detections'] = []
+
+        keys = {self.obstacle_camera: ('closest_obstacle_distance', 'cam1_distance_source'),
+                self.vehicle_camera: ('closest_vehicle_distance', 'cam2_distance_source')}
+        fused['cam1_distance_source'] = fused['cam2_distance_source'] = 'camera'
+        for camera, distance in self.measured_distances():
+            distance_key, source_key = keys[camera]
+            fused[distance_key] = distance
+            fused[source_key] = 'sensor'
+        fused['total_distance'] = (fused['closest_obstacle_distance'] + fused['closest_vehicle_distance']
+                                   + self.camera_distance)
+        return fused
@@ -0,0 +1,221 @@
+"""
+Where people and vehicles show up in each camera's view, kept up to date
+as frames are processed instead of recomputed from saved detections.
+
+Each camera has a grid of CELL-pixel cells per class. Every processed frame
+adds its boxes' centres to the grids with one vectorised np.add.at per
+class, and the grids are kept three ways:
+
+- 'decay': exponentially decayed, a detection loses half its weight every
+  half_life seconds;
+- rolling windows ('1m', '5m', '15m'): the frame's counts also go into a
+  BUCKET_SECONDS bucket, and each window keeps a running sum that buckets
+  are added to and subtracted from as they enter and leave it;
+- 'total': everything since start.
+
+Reading a grid is a copy, nothing is re-summed, so /heatmap can be asked
+at any moment:
+
+    heatmap = OccupancyHeatmap('cam1')
+    heatmap.update(detections, capture_time)          # from the pipeline
+    png = heatmap.png('person', '5m')
+    counts = heatmap.counters()
+
+The class 'all' sums every class.
+"""
+import io
+import math
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from espcam import stages
+
+CELL = 16               # pixels per grid cell
+HALF_LIFE = 60.0        # seconds for the decayed grid to halve
+BUCKET_SECONDS = 10.0
+WINDOWS = {'1m': 60.0, '5m': 300.0, '15m': 900.0}
+DECAY = 'decay'
+TOTAL = 'total'
+ALL = 'all'
+
+
+class OccupancyHeatmap:
+    """
+    Per-class occupancy grids of one camera
+    """
+
+    def __init__(self, camera, width=stages.STANDARD_WIDTH, height=stages.STANDARD_HEIGHT, cell=CELL,
+                 half_life=HALF_LIFE, windows=WINDOWS, bucket_seconds=BUCKET_SECONDS):
+        self.camera = camera
+        self.width = width
+        self.height = height
+        self.cell = cell
+        self.half_life = half_life
+        self.windows = dict(windows)
+        self.bucket_seconds = bucket_seconds
+        self.shape = (math.ceil(height / cell), math.ceil(width / cell))
+
+        self.version = 0
+        self.frames = 0
+        self._decayed = {}              # class -> grid
+        self._totals = {}               # class -> grid
+        self._window_sums = {name: {} for name in self.windows}  # window -> class -> grid
+        self._buckets = deque()         # (start, {class: grid}, windows it left), oldest first
+        self._last_update = None
+        self._last_counts = {}          # class -> objects in the newest frame
+        self._lock = threading.Lock()
+        self._png_cache = {}
+
+    def _grid(self, grids, cls):
+        grid = grids.get(cls)
+        if grid is None:
+            grid = grids[cls] = np.zeros(self.shape, dtype=np.float32)
+        return grid
+
+    def _frame_counts(self, detections):
+        """
+        {class: grid} of this frame's box centres, including ALL
+        """
+        if not detections:
+            return {}
+        boxes = np.asarray([detection['bbox'] for detection in detections], dtype=np.float32)
+        rows = np.clip(((boxes[:, 1] + boxes[:, 3]) / 2 // self.cell).astype(np.intp), 0, self.shape[0] - 1)
+        cols = np.clip(((boxes[:, 0] + boxes[:, 2]) / 2 // self.cell).astype(np.intp), 0, self.shape[1] - 1)
+        classes = np.asarray([detection['class'] for detection in detections])
+
+        counts = {}
+        for cls in np.unique(classes):
+            mask = classes == cls
+            grid = np.zeros(self.shape, dtype=np.float32)
+            np.add.at(grid, (rows[mask], cols[mask]), 1.0)
+            counts[str(cls)] = grid
+        everything = np.zeros(self.shape, dtype=np.float32)
+        np.add.at(everything, (rows, cols), 1.0)
+        counts[ALL] = everything
+        return counts
+
+    def _expire(self, now):
+        """
+        Take each bucket out of the running sum of every window it just
+        left, and drop buckets older than the longest window
+        """
+        shortest = min(self.windows.values(), default=0.0)
+        for start, grids, left in self._buckets:
+            if start + self.bucket_seconds > now - shortest:
+                break  # newer buckets are still in every window
+            for name, seconds in self.windows.items():
+                if name not in left and start + self.bucket_seconds <= now - seconds:
+                    sums = self._window_sums[name]
+                    for cls, grid in grids.items():
+                        sums[cls] -= grid
+                    left.add(name)
+                    self.version += 1
+        while self._buckets and len(self._buckets[0][2]) == len(self.windows):
+            self._buckets.popleft()
+
+    def _decay_factor(self, now):
+        if self._last_update is None or now <= self._last_update:
+            return 1.0
+        return 0.5 ** ((now - self._last_update) / self.half_life)
+
+    def update(self, detections, timestamp=None):
+        now = time.time() if timestamp is None else timestamp
+        counts = self._frame_counts(detections)
+
+        with self._lock:
+            factor = self._decay_factor(now)
+            if factor != 1.0:
+                for grid in self._decayed.values():
+                    grid *= factor
+            self._last_update = now if self._last_update is None else max(now, self._last_update)
+
+            if not self._buckets or now >= self._buckets[-1][0] + self.bucket_seconds:
+                self._buckets.append((now - now % self.bucket_seconds, {}, set()))
+            bucket = self._buckets[-1][1]
+
+            for cls, grid in counts.items():
+                self._grid(self._decayed, cls)[...] += grid
+                self._grid(self._totals, cls)[...] += grid
+                self._grid(bucket, cls)[...] += grid
+                for sums in self._window_sums.values():
+                    self._grid(sums, cls)[...] += grid
+            self._expire(self._last_update)
+
+            self._last_counts = {cls: int(grid.sum()) for cls, grid in counts.items()}
+            self.frames += 1
+            self.version += 1
+
+    def grid(self, cls=ALL, window=DECAY):
+        """
+        Copy of one class's grid, raises ValueError for an unknown window
+        """
+        return self._read(cls, window)[1]
+
+    def _read(self, cls, window):
+        with self._lock:
+            self._expire(time.time())  # windows also move on without new frames
+            if window == DECAY:
+                grids = self._decayed
+            elif window == TOTAL:
+                grids = self._totals
+            elif window in self._window_sums:
+                grids = self._window_sums[window]
+            else:
+                raise ValueError(f"unknown window {window}, use {DECAY}, {TOTAL} or one of {', '.join(self.windows)}")
+            grid = grids.get(cls)
+            if grid is None:
+                return self.version, np.zeros(self.shape, dtype=np.float32)
+            if window == DECAY:
+                return self.version, grid * self._decay_factor(time.time())  # decayed up to now
+            return self.version, grid.copy()
+
+    def counters(self):
+        """
+        Objects per class in the newest frame, each window and in total
+        """
+        with self._lock:
+            self._expire(time.time())
+            classes = sorted(self._totals)
+            factor = self._decay_factor(time.time())
+            return {
+                'camera': self.camera,
+                'frames': self.frames,
+                'cell': self.cell,
+                'shape': list(self.shape),
+                'current': dict(self._last_counts),
+                'total': {cls: int(round(float(self._totals[cls].sum()))) for cls in classes},
+                'windows': {name: {cls: int(round(float(sums[cls].sum()))) for cls in classes if cls in sums}
+                            for name, sums in self._window_sums.items()},
+                'decay': {cls: round(float(self._decayed[cls].sum()) * factor, 2) for cls in classes},
+            }
+
+    def npy(self, cls=ALL, window=DECAY):
+        buffer = io.BytesIO()
+        np.save(buffer, self.grid(cls, window))
+        return buffer.getvalue()
+
+    def png(self, cls=ALL, window=DECAY):
+        """
+        Colour-mapped grid at the camera's resolution, rendered once per
+        version of the grids (scaled to the hottest cell, so decay since the
+        last frame does not change it)
+        """
+        version, grid = self._read(cls, window)
+        key = (cls, window)
+        cached = self._png_cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        peak = float(grid.max())
+        scaled = np.zeros(grid.shape, dtype=np.uint8) if peak <= 0 else (grid * (255.0 / peak)).astype(np.uint8)
+        image = cv2.applyColorMap(cv2.resize(scaled, (self.width, self.height), interpolation=cv2.INTER_LINEAR),
+                                  cv2.COLORMAP_JET)
+        ok, buffer = cv2.imencode('.png', image)
+        if not ok:
+            raise RuntimeError("PNG encoding failed")
+        self._png_cache[key] = (version, buffer.tobytes())
+        return self._png_cache[key][1]
@@ -0,0 +1,212 @@
+"""
+Incremental detection for fixed cameras: only re-run the model where the
+picture changed.
+
+The frame is split into a grid of tiles and each tile gets a change score,
+the mean absolute grey-level difference from the frame it was last inferred
+on. Neighbouring changed tiles are grouped into regions, each region is cut
+out with a border of context around it, and the crops are sent to the model
+in one batch, at an input size proportional to the crop. Detections centred
+inside a re-inferred region replace the cached ones there; cached detections
+elsewhere are kept. A still scene costs almost nothing, a busy one falls
+back to a full-frame pass:
+
+    tiled = TiledDetector(predict, camera='cam1')
+    detections = tiled.detect(frame, imgsz=640)
+
+predict(images, imgsz) runs the model on a list of images and returns a
+list of detection lists (as built by stages.extract_detections) in each
+image's own coordinates. A full-frame pass calls it with [frame].
+
+The whole frame is still inferred every refresh_seconds, so slow drifts
+(light, an object creeping across tiles) cannot leave stale boxes behind.
+"""
+import math
+import time
+
+import cv2
+import numpy as np
+
+from espcam import metrics
+
+TILE_SIZE = 80           # tile side in frame pixels
+BORDER = 32              # context added around each re-inferred region
+CHANGE_THRESHOLD = 6.0   # mean grey-level difference that marks a tile changed
+FULL_FRACTION = 0.5      # above this share of the frame in crops, infer it whole
+REFRESH_SECONDS = 5.0    # full-frame pass at least this often
+SCORE_SCALE = 4          # change scores are computed on a frame this much smaller
+MERGE_IOU = 0.5          # same-class boxes overlapping this much are duplicates
+STRIDE = 32
+MIN_IMGSZ = 64
+
+
+def box_iou(a, b):
+    """
+    Intersection over union of two (x1, y1, x2, y2) boxes
+    """
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    inter = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def merge_detections(detections, iou=MERGE_IOU):
+    """
+    Drop same-class duplicates (an object seen in two crops, or both cached
+    and re-detected), keeping the most confident box
+    """
+    kept = []
+    for detection in sorted(detections, key=lambda d: d['confidence'], reverse=True):
+        if all(other['class'] != detection['class'] or box_iou(other['bbox'], detection['bbox']) < iou
+               for other in kept):
+            kept.append(detection)
+    return kept
+
+
+def center(bbox):
+    return (bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2
+
+
+def inside(point, rect):
+    return rect[0] <= point[0] < rect[2] and rect[1] <= point[1] < rect[3]
+
+
+class TiledDetector:
+    """
+    Cached detections of one camera, refreshed tile region by tile region
+    """
+
+    def __init__(self, predict, camera=None, tile_size=TILE_SIZE, border=BORDER, threshold=CHANGE_THRESHOLD,
+                 full_fraction=FULL_FRACTION, refresh_seconds=REFRESH_SECONDS):
+        self.predict = predict
+        self.tile_size = tile_size
+        self.border = border
+        self.threshold = threshold
+        self.full_fraction = full_fraction
+        self.refresh_seconds = refresh_seconds
+        if tile_size % SCORE_SCALE:
+            raise ValueError(f"tile_size must be a multiple of {SCORE_SCALE}")
+
+        self.detections = []
+        self.scores = None  # change score of every tile on the last frame
+        self._reference = None
+        self._frame_shape = None
+        self._imgsz = None
+        self._last_full = 0.0
+
+        camera = camera or 'default'
+        self._tiles_inferred = metrics.TILES.labels(camera, 'inferred')
+        self._tiles_reused = metrics.TILES.labels(camera, 'reused')
+
+    def reset(self):
+        """
+        Forget the cache (the model or its settings changed), the next frame
+        is inferred whole
+        """
+        self._frame_shape = None
+
+    def _grey(self, frame):
+        height, width = frame.shape[:2]
+        small = cv2.resize(frame, (max(1, width // SCORE_SCALE), max(1, height // SCORE_SCALE)),
+                           interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def _tile_scores(self, grey):
+        """
+        Mean absolute difference from the reference, per tile
+        """
+        rows, cols = self._grid
+        step = self.tile_size // SCORE_SCALE
+        diff = cv2.absdiff(grey, self._reference)
+        diff = cv2.copyMakeBorder(diff, 0, rows * step - diff.shape[0], 0, cols * step - diff.shape[1],
+                                  cv2.BORDER_REPLICATE)
+        return diff.reshape(rows, step, cols, step).mean(axis=(1, 3))
+
+    def _regions(self, changed):
+        """
+        (core, crop) rectangles in frame pixels for each group of touching
+        changed tiles; crop is core plus the border, clipped to the frame
+        """
+        height, width = self._frame_shape
+        count, _, stats, _ = cv2.connectedComponentsWithStats(changed.astype(np.uint8), connectivity=8)
+        regions = []
+        for x, y, w, h in stats[1:count, :4].tolist():
+            core = (x * self.tile_size, y * self.tile_size,
+                    min((x + w) * self.tile_size, width), min((y + h) * self.tile_size, height))
+            crop = (max(core[0] - self.border, 0), max(core[1] - self.border, 0),
+                    min(core[2] + self.border, width), min(core[3] + self.border, height))
+            regions.append((core, crop))
+        return regions
+
+    def _crop_imgsz(self, crops, imgsz):
+        """
+        Input size keeping the crops at the scale a full-frame pass would see them
+        """
+        ratio = imgsz / max(self._frame_shape)
+        longest = max(max(x2 - x1, y2 - y1) for x1, y1, x2, y2 in crops)
+        return min(imgsz, max(MIN_IMGSZ, math.ceil(longest * ratio / STRIDE) * STRIDE))
+
+    def _full(self, frame, grey, imgsz, now):
+        self.detections = self.predict([frame], imgsz)[0]
+        self._reference = grey
+        self._last_full = now
+        self._tiles_inferred.inc(self.scores.size)
+        return self.detections
+
+    def detect(self, frame, imgsz):
+        """
+        Detections for this frame, re-inferring only the regions that changed
+        """
+        now = time.monotonic()
+        grey = self._grey(frame)
+        height, width = frame.shape[:2]
+
+        if frame.shape[:2] != self._frame_shape or imgsz != self._imgsz:
+            self._frame_shape = frame.shape[:2]
+            self._grid = (math.ceil(height / self.tile_size), math.ceil(width / self.tile_size))
+            self._imgsz = imgsz
+            self.scores = np.zeros(self._grid, dtype=np.float32)
+            return self._full(frame, grey, imgsz, now)
+
+        self.scores = self._tile_scores(grey)
+        if now - self._last_full >= self.refresh_seconds:
+            return self._full(frame, grey, imgsz, now)
+
+        changed = self.scores > self.threshold
+        inferred = int(changed.sum())
+        if not inferred:
+            self._tiles_reused.inc(changed.size)
+            return self.detections
+
+        regions = self._regions(changed)
+        crops = [crop for _, crop in regions]
+        crop_area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in crops)
+        if crop_area > self.full_fraction * height * width:
+            return self._full(frame, grey, imgsz, now)
+
+        images = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in crops]
+        results = self.predict(images, self._crop_imgsz(crops, imgsz))
+        self._tiles_inferred.inc(inferred)
+        self._tiles_reused.inc(changed.size - inferred)
+
+        cores = [core for core, _ in regions]
+        fresh = []
+        for (core, (x1, y1, _, _)), detections in zip(regions, results):
+            for detection in detections:
+                bx1, by1, bx2, by2 = detection['bbox']
+                bbox = (bx1 + x1, by1 + y1, bx2 + x1, by2 + y1)
+                # Objects centred in the border belong to a neighbouring region or the cache
+                if inside(center(bbox), core):
+                    fresh.append(dict(detection, bbox=bbox))
+        cached = [detection for detection in self.detections
+                  if not any(inside(center(detection['bbox']), core) for core in cores)]
+        self.detections = merge_detections(cached + fresh)
+
+        # Changed tiles now compare against this frame
+        step = self.tile_size // SCORE_SCALE
+        mask = changed.repeat(step, axis=0).repeat(step, axis=1)[:grey.shape[0], :grey.shape[1]]
+        np.copyto(self._reference, grey, where=mask)
+        return self.detections
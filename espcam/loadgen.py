@@ -0,0 +1,212 @@
+"""
+Load generator for the detection servers.
+
+Starts N simulated ESP32-CAMs (see espcam.simulator) and M simulated viewers
+that read a server's MJPEG feed, then reports as JSON the throughput the
+server sustained and the capture-to-viewer latency of its frames, from the
+X-Capture-Time header each part carries (see espcam.tracing; the server and
+the load generator share a clock when they run on one machine).
+
+The servers read their camera URLs from the environment, and the cameras
+have to keep running while the server is under test, so start them on their
+own and attach the viewers with --cameras 0:
+
+    python -m espcam.loadgen test-1/detections --cameras 2 --print-env
+    CAM1_URL=http://127.0.0.1:9001/stream CAM2_URL=http://127.0.0.1:9003/stream python test.py
+    python -m espcam.loadgen --cameras 0 --viewers 8 \\
+        --target http://127.0.0.1:5000/video_feed/cam1 --duration 60
+
+Servers whose camera URLs are already set can also be tested from one
+process: --cameras 2 --target ... starts the cameras and the viewers
+together.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+
+from espcam import simulator
+from espcam.benchmark import load_frames, percentiles
+
+JPEG_START = b'\xff\xd8'
+JPEG_END = b'\xff\xd9'
+CAPTURE_TIME_HEADER = b'X-Capture-Time:'
+
+
+def capture_time(part_head):
+    """
+    Wall-clock capture time from the headers in front of a JPEG, or None
+    """
+    start = part_head.rfind(CAPTURE_TIME_HEADER)
+    if start == -1:
+        return None
+    line = part_head[start + len(CAPTURE_TIME_HEADER):].split(b'\r\n', 1)[0]
+    try:
+        return float(line.strip())
+    except ValueError:
+        return None
+
+
+class Viewer(threading.Thread):
+    """
+    Reads an MJPEG feed and records when each complete frame arrived and
+    how long after its capture
+    """
+
+    def __init__(self, url, deadline):
+        super().__init__(daemon=True)
+        self.url = url
+        self.deadline = deadline
+        self.arrivals = []
+        self.latencies = []     # capture to arrival, for parts with X-Capture-Time
+        self.bytes_received = 0
+        self.first_frame = None
+        self.errors = 0
+
+    def run(self):
+        while time.time() < self.deadline:
+            started = time.perf_counter()
+            try:
+                with requests.get(self.url, stream=True, timeout=5) as response:
+                    buffer = b''
+                    for chunk in response.iter_content(chunk_size=16384):
+                        self.bytes_received += len(chunk)
+                        buffer += chunk
+                        # Every JPEG runs from SOI to EOI, whatever the boundary;
+                        # the part's headers are in front of it
+                        start = buffer.find(JPEG_START)
+                        end = buffer.find(JPEG_END, start + 2) if start != -1 else -1
+                        while start != -1 and end != -1:
+                            now = time.perf_counter()
+                            if self.first_frame is None:
+                                self.first_frame = now - started
+                            self.arrivals.append(now)
+                            captured = capture_time(buffer[:start])
+                            if captured is not None:
+                                self.latencies.append(time.time() - captured)
+                            buffer = buffer[end + 2:]
+                            start = buffer.find(JPEG_START)
+                            end = buffer.find(JPEG_END, start + 2) if start != -1 else -1
+                        if time.time() >= self.deadline:
+                            return
+            except requests.exceptions.RequestException:
+                self.errors += 1
+                time.sleep(0.5)
+
+
+class Poller(threading.Thread):
+    """
+    Polls a JSON endpoint such as /data and records each request's latency
+    """
+
+    def __init__(self, url, deadline, interval=1.0):
+        super().__init__(daemon=True)
+        self.url = url
+        self.deadline = deadline
+        self.interval = interval
+        self.latencies = []
+        self.errors = 0
+
+    def run(self):
+        session = requests.Session()
+        while time.time() < self.deadline:
+            started = time.perf_counter()
+            try:
+                session.get(self.url, timeout=5).raise_for_status()
+                self.latencies.append(time.perf_counter() - started)
+            except requests.exceptions.RequestException:
+                self.errors += 1
+            time.sleep(self.interval)
+
+
+def summarise_viewers(viewers, duration):
+    frames = sum(len(viewer.arrivals) for viewer in viewers)
+    gaps = []
+    for viewer in viewers:
+        gaps.extend(np.diff(viewer.arrivals).tolist())
+    first_frames = [viewer.first_frame for viewer in viewers if viewer.first_frame is not None]
+    latencies = [latency for viewer in viewers for latency in viewer.latencies]
+
+    return {
+        'viewers': len(viewers),
+        'frames': frames,
+        'fps_total': round(frames / duration, 3),
+        'fps_per_viewer': round(frames / duration / len(viewers), 3),
+        'megabits_per_second': round(sum(v.bytes_received for v in viewers) * 8 / duration / 1e6, 3),
+        'capture_to_viewer': percentiles(latencies) if latencies else None,
+        'frame_interval': percentiles(gaps) if gaps else None,
+        'time_to_first_frame': percentiles(first_frames) if first_frames else None,
+        'errors': sum(viewer.errors for viewer in viewers),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test a detection server with simulated cameras")
+    parser.add_argument('sources', nargs='*', help="frames for the simulated cameras")
+    parser.add_argument('--cameras', type=int, default=2,
+                        help="number of simulated cameras, 0 to attach to cameras already running")
+    parser.add_argument('--base-port', type=int, default=9000,
+                        help="camera i controls on base + 2i, streams on base + 2i + 1")
+    parser.add_argument('--viewers', type=int, default=0, help="simulated viewers per target")
+    parser.add_argument('--target', action='append', default=[],
+                        help="MJPEG feed URL on the server under test (repeatable)")
+    parser.add_argument('--poll', action='append', default=[],
+                        help="JSON endpoint to poll once per second per viewer (repeatable)")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds to run")
+    parser.add_argument('--print-env', action='store_true',
+                        help="print CAMn_URL settings for the servers and keep serving")
+    simulator.add_camera_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.cameras and not args.sources:
+        parser.error("simulated cameras need frames, give sources or --cameras 0")
+
+    frames = load_frames(args.sources) if args.cameras else []
+    cameras = []
+    for i in range(args.cameras):
+        camera = simulator.camera_from_args(frames, args)
+        simulator.start_camera(camera, '127.0.0.1', args.base_port + 2 * i)
+        cameras.append(camera)
+
+    stream_urls = [f"http://127.0.0.1:{args.base_port + 2 * i + 1}/stream" for i in range(args.cameras)]
+    if args.print_env:
+        for i, url in enumerate(stream_urls):
+            print(f"CAM{i + 1}_URL={url}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            return 0
+
+    deadline = time.time() + args.duration
+    started = time.time()
+    viewers = {url: [Viewer(url, deadline) for _ in range(args.viewers)] for url in args.target}
+    pollers = {url: [Poller(url, deadline) for _ in range(max(args.viewers, 1))] for url in args.poll}
+
+    for thread in [t for group in list(viewers.values()) + list(pollers.values()) for t in group]:
+        thread.start()
+    for thread in [t for group in list(viewers.values()) + list(pollers.values()) for t in group]:
+        thread.join(args.duration + 10)
+    elapsed = time.time() - started
+
+    report = {
+        'duration': round(elapsed, 3),
+        'cameras': [{'url': url, 'frames_sent': camera.frames_sent, 'fps': args.fps}
+                    for url, camera in zip(stream_urls, cameras)],
+        'targets': {url: summarise_viewers(group, elapsed) for url, group in viewers.items() if group},
+        'polls': {url: {
+            'requests': sum(len(p.latencies) for p in group),
+            'latency': percentiles([l for p in group for l in p.latencies])
+            if any(p.latencies for p in group) else None,
+            'errors': sum(p.errors for p in group),
+        } for url, group in pollers.items()},
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
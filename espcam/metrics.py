@@ -0,0 +1,272 @@
+"""
+Minimal Prometheus-style metrics for the detection servers.
+
+Counters, gauges and histograms are kept in plain Python objects so that
+recording on the capture / inference hot path is a dict lookup, a lock and an
+addition. ``render()`` produces the Prometheus text exposition format for a
+``/metrics`` endpoint:
+
+    FRAMES = metrics.counter('espcam_frames_captured_total', "Frames read", ['camera'])
+    FRAMES.labels('cam1').inc()
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+"""
+import bisect
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latency buckets in seconds, from 1ms up to 5s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1,
+                   0.25, 0.5, 0.75, 1.0, 2.5, 5.0)
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+        self._function = None
+
+    def set(self, value):
+        self.value = float(value)
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set_function(self, function):
+        """
+        Compute the value at scrape time instead of on the hot path
+        """
+        self._function = function
+
+    def get(self):
+        if self._function is not None:
+            return float(self._function())
+        return self.value
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """
+        Context manager observing the duration of the block
+        """
+        return _Timer(self)
+
+
+class _Timer:
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._start)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *labelvalues):
+        """
+        Return the child for these label values, creating it on first use
+        """
+        child = self._children.get(labelvalues)
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(labelvalues, self._new_child())
+        return child
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1.0):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for labelvalues, child in list(self._children.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(child.value)}"
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def _samples(self):
+        for labelvalues, child in list(self._children.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(child.get())}"
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for labelvalues, child in list(self._children.items()):
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, ('le', _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Register a metric, returning the existing one if the name is taken
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in list(self._metrics.values())) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render():
+    """
+    Render every registered metric in the Prometheus text format
+    """
+    return REGISTRY.render()
+
+
+# Pipeline metrics shared by every detection server
+FRAMES_CAPTURED = counter('espcam_frames_captured_total',
+                          "Frames read from the camera stream", ['camera'])
+CAPTURE_RECONNECTS = counter('espcam_capture_reconnects_total',
+                             "Times the camera stream was reopened", ['camera'])
+FRAMES_DROPPED = counter('espcam_frames_dropped_total',
+                         "Frames discarded because a queue was full", ['camera', 'queue'])
+FRAMES_PROCESSED = counter('espcam_frames_processed_total',
+                           "Frames that went through inference", ['camera'])
+FRAMES_STREAMED = counter('espcam_frames_streamed_total',
+                          "JPEG frames sent to viewers", ['camera'])
+STAGE_SECONDS = histogram('espcam_stage_seconds',
+                          "Time spent in each pipeline stage", ['camera', 'stage'])
+QUEUE_DEPTH = gauge('espcam_queue_depth',
+                    "Items waiting in a pipeline queue", ['queue'])
+VIEWERS = gauge('espcam_viewers',
+                "Clients currently watching a video feed", ['camera'])
+STREAM_VARIANTS = gauge('espcam_stream_variants',
+                        "Encoders running for distinct video feed variants", ['camera'])
+ALERT_LATENCY = histogram('espcam_alert_latency_seconds',
+                          "Time from frame capture to an alert event being sent", ['camera'])
+FRAME_AGE = histogram('espcam_frame_age_seconds',
+                      "Time since capture when a frame reaches each pipeline point", ['camera', 'point'])
+TILES = counter('espcam_tiles_total',
+                "Frame tiles re-inferred or served from cache by incremental detection", ['camera', 'state'])
+TELEMETRY_MESSAGES = counter('espcam_telemetry_messages_total',
+                             "Telemetry frames received from remote sensors", ['kind'])
+TELEMETRY_CONNECTIONS = gauge('espcam_telemetry_connections',
+                              "Sensors currently connected to the telemetry ingest")
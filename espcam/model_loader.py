@@ -0,0 +1,304 @@
+"""
+Background model loading and warm-up.
+
+Importing ultralytics/torch and loading YOLO weights takes seconds, and the
+first inference pays extra warm-up costs. LazyModel does all of that in a
+background thread so the web server can answer immediately and show a
+"warming up" status until the model is ready:
+
+    model = LazyModel("yolov8n.pt").start()
+    ...
+    if model.wait(timeout=1.0):
+        results = model(frame)
+
+After the first successful load the model is exported (TorchScript by
+default) into the cache directory, and later starts load that artifact
+instead of rebuilding the network from the .pt checkpoint. The cache is
+keyed on the weights file ultralytics actually loaded, which for a bare
+name like "yolov8n.pt" is only known once it has been downloaded; where
+that file ended up is recorded so the next start can find the artifact
+before loading anything.
+
+An exported model only takes the input it was exported for: one image at
+imgsz x imgsz. Calls at another imgsz (a profile change, incremental crops)
+or with a batch go to the .pt weights instead, loaded on first need, and
+static_shape tells callers building their own input tensors which square
+size the exported model expects. Exports are serialised with a lock file
+and written in a private temporary directory, so several models or
+processes loading the same weights never move each other's half-written
+files into the cache.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from espcam import CACHE_DIR
+
+MODEL_CACHE_DIR = os.path.join(CACHE_DIR, 'models')
+
+LOADING = 'loading'
+WARMING_UP = 'warming_up'
+READY = 'ready'
+FAILED = 'failed'
+
+WARMUP_RUNS = 2
+EXPORT_FORMAT = os.environ.get('MODEL_EXPORT_FORMAT', 'torchscript')  # '' disables the cache
+
+# File suffix ultralytics gives each export format
+EXPORT_SUFFIXES = {'torchscript': '.torchscript', 'onnx': '.onnx', 'openvino': '_openvino_model'}
+
+_export_lock = threading.Lock()  # one export at a time within the process, the lock file covers other processes
+
+
+class _ExportLock:
+    """
+    Exclusive lock file next to the artifact, where fcntl is available
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        _export_lock.acquire()
+        try:
+            import fcntl
+        except ImportError:
+            return self
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'w')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            self._file.close()  # releases the flock
+            self._file = None
+        _export_lock.release()
+
+
+def cached_artifact_path(weights, imgsz, export_format):
+    """
+    Where the exported model for a weights file and input size is cached.
+
+    The weights' size and modification time are part of the name, so
+    replacing the .pt file invalidates the cache.
+    """
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    stat = os.stat(weights)
+    return os.path.join(MODEL_CACHE_DIR,
+                        f"{stem}-{stat.st_size}-{int(stat.st_mtime)}-{imgsz}{EXPORT_SUFFIXES[export_format]}")
+
+
+def _weights_record(model_path):
+    return os.path.join(MODEL_CACHE_DIR, os.path.basename(model_path) + '.weights')
+
+
+def resolve_weights(model_path):
+    """
+    Local weights file for model_path before it is loaded: the path itself,
+    or where ultralytics downloaded it on an earlier start. None when there
+    is none yet.
+    """
+    if os.path.exists(model_path):
+        return model_path
+    try:
+        with open(_weights_record(model_path)) as f:
+            weights = f.read().strip()
+    except OSError:
+        return None
+    return weights if os.path.exists(weights) else None
+
+
+def loaded_weights(model, model_path):
+    """
+    Weights file a loaded YOLO model came from, after any download
+    """
+    weights = getattr(model, 'ckpt_path', None) or model_path
+    if not os.path.exists(weights):
+        return None
+    if os.path.abspath(weights) != os.path.abspath(model_path):
+        try:
+            os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+            with open(_weights_record(model_path), 'w') as f:
+                f.write(os.path.abspath(weights))
+        except OSError as e:
+            print(f"Could not record where {model_path} was downloaded: {e}")
+    return weights
+
+
+class LazyModel:
+    """
+    YOLO model that loads and warms up in the background
+    """
+
+    def __init__(self, model_path, imgsz=640, export_format=EXPORT_FORMAT):
+        self.model_path = model_path
+        self.imgsz = imgsz
+        self.export_format = export_format if export_format in EXPORT_SUFFIXES else None
+
+        self.state = LOADING
+        self.error = None
+        self.source = None
+        self.weights = None  # .pt file the weights were loaded from
+        self.load_seconds = None
+        self._model = None
+        self._dynamic = None  # .pt model for inputs the exported one does not take
+        self._done = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start loading in the background (calling it again does nothing)
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, name=f"load-{self.model_path}")
+                self._thread.daemon = True
+                self._thread.start()
+        return self
+
+    def _load(self):
+        started = time.time()
+        try:
+            from ultralytics import YOLO
+
+            self.weights = resolve_weights(self.model_path)
+            artifact = None
+            if self.export_format and self.weights:
+                artifact = cached_artifact_path(self.weights, self.imgsz, self.export_format)
+
+            if artifact and os.path.exists(artifact):
+                model = YOLO(artifact, task='detect')
+                self.source = artifact
+            else:
+                model = YOLO(self.model_path)
+                self.source = self.model_path
+                self.weights = loaded_weights(model, self.model_path)
+
+            self.state = WARMING_UP
+            dummy = np.zeros((480, 640, 3), dtype=np.uint8)
+            for _ in range(WARMUP_RUNS):
+                model(dummy, imgsz=self.imgsz, verbose=False)
+
+            self._model = model
+            self.load_seconds = time.time() - started
+            self.state = READY
+            self._done.set()
+            print(f"Model {self.source} ready in {self.load_seconds:.1f}s")
+
+            if self.export_format and self.weights and self.source == self.model_path:
+                self._export(cached_artifact_path(self.weights, self.imgsz, self.export_format))
+        except Exception as e:
+            self.error = str(e)
+            self.state = FAILED
+            self._done.set()
+            print(f"Error: could not load model {self.model_path}: {e}")
+
+    def _export(self, artifact):
+        """
+        Export the loaded weights for faster cold starts next time
+        """
+        try:
+            from ultralytics import YOLO
+
+            with _ExportLock(artifact + '.lock'):
+                if os.path.exists(artifact):
+                    return  # another model or process exported it meanwhile
+
+                # ultralytics writes the export next to the weights, so export
+                # a private copy of them; the live instance keeps serving
+                workdir = tempfile.mkdtemp(prefix='espcam-export-')
+                try:
+                    weights = shutil.copy(self.weights, workdir)
+                    exported = YOLO(weights).export(format=self.export_format, imgsz=self.imgsz)
+                    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+                    tmp_path = artifact + '.tmp'
+                    shutil.move(str(exported), tmp_path)
+                    os.replace(tmp_path, artifact)
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+            print(f"Cached exported model at {artifact}")
+        except Exception as e:
+            print(f"Model export for the startup cache failed: {e}")
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def wait(self, timeout=None):
+        """
+        Block until the model is ready, returns False on timeout or failure.
+
+        A failed model never becomes ready, so callers polling with a timeout
+        are paced by it instead of spinning.
+        """
+        self._done.wait(timeout)
+        if self.state == FAILED and timeout:
+            time.sleep(timeout)
+        return self.ready
+
+    def _loaded(self):
+        if not self.wait():
+            raise RuntimeError(f"model {self.model_path} failed to load: {self.error}")
+        return self._model
+
+    @property
+    def names(self):
+        return self._loaded().names
+
+    @property
+    def exported(self):
+        return self.source is not None and self.source != self.model_path
+
+    @property
+    def static_shape(self):
+        """
+        (height, width) an input tensor must have for the exported model,
+        None when the .pt weights are serving and any size goes
+        """
+        return (self.imgsz, self.imgsz) if self.exported else None
+
+    def _takes(self, source, imgsz):
+        """
+        Whether the exported model can run this input as exported
+        """
+        if imgsz is not None and imgsz != self.imgsz:
+            return False
+        if isinstance(source, (list, tuple)):
+            return len(source) == 1 and self._takes(source[0], imgsz)
+        shape = getattr(source, 'shape', None)
+        if shape is not None and len(shape) == 4:  # a preprocessed tensor is used as is
+            return shape[0] == 1 and tuple(shape[2:]) == self.static_shape
+        return True  # single images are letterboxed to imgsz by ultralytics
+
+    def _dynamic_model(self):
+        with self._lock:
+            if self._dynamic is None:
+                from ultralytics import YOLO
+
+                print(f"Loading {self.model_path} for inputs the exported model does not take")
+                self._dynamic = YOLO(self.weights or self.model_path)
+            return self._dynamic
+
+    def __call__(self, source, *args, **kwargs):
+        model = self._loaded()
+        if self.exported and not self._takes(source, kwargs.get('imgsz')):
+            model = self._dynamic_model()
+        return model(source, *args, **kwargs)
+
+    def status(self):
+        return {
+            'model': self.model_path,
+            'state': self.state,
+            'source': self.source,
+            'weights': self.weights,
+            'dynamic_fallback': self._dynamic is not None,
+            'load_seconds': round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            'error': self.error,
+        }
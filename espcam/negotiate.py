@@ -0,0 +1,201 @@
+"""
+Camera-side resolution and JPEG quality negotiation.
+
+The ESP32-CAM firmware (human-detection/app_httpd.cpp) reports its sensor
+settings on /status and changes them with /control?var=framesize|quality,
+on the control port next to the stream port (80 next to 81). Instead of
+pulling full-size frames over Wi-Fi and shrinking them after decoding, a
+CameraNegotiator asks each camera for what inference can use:
+
+- framesize: the smallest 4:3 size at least as wide as the camera's model
+  input (its profile's imgsz), and never more than the standard 640x480
+  the pipeline works at;
+- quality: ESP32 quality runs 4-63 with lower meaning better. It moves from
+  QUALITY_BEST towards QUALITY_BUSY as the share of frames dropped before
+  inference grows, since dropped frames only cost bandwidth and decode time.
+
+Settings are re-checked every interval and only sent when they differ from
+what /status reports, so a camera that rebooted gets them back. After a
+framesize change the stream has to be reopened (reopen callback), OpenCV
+would otherwise keep scaling frames to the size it first saw.
+
+framesize_t is an enum whose numbering changed between esp32-camera
+releases (FRAMESIZES vs FRAMESIZES_LEGACY in espcam/simulator.py: VGA is
+10 or 8), and /status only reports the number. So each camera starts with
+the current numbering and the size of the frames it actually delivers
+(frame_size callback) is compared with what its /status framesize should
+give; a camera whose frames match the other numbering is switched to it.
+
+    negotiator = CameraNegotiator({'cam1': CAM1_URL}, imgsz=lambda cam: 640,
+                                  stage=lambda cam: pipelines[cam].stages[0],
+                                  reopen=lambda cam: get_camera(cam, CAM1_URL).reopen(),
+                                  frame_size=lambda cam: get_camera(cam, CAM1_URL).frame_size).start()
+"""
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+
+from espcam import stages
+from espcam.simulator import FRAMESIZES, FRAMESIZES_LEGACY
+
+INTERVAL = 5.0          # seconds between checks
+TIMEOUT = 2.0
+QUALITY_BEST = 10
+QUALITY_BUSY = 30
+QUALITY_STEP = 5        # smaller quality changes are not worth a sensor reconfiguration
+
+# framesize_t numberings a camera's firmware may use, the first is assumed until its frames tell otherwise
+NUMBERINGS = {'current': FRAMESIZES, 'legacy': FRAMESIZES_LEGACY}
+
+
+def control_url(stream_url):
+    """
+    Base URL of the control server next to a stream URL (port 81 -> 80)
+    """
+    parts = urlsplit(stream_url)
+    port = (parts.port or 80) - 1
+    netloc = parts.hostname if port == 80 else f"{parts.hostname}:{port}"
+    return urlunsplit((parts.scheme, netloc, '', '', ''))
+
+
+def framesizes_4_3(framesizes=FRAMESIZES):
+    """
+    4:3 framesizes, smallest first (QQVGA, QVGA, VGA, SVGA, XGA, UXGA)
+    """
+    return sorted((size for size, (width, height) in framesizes.items() if width * 3 == height * 4),
+                  key=lambda size: framesizes[size][0])
+
+
+def framesize_for_imgsz(imgsz, max_width=stages.STANDARD_WIDTH, framesizes=FRAMESIZES):
+    """
+    Smallest 4:3 framesize at least imgsz wide, capped at max_width
+    """
+    sizes = framesizes_4_3(framesizes)
+    allowed = [size for size in sizes if framesizes[size][0] <= max_width] or sizes[:1]
+    for size in allowed:
+        if framesizes[size][0] >= imgsz:
+            return size
+    return allowed[-1]
+
+
+def quality_for_load(drop_ratio):
+    """
+    JPEG quality for the share of frames dropped before inference
+    """
+    drop_ratio = min(max(drop_ratio, 0.0), 1.0)
+    quality = QUALITY_BEST + (QUALITY_BUSY - QUALITY_BEST) * drop_ratio
+    return int(round(quality / QUALITY_STEP) * QUALITY_STEP)
+
+
+class CameraNegotiator:
+    """
+    Keeps each camera's framesize and quality matched to inference
+    """
+
+    def __init__(self, cameras, imgsz, stage, reopen=None, frame_size=None, interval=INTERVAL):
+        self.cameras = cameras      # name -> stream URL
+        self.imgsz = imgsz          # imgsz(name) -> model input size
+        self.stage = stage          # stage(name) -> detect Stage, or None while not running
+        self.reopen = reopen        # reopen(name) reconnects the stream after a framesize change
+        self.frame_size = frame_size  # frame_size(name) -> (width, height) being delivered, or None
+        self.interval = interval
+
+        self.state = {name: {'control': control_url(url), 'framesize': None, 'quality': None,
+                             'numbering': next(iter(NUMBERINGS)), 'delivered': None,
+                             'target': None, 'drop_ratio': 0.0, 'changes': 0, 'error': None}
+                      for name, url in cameras.items()}
+        self._counts = {}           # name -> (processed, dropped) at the last check
+        self._resized = set()       # cameras whose framesize was just changed, their stream is reopening
+        self._stop = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name="camera-negotiator")
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _drop_ratio(self, name):
+        stage = self.stage(name)
+        if stage is None:
+            return 0.0
+        processed, dropped = stage.processed, stage.dropped
+        last_processed, last_dropped = self._counts.get(name, (0, 0))
+        self._counts[name] = (processed, dropped)
+        processed, dropped = processed - last_processed, dropped - last_dropped
+        return dropped / (processed + dropped) if processed + dropped else 0.0
+
+    def check_delivered(self, name, framesize):
+        """
+        Compare the size of the frames the camera delivers with the one its
+        framesize should give, and switch it to the numbering that explains
+        them. Returns False on a mismatch no numbering explains.
+        """
+        state = self.state[name]
+        delivered = self.frame_size(name) if self.frame_size is not None else None
+        state['delivered'] = delivered
+        if delivered is None or framesize is None or name in self._resized:
+            return True
+        if NUMBERINGS[state['numbering']].get(framesize) == delivered:
+            return True
+
+        for numbering, framesizes in NUMBERINGS.items():
+            if framesizes.get(framesize) == delivered:
+                print(f"{name}: framesize {framesize} delivers {delivered[0]}x{delivered[1]}, "
+                      f"using the {numbering} framesize_t numbering")
+                state['numbering'] = numbering
+                return True
+        return False
+
+    def negotiate(self, name, session):
+        """
+        Read the camera's settings and send the ones that differ
+        """
+        state = self.state[name]
+        state['drop_ratio'] = round(self._drop_ratio(name), 3)
+
+        try:
+            status = session.get(f"{state['control']}/status", timeout=TIMEOUT).json()
+            known = self.check_delivered(name, status.get('framesize'))
+            self._resized.discard(name)
+
+            framesizes = NUMBERINGS[state['numbering']]
+            target = {'framesize': framesize_for_imgsz(self.imgsz(name), framesizes=framesizes),
+                      'quality': quality_for_load(state['drop_ratio'])}
+            if not known:
+                # Resizing blindly could hand inference any size, leave the framesize as it is
+                del target['framesize']
+                state['framesize'] = status.get('framesize')
+            state['target'] = target
+            for variable, value in target.items():
+                state[variable] = status.get(variable)
+                if status.get(variable) == value:
+                    continue
+                response = session.get(f"{state['control']}/control", params={'var': variable, 'val': value},
+                                       timeout=TIMEOUT)
+                response.raise_for_status()
+                print(f"{name}: {variable} {status.get(variable)} -> {value}")
+                state[variable] = value
+                state['changes'] += 1
+                if variable == 'framesize':
+                    self._resized.add(name)  # its frames are checked again from the next round
+                    if self.reopen is not None:
+                        self.reopen(name)
+            state['error'] = None if known else (
+                f"framesize {status.get('framesize')} delivers {state['delivered'][0]}x{state['delivered'][1]}, "
+                f"which no known framesize_t numbering gives")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            state['error'] = str(e)
+
+    def _run(self):
+        session = requests.Session()
+        while not self._stop.is_set():
+            for name in self.cameras:
+                self.negotiate(name, session)
+            self._stop.wait(self.interval)
+
+    def status(self):
+        return {name: dict(state) for name, state in self.state.items()}
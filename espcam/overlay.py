@@ -0,0 +1,145 @@
+"""
+Cached overlay compositor for annotations.
+
+Static layers (ROI polygon, legend, warning banners) are rendered once per
+frame size into a patch covering just what they paint, and label text is
+rendered once per (text, style) into a small glyph patch kept in an LRU
+cache. Compositing a frame blends those patches in with two OpenCV
+arithmetic calls each and draws the boxes, all in one pass, and callers only
+composite the frames a viewer actually receives.
+
+    overlay = OverlayCompositor()
+    overlay.add_layer('roi', lambda canvas: cv2.polylines(canvas, [ROI], True, (255, 0, 0), 2))
+    overlay.compose(frame, boxes=[((x1, y1, x2, y2), color)],
+                    labels=[("car: 3.20m", (x1, y1 - 10), color)], layers=['roi'])
+"""
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+GLYPH_CACHE_SIZE = 512
+
+
+def render_patch(width, height, draw):
+    """
+    Render a drawing function into (colors, keep, (x, y)), or None if it
+    paints nothing.
+
+    The function draws on two canvases, one black and one white. The black
+    one holds the premultiplied colour of each pixel and the difference
+    between the two how much of the background shows through (0 where the
+    drawing is opaque, 255 where it is untouched), so anti-aliased edges and
+    translucent fills blend like they would when drawn directly. Both are
+    cropped to the painted area.
+    """
+    black = np.zeros((height, width, 3), dtype=np.uint8)
+    white = np.full((height, width, 3), 255, dtype=np.uint8)
+    draw(black)
+    draw(white)
+
+    keep = cv2.subtract(white, black)
+    ys, xs = np.nonzero((keep < 255).any(axis=2))
+    if len(xs) == 0:
+        return None
+    x0, x1, y0, y1 = xs.min(), xs.max() + 1, ys.min(), ys.max() + 1
+    return black[y0:y1, x0:x1].copy(), keep[y0:y1, x0:x1].copy(), (int(x0), int(y0))
+
+
+def blit(frame, colors, keep, x, y):
+    """
+    Blend a rendered patch onto the frame at (x, y), clipped to the frame
+    """
+    height, width = frame.shape[:2]
+    patch_height, patch_width = colors.shape[:2]
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + patch_width, width), min(y + patch_height, height)
+    if left >= right or top >= bottom:
+        return
+
+    region = frame[top:bottom, left:right]
+    crop = (slice(top - y, bottom - y), slice(left - x, right - x))
+    cv2.add(colors[crop], cv2.multiply(region, keep[crop], scale=1 / 255.0), dst=region)
+
+
+class OverlayCompositor:
+    """
+    Composites static layers, boxes and cached label glyphs onto frames.
+
+    One compositor can be shared by several streaming threads.
+    """
+
+    def __init__(self, glyph_cache_size=GLYPH_CACHE_SIZE):
+        self._layer_draws = {}
+        self._layers = {}
+        self._glyphs = OrderedDict()
+        self._glyph_cache_size = glyph_cache_size
+        self._lock = threading.Lock()
+
+    def add_layer(self, name, draw):
+        """
+        Register a static layer, draw(canvas) paints it onto a full-size canvas
+        """
+        self._layer_draws[name] = draw
+        self._layers = {key: value for key, value in self._layers.items() if key[0] != name}
+
+    def _layer(self, name, width, height):
+        key = (name, width, height)
+        if key not in self._layers:
+            self._layers[key] = render_patch(width, height, self._layer_draws[name])
+        return self._layers[key]
+
+    def glyph(self, text, color, scale=0.5, thickness=2):
+        """
+        Rendered label as (colors, keep, offset from the putText origin),
+        cached by text and style
+        """
+        key = (text, color, scale, thickness)
+        with self._lock:
+            if key in self._glyphs:
+                self._glyphs.move_to_end(key)
+                return self._glyphs[key]
+
+        (text_width, text_height), baseline = cv2.getTextSize(text, FONT, scale, thickness)
+        pad = 2 * thickness
+        origin = (pad, pad + text_height)
+        rendered = render_patch(text_width + 2 * pad, text_height + baseline + 2 * pad,
+                                lambda canvas: cv2.putText(canvas, text, origin, FONT, scale, color, thickness))
+        if rendered is not None:
+            colors, keep, (x, y) = rendered
+            rendered = (colors, keep, (x - origin[0], y - origin[1]))
+
+        with self._lock:
+            self._glyphs[key] = rendered
+            if len(self._glyphs) > self._glyph_cache_size:
+                self._glyphs.popitem(last=False)
+        return rendered
+
+    def compose(self, frame, boxes=(), labels=(), layers=(), scale=0.5, thickness=2):
+        """
+        Draw layers, boxes and labels onto the frame in place.
+
+        boxes:  [((x1, y1, x2, y2), color), ...]
+        labels: [(text, (x, y), color), ...] with (x, y) the putText origin,
+                a fourth item overrides the font scale for that label
+        """
+        height, width = frame.shape[:2]
+
+        for name in layers:
+            layer = self._layer(name, width, height)
+            if layer is not None:
+                colors, keep, (x, y) = layer
+                blit(frame, colors, keep, x, y)
+
+        for (x1, y1, x2, y2), color in boxes:
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color, thickness)
+
+        for text, (x, y), color, *label_scale in labels:
+            glyph = self.glyph(text, color, label_scale[0] if label_scale else scale, thickness)
+            if glyph is not None:
+                colors, keep, (dx, dy) = glyph
+                blit(frame, colors, keep, x + dx, y + dy)
+
+        return frame
@@ -0,0 +1,135 @@
+"""
+Pre-serialized /data responses.
+
+/data is polled every second by the dashboard, client.py and admin.py, but
+the fused state only changes when a camera delivers a frame or goes stale.
+PayloadCache serializes the state once per change and per format, keeps a
+gzipped copy next to it, and tags both with an ETag, so an unchanged poll
+is answered with a 304 and no serialization at all:
+
+    payloads = PayloadCache(lambda: (fusion.version, tuple(fusion.stale_cameras())), fusion.snapshot)
+    payload = payloads.get('compact', gzip_ok=True)
+
+Formats:
+- json: the full state, as before
+- compact: JSON with rounded floats and short detections
+  ({class, confidence, distance, bbox, timestamp}, original_distance only
+  when it differs from the adjusted one)
+- msgpack: the compact state as MessagePack (needs the msgpack package)
+
+JSON is written with orjson when it is installed, stdlib json otherwise.
+"""
+import gzip
+import hashlib
+import json
+import threading
+from collections import namedtuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FULL = 'json'
+COMPACT = 'compact'
+MSGPACK = 'msgpack'
+FORMATS = (FULL, COMPACT, MSGPACK)
+
+DISTANCE_DIGITS = 2      # centimetres
+TIME_DIGITS = 3          # milliseconds
+CONFIDENCE_DIGITS = 3
+GZIP_MIN_BYTES = 256     # smaller bodies are not worth compressing
+GZIP_LEVEL = 6
+
+Payload = namedtuple('Payload', ['body', 'etag', 'content_type', 'encoding'])
+
+
+def dumps_json(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def compact_detection(detection):
+    distance = round(detection['adjusted_distance'], DISTANCE_DIGITS)
+    compact = {
+        'class': detection['class'],
+        'confidence': round(detection['confidence'], CONFIDENCE_DIGITS),
+        'distance': distance,
+        'bbox': list(detection['bbox']),
+        'timestamp': round(detection['timestamp'], TIME_DIGITS),
+    }
+    original = round(detection['original_distance'], DISTANCE_DIGITS)
+    if original != distance:
+        compact['original_distance'] = original
+    return compact
+
+
+def compact_state(data):
+    """
+    Rounded copy of the fused state with short detection records
+    """
+    compact = {}
+    for key, value in data.items():
+        if key.endswith('_detections'):
+            value = [compact_detection(detection) for detection in value]
+        elif isinstance(value, float):
+            value = round(value, TIME_DIGITS if key.endswith('timestamp') or key == 'skew' else DISTANCE_DIGITS)
+        compact[key] = value
+    return compact
+
+
+def serialize(data, output_format):
+    """
+    (body, content type) of the state in one of FORMATS
+    """
+    if output_format == FULL:
+        return dumps_json(data), 'application/json'
+    if output_format == COMPACT:
+        return dumps_json(compact_state(data)), 'application/json'
+    if output_format == MSGPACK:
+        import msgpack
+
+        return msgpack.packb(compact_state(data)), 'application/msgpack'
+    raise ValueError(f"unknown format {output_format}, expected one of {', '.join(FORMATS)}")
+
+
+class PayloadCache:
+    """
+    Serialized bodies of a state, rebuilt when key() changes
+    """
+
+    def __init__(self, key, build):
+        self.key = key        # cheap value that changes whenever build() would
+        self.build = build    # returns the state to serialize
+        self._state_key = None
+        self._state = None
+        self._payloads = {}
+        self._lock = threading.Lock()
+
+    def get(self, output_format=FULL, gzip_ok=False):
+        """
+        Payload for the current state. Raises ValueError for an unknown
+        format and ImportError if msgpack is asked for but not installed.
+        """
+        key = self.key()
+        with self._lock:
+            if key != self._state_key:
+                self._state_key = key
+                self._state = self.build()
+                self._payloads = {}
+
+            if output_format not in self._payloads:
+                body, content_type = serialize(self._state, output_format)
+                etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+                self._payloads[output_format] = [Payload(body, etag, content_type, None), None]
+            entry = self._payloads[output_format]
+
+            plain = entry[0]
+            if not gzip_ok or len(plain.body) < GZIP_MIN_BYTES:
+                return plain
+            if entry[1] is None:
+                # A different representation needs its own ETag
+                entry[1] = Payload(gzip.compress(plain.body, GZIP_LEVEL, mtime=0), plain.etag + '-gzip',
+                                   plain.content_type, 'gzip')
+            return entry[1]
@@ -0,0 +1,269 @@
+"""
+Small stage-graph runtime for the capture -> infer -> annotate -> encode ->
+serve flow every entry point runs.
+
+A pipeline is a source followed by a chain of stages. Each stage declares:
+
+- how many worker threads run it;
+- its bounded input queue and what happens when it is full: BLOCK the
+  producer, DROP_OLDEST item, or keep the LATEST_ONLY;
+- timing hooks, called with the time spent on every item. The default hook
+  records espcam_stage_seconds{camera=<pipeline>, stage=<stage>}.
+
+Items are usually dicts carrying the frame and its timestamps. A stage
+function returns the item to pass on, or None to stop it there:
+
+    pipeline = Pipeline('cam1')
+    pipeline.source('capture', read_camera)
+    pipeline.stage('detect', detect, policy=LATEST_ONLY)
+    pipeline.stage('encode', encode, workers=2)
+    pipeline.stage('publish', latest.publish)
+    pipeline.start()
+
+Queue depths and drops are exported as espcam_queue_depth and
+espcam_frames_dropped_total.
+"""
+import threading
+import time
+from collections import deque
+
+from espcam import metrics
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+LATEST_ONLY = 'latest_only'
+
+QUEUE_SIZE = 10
+POLL_SECONDS = 0.5  # how often idle workers check for stop()
+
+
+class StageQueue:
+    """
+    Bounded queue with a full-queue policy
+    """
+
+    def __init__(self, maxsize=QUEUE_SIZE, policy=BLOCK, on_drop=None):
+        if policy not in (BLOCK, DROP_OLDEST, LATEST_ONLY):
+            raise ValueError(f"unknown queue policy {policy}")
+        self.policy = policy
+        self.maxsize = 1 if policy == LATEST_ONLY else maxsize
+        self.on_drop = on_drop
+        self._items = deque()
+        self._condition = threading.Condition()
+
+    def put(self, item, timeout=None):
+        """
+        Add an item, returns False if a BLOCK queue stayed full until timeout
+        """
+        with self._condition:
+            if len(self._items) >= self.maxsize:
+                if self.policy == BLOCK:
+                    if not self._condition.wait_for(lambda: len(self._items) < self.maxsize, timeout):
+                        return False
+                else:
+                    self._items.popleft()
+                    if self.on_drop:
+                        self.on_drop()
+            self._items.append(item)
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """
+        Take the oldest item, or None if nothing arrived within the timeout
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._items, timeout):
+                return None
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def qsize(self):
+        return len(self._items)
+
+
+class Latest:
+    """
+    Most recent output of a pipeline, for any number of readers
+    """
+
+    def __init__(self):
+        self._seq = 0
+        self._value = None
+        self._condition = threading.Condition()
+
+    def publish(self, value):
+        with self._condition:
+            self._seq += 1
+            self._value = value
+            self._condition.notify_all()
+
+    def read(self, last_seq=0, timeout=None):
+        """
+        Wait for a value newer than last_seq, returns (seq, value) or
+        (last_seq, None) on timeout
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._seq > last_seq, timeout):
+                return last_seq, None
+            return self._seq, self._value
+
+
+def metrics_hook(pipeline_name, stage_name):
+    histogram = metrics.STAGE_SECONDS.labels(pipeline_name, stage_name)
+    return lambda seconds, item: histogram.observe(seconds)
+
+
+class Stage:
+    """
+    One step of a pipeline and the workers running it
+    """
+
+    def __init__(self, pipeline, name, fn=None, setup=None, workers=1,
+                 policy=DROP_OLDEST, maxsize=QUEUE_SIZE, hooks=None):
+        if (fn is None) == (setup is None):
+            raise ValueError("a stage needs either fn or setup")
+
+        self.pipeline = pipeline
+        self.name = name
+        self.fn = fn
+        self.setup = setup  # setup(worker_index) returns that worker's fn
+        self.workers = workers
+        self.hooks = [metrics_hook(pipeline.name, name)] if hooks is None else list(hooks)
+        self.processed = 0
+        self.errors = 0
+        self.dropped = 0
+        self.output = None
+
+        self._dropped = metrics.FRAMES_DROPPED.labels(pipeline.name, name)
+        self.input = StageQueue(maxsize, policy, on_drop=self._drop)
+        metrics.QUEUE_DEPTH.labels(f"{pipeline.name}_{name}").set_function(self.input.qsize)
+        self._lock = threading.Lock()  # counters are updated by every worker and producer
+
+    def _drop(self):
+        with self._lock:
+            self.dropped += 1
+        self._dropped.inc()
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run_worker, args=(index,),
+                                      name=f"{self.pipeline.name}-{self.name}-{index}")
+            thread.daemon = True
+            thread.start()
+
+    def _forward(self, item, started):
+        seconds = time.perf_counter() - started
+        with self._lock:
+            self.processed += 1
+        for hook in self.hooks:
+            hook(seconds, item)
+        if item is not None and self.output is not None:
+            # A BLOCK stage downstream holds this worker, that is the backpressure
+            while not self.output.put(item, timeout=POLL_SECONDS):
+                if self.pipeline.stopped:
+                    return
+
+    def _failed(self, error):
+        with self._lock:
+            self.errors += 1
+        print(f"Error in {self.pipeline.name} stage {self.name}: {error}")
+
+    def _run_worker(self, index):
+        fn = self.fn if self.setup is None else self.setup(index)
+        while not self.pipeline.stopped:
+            item = self.input.get(timeout=POLL_SECONDS)
+            if item is None:
+                continue
+            started = time.perf_counter()
+            try:
+                result = fn(item)
+            except Exception as e:
+                self._failed(e)
+                continue
+            self._forward(result, started)
+
+    def status(self):
+        return {
+            'workers': self.workers,
+            'policy': self.input.policy,
+            'queued': self.input.qsize(),
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+        }
+
+
+class Pipeline:
+    """
+    A source and a chain of stages, started and stopped together
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+        self.stopped = False
+        self._source = None
+        self._started = False
+        self._lock = threading.Lock()
+
+    def source(self, name, produce):
+        """
+        produce() returns an iterable of items, read on a thread of its own
+        """
+        self._source = (name, produce)
+        return self
+
+    def stage(self, name, fn=None, **options):
+        """
+        Append a stage, see Stage for the options
+        """
+        stage = Stage(self, name, fn, **options)
+        if self.stages:
+            self.stages[-1].output = stage.input
+        self.stages.append(stage)
+        return self
+
+    def start(self):
+        """
+        Start every stage and the source (calling it again does nothing)
+        """
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+
+        for stage in self.stages:
+            stage.start()
+        if self._source is not None:
+            thread = threading.Thread(target=self._run_source, name=f"{self.name}-{self._source[0]}")
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def _run_source(self):
+        name, produce = self._source
+        first = self.stages[0].input if self.stages else None
+        try:
+            for item in produce():
+                if self.stopped:
+                    break
+                if first is not None and item is not None:
+                    while not first.put(item, timeout=POLL_SECONDS):
+                        if self.stopped:
+                            return
+        except Exception as e:
+            print(f"Error in {self.name} source {name}: {e}")
+
+    def put(self, item):
+        """
+        Feed an item to the first stage, for pipelines without a source
+        """
+        return self.stages[0].input.put(item)
+
+    def stop(self):
+        self.stopped = True
+
+    def status(self):
+        return {stage.name: stage.status() for stage in self.stages}
@@ -0,0 +1,97 @@
+"""
+Letterboxing straight into a preallocated model input tensor.
+
+Given a BGR frame, ultralytics letterboxes it into a new array, flips it
+to RGB, transposes it to CHW and normalises it into yet another tensor, on
+every frame. LetterboxBuffer keeps one uint8 letterbox canvas and one float
+input tensor per camera (or batch slot) and fills them in place: the resize
+writes into the canvas, and the RGB flip, CHW transpose and /255 happen in
+a single pass per channel into the tensor's memory. The tensor is passed to
+the model as is, which skips ultralytics' own preprocessing, so boxes come
+back in letterbox coordinates and are mapped back with scale_box():
+
+    buffer = LetterboxBuffer(imgsz=640)
+    results = model(buffer.fill(frame), verbose=False)
+    detections = stages.extract_detections(results, model.names, None, distance_fn,
+                                           scale_box=buffer.scale_box)
+
+The tensor is rectangular (1x3x480x640 for a 640x480 frame) like the
+.pt model's own letterbox. Exported models (TorchScript, ONNX) only take
+the imgsz x imgsz input they were exported at, so use square=True for
+them.
+"""
+import math
+
+import cv2
+import numpy as np
+
+STRIDE = 32
+PAD_VALUE = 114  # same grey ultralytics pads with
+
+
+class LetterboxBuffer:
+    """
+    Reusable letterboxed input tensor for frames of one size
+    """
+
+    def __init__(self, imgsz=640, stride=STRIDE, square=False):
+        self.imgsz = imgsz
+        self.stride = stride
+        self.square = square    # pad to imgsz x imgsz for fixed-shape exported models
+        self._frame_shape = None
+        self.tensor = None
+
+    def _allocate(self, frame_height, frame_width):
+        """
+        Size the buffers for this frame size, like ultralytics' rectangular
+        letterbox: longest side to imgsz, padded to a multiple of the stride
+        (or to imgsz on both sides when square)
+        """
+        import torch
+
+        self.ratio = min(self.imgsz / frame_height, self.imgsz / frame_width)
+        self.resized = (round(frame_width * self.ratio), round(frame_height * self.ratio))
+        if self.square:
+            width = height = self.imgsz
+        else:
+            width = math.ceil(self.resized[0] / self.stride) * self.stride
+            height = math.ceil(self.resized[1] / self.stride) * self.stride
+        self.pad = ((width - self.resized[0]) // 2, (height - self.resized[1]) // 2)
+
+        self.canvas = np.full((height, width, 3), PAD_VALUE, dtype=np.uint8)
+        left, top = self.pad
+        self._inner = self.canvas[top:top + self.resized[1], left:left + self.resized[0]]
+        self.tensor = torch.empty((1, 3, height, width), dtype=torch.float32)
+        self._planes = self.tensor.numpy()[0]  # shares the tensor's memory
+        self._frame_shape = (frame_height, frame_width)
+
+    def fill(self, frame):
+        """
+        Letterbox a BGR frame into the input tensor and return the tensor
+        """
+        if frame.shape[:2] != self._frame_shape:
+            self._allocate(*frame.shape[:2])
+
+        if self.resized == (frame.shape[1], frame.shape[0]):
+            self._inner[...] = frame
+        else:
+            # dst must be the exact size, so resize writes into the canvas
+            cv2.resize(frame, self.resized, dst=self._inner, interpolation=cv2.INTER_LINEAR)
+
+        # BGR -> RGB, HWC -> CHW and 0..255 -> 0..1 in one pass per channel
+        for channel in range(3):
+            np.multiply(self.canvas[:, :, 2 - channel], 1 / 255.0, out=self._planes[channel], casting='unsafe')
+        return self.tensor
+
+    def scale_box(self, x1, y1, x2, y2):
+        """
+        Map a box from tensor coordinates back onto the original frame
+        """
+        left, top = self.pad
+        height, width = self._frame_shape
+        return (
+            int(min(max((x1 - left) / self.ratio, 0), width)),
+            int(min(max((y1 - top) / self.ratio, 0), height)),
+            int(min(max((x2 - left) / self.ratio, 0), width)),
+            int(min(max((y2 - top) / self.ratio, 0), height)),
+        )
@@ -0,0 +1,138 @@
+"""
+On-demand sampling profiler for the running pipeline threads.
+
+Nothing is installed while profiling is off: no sys.setprofile hook, no
+timers. A profile() call samples every thread's Python stack with
+sys._current_frames() every few milliseconds for the requested number of
+seconds, from the calling thread, then returns:
+
+- collapsed stacks, one line per distinct stack, "thread;outer;...;inner count",
+  ready for flamegraph.pl or speedscope;
+- per-function totals: samples where the function was running (self) and
+  where it was anywhere on the stack (total).
+
+Threads are picked by name, e.g. 'cam1' matches the cam1 pipeline threads
+('cam1-capture', 'cam1-detect-0') and 'camera-' the camera readers. Samples
+of threads parked in a lock, queue or select are left out unless idle=True,
+so the profile shows where the CPU time goes. Time spent inside C code
+(cv2.imdecode, torch) is charged to the Python frame that called it.
+
+    report = profile(seconds=5, threads=['cam1'])
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+INTERVAL = 0.005     # seconds between samples
+MAX_SECONDS = 60.0
+TOP_FUNCTIONS = 50
+IDLE_FILES = ('threading.py', 'queue.py', 'selectors.py', 'socket.py', 'socketserver.py')
+
+_running = threading.Lock()  # one profile at a time
+_labels = {}
+
+
+def frame_label(code):
+    label = _labels.get(code)
+    if label is None:
+        label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        _labels[code] = label
+    return label
+
+
+def sample(seconds, interval=INTERVAL, threads=None, idle=False):
+    """
+    Counter of (thread name, stack) -> samples, stacks outermost first,
+    and the number of sampling rounds
+    """
+    me = threading.get_ident()
+    names = {}
+    stacks = Counter()
+    rounds = 0
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            if ident not in names:
+                names.update((thread.ident, thread.name) for thread in threading.enumerate())
+            name = names.get(ident, str(ident))
+            if threads and not any(match in name for match in threads):
+                continue
+            if not idle and os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            stacks[(name, tuple(stack))] += 1
+        rounds += 1
+        time.sleep(interval)
+
+    return stacks, rounds
+
+
+def collapse(stacks):
+    """
+    Brendan Gregg's collapsed format, heaviest stacks first
+    """
+    return '\n'.join(f"{';'.join((name,) + stack)} {count}"
+                     for (name, stack), count in stacks.most_common()) + '\n'
+
+
+def function_totals(stacks, seconds_per_round, top=TOP_FUNCTIONS):
+    self_samples = Counter()
+    total_samples = Counter()
+    for (_, stack), count in stacks.items():
+        self_samples[stack[-1]] += count
+        for function in set(stack):  # recursion counts once per sample
+            total_samples[function] += count
+
+    samples = sum(stacks.values()) or 1
+    return [{
+        'function': function,
+        'self': self_samples[function],
+        'total': count,
+        'self_pct': round(100.0 * self_samples[function] / samples, 2),
+        'total_pct': round(100.0 * count / samples, 2),
+        'total_seconds': round(count * seconds_per_round, 3),  # of thread time, summed over threads
+    } for function, count in total_samples.most_common(top)]
+
+
+def profile(seconds, interval=INTERVAL, threads=None, idle=False):
+    """
+    Sample for the given time and summarise. Raises RuntimeError if another
+    profile is already running and ValueError for out-of-range settings.
+    """
+    if not 0 < seconds <= MAX_SECONDS:
+        raise ValueError(f"seconds must be between 0 and {MAX_SECONDS}")
+    if not 0.001 <= interval <= 1.0:
+        raise ValueError("interval must be between 0.001 and 1 second")
+    if not _running.acquire(blocking=False):
+        raise RuntimeError("a profile is already running")
+    try:
+        started = time.time()
+        stacks, rounds = sample(seconds, interval, threads, idle)
+        elapsed = time.time() - started
+    finally:
+        _running.release()
+
+    per_thread = Counter()
+    for (name, _), count in stacks.items():
+        per_thread[name] += count
+
+    return {
+        'started': started,
+        'seconds': seconds,
+        'interval': interval,
+        'rounds': rounds,
+        'samples': sum(stacks.values()),
+        'threads': dict(per_thread.most_common()),
+        'functions': function_totals(stacks, elapsed / max(rounds, 1)),
+        'collapsed': collapse(stacks),
+    }
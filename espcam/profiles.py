@@ -0,0 +1,123 @@
+"""
+Per-camera detection profiles applied inside inference.
+
+A profile holds the classes, confidence threshold, NMS IoU, max_det and
+imgsz for one camera. They are passed straight to the YOLO predictor, so
+class filtering happens in NMS and post-processing only ever sees relevant
+boxes. Profiles can be changed at runtime (e.g. from a PUT /profiles/<cam>
+endpoint); readers always get a complete, consistent profile.
+
+    profiles = ProfileStore({'cam1': {'classes': [0, 2], 'conf': 0.4}})
+    results = model(frame, **profiles.predict_kwargs('cam1', model.names))
+"""
+import threading
+
+DEFAULT_PROFILE = {
+    'classes': None,  # None keeps every class
+    'conf': 0.25,
+    'iou': 0.7,
+    'max_det': 300,
+    'imgsz': 640,
+}
+
+
+def validate(changes):
+    """
+    Check and normalise profile fields, raising ValueError on bad input
+    """
+    unknown = set(changes) - set(DEFAULT_PROFILE)
+    if unknown:
+        raise ValueError(f"unknown profile fields: {', '.join(sorted(unknown))}")
+
+    profile = {}
+    for key, value in changes.items():
+        if key == 'classes':
+            if value is not None:
+                if not isinstance(value, (list, tuple)) or not value:
+                    raise ValueError("classes must be a non-empty list of class ids or names, or null")
+                if not all(isinstance(c, (int, str)) and not isinstance(c, bool) for c in value):
+                    raise ValueError("classes must contain class ids or names")
+                value = list(value)
+        elif key in ('conf', 'iou'):
+            value = float(value)
+            if not 0.0 <= value <= 1.0:
+                raise ValueError(f"{key} must be between 0 and 1")
+        elif key == 'max_det':
+            value = int(value)
+            if value < 1:
+                raise ValueError("max_det must be at least 1")
+        elif key == 'imgsz':
+            value = int(value)
+            if value < 32 or value % 32:
+                raise ValueError("imgsz must be a positive multiple of 32")
+        profile[key] = value
+    return profile
+
+
+def resolve_classes(classes, names):
+    """
+    Map class names to ids using the model's names (ids pass through)
+    """
+    if classes is None:
+        return None
+    ids_by_name = {name: cls for cls, name in names.items()}
+    resolved = []
+    for cls in classes:
+        if isinstance(cls, str):
+            if cls not in ids_by_name:
+                print(f"Warning: unknown class '{cls}' in detection profile")
+                continue
+            cls = ids_by_name[cls]
+        resolved.append(cls)
+    return resolved
+
+
+class ProfileStore:
+    """
+    Detection profiles by camera name, safe to update while inference runs
+    """
+
+    def __init__(self, profiles=None):
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self._resolved = {}
+        for camera, profile in (profiles or {}).items():
+            self.update(camera, profile)
+
+    def get(self, camera):
+        profile = self._profiles.get(camera)
+        return dict(profile) if profile else dict(DEFAULT_PROFILE)
+
+    def all(self):
+        return {camera: dict(profile) for camera, profile in list(self._profiles.items())}
+
+    def update(self, camera, changes):
+        """
+        Merge validated changes into a camera's profile and return it
+        """
+        changes = validate(changes)
+        with self._lock:
+            profile = dict(self._profiles.get(camera, DEFAULT_PROFILE))
+            profile.update(changes)
+            # Replace, never mutate, so readers see either the old or new profile
+            self._profiles[camera] = profile
+            self._resolved.pop(camera, None)
+        return dict(profile)
+
+    def predict_kwargs(self, camera, names):
+        """
+        Keyword arguments for model(frame, ...) under the camera's profile
+        """
+        cached = self._resolved.get(camera)
+        if cached is None:
+            with self._lock:
+                profile = self._profiles.get(camera, DEFAULT_PROFILE)
+                cached = {
+                    'classes': resolve_classes(profile['classes'], names),
+                    'conf': profile['conf'],
+                    'iou': profile['iou'],
+                    'max_det': profile['max_det'],
+                    'imgsz': profile['imgsz'],
+                }
+                self._resolved[camera] = cached
+        return cached
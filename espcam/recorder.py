@@ -0,0 +1,237 @@
+"""
+Event-triggered clip recording from an in-memory JPEG ring.
+
+The stream's already encoded JPEGs are kept in a ring bounded by age and
+total size. When an event fires, the last pre_roll seconds are flushed to a
+new clip and frames keep being recorded until post_roll seconds after the
+last trigger. A background thread writes the clip as MJPEG segments (raw
+concatenated JPEGs, which espcam.benchmark can replay) plus a clip.json
+index, so recording never re-encodes and never blocks the caller:
+
+    recorder = ClipRecorder('cam1', 'clips').start()
+    recorder.add(time.time(), seq, jpeg_bytes)    # every streamed frame
+    recorder.trigger("Accident Can Happen!")      # when a warning fires
+"""
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from espcam import metrics
+
+PRE_ROLL = 5.0          # seconds before the event
+POST_ROLL = 5.0         # seconds after the last trigger
+SEGMENT_SECONDS = 10.0  # length of each written segment
+RING_SECONDS = 15.0     # the ring must cover at least the pre-roll
+RING_BYTES = 32 * 1024 * 1024
+WRITE_QUEUE_SIZE = 256
+
+
+class JpegRing:
+    """
+    Last few seconds of encoded frames, bounded by age and total bytes
+    """
+
+    def __init__(self, max_seconds=RING_SECONDS, max_bytes=RING_BYTES):
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self._frames = deque()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def append(self, timestamp, jpeg):
+        with self._lock:
+            self._frames.append((timestamp, jpeg))
+            self._bytes += len(jpeg)
+            while self._frames and (self._bytes > self.max_bytes
+                                    or timestamp - self._frames[0][0] > self.max_seconds):
+                self._bytes -= len(self._frames.popleft()[1])
+
+    def since(self, timestamp):
+        """
+        Frames captured at or after timestamp, oldest first
+        """
+        with self._lock:
+            return [frame for frame in self._frames if frame[0] >= timestamp]
+
+    def __len__(self):
+        return len(self._frames)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+
+class ClipRecorder:
+    """
+    Records pre/post-roll clips of one camera's stream on demand
+    """
+
+    def __init__(self, name, clip_dir, pre_roll=PRE_ROLL, post_roll=POST_ROLL,
+                 segment_seconds=SEGMENT_SECONDS, max_bytes=RING_BYTES):
+        self.name = name
+        self.clip_dir = clip_dir
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        self.segment_seconds = segment_seconds
+        self.ring = JpegRing(max(RING_SECONDS, pre_roll), max_bytes)
+
+        self.clips_written = 0
+        self._last_seq = 0
+        self._recording_until = None
+        self._lock = threading.Lock()
+        self._writes = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._frames_dropped = metrics.FRAMES_DROPPED.labels(name, 'recorder')
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write_clips, name=f"recorder-{self.name}")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    @property
+    def recording(self):
+        return self._recording_until is not None
+
+    def add(self, timestamp, seq, jpeg):
+        """
+        Keep an encoded frame; only the first copy of each camera frame
+        seq is kept
+        """
+        with self._lock:
+            if seq <= self._last_seq:
+                return
+            self._last_seq = seq
+
+            self.ring.append(timestamp, jpeg)
+            if self._recording_until is not None:
+                if timestamp <= self._recording_until:
+                    self._enqueue(('frame', timestamp, jpeg))
+                else:
+                    self._recording_until = None
+                    self._enqueue(('end', timestamp, None))
+
+    def trigger(self, reason, timestamp=None):
+        """
+        Start a clip with the pre-roll, or extend the running clip's post-roll
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            if self._recording_until is None:
+                self._enqueue(('start', timestamp, reason))
+                for frame_time, jpeg in self.ring.since(timestamp - self.pre_roll):
+                    self._enqueue(('frame', frame_time, jpeg))
+            self._recording_until = timestamp + self.post_roll
+
+    def _enqueue(self, item):
+        if item[0] != 'frame':
+            # A lost start or end would merge or lose whole clips, wait for room
+            self._writes.put(item)
+            return
+        try:
+            self._writes.put_nowait(item)
+        except queue.Full:
+            # The disk cannot keep up, lose frames rather than stall the stream
+            self._frames_dropped.inc()
+
+    def _write_clips(self):
+        clip = None
+        while True:
+            try:
+                kind, timestamp, payload = self._writes.get(timeout=1.0)
+            except queue.Empty:
+                # Close the clip even if the stream stopped during the post-roll.
+                # Never wait for the lock here: its holder may be waiting for
+                # this thread to make room in the queue
+                if not self._lock.acquire(blocking=False):
+                    continue
+                try:
+                    expired = self._recording_until is not None and time.time() > self._recording_until
+                    if expired:
+                        self._recording_until = None
+                finally:
+                    self._lock.release()
+                if not expired:
+                    continue
+                kind, timestamp, payload = 'end', time.time(), None
+
+            try:
+                if kind == 'start':
+                    if clip is not None:
+                        clip.close()
+                    clip = Clip(self.clip_dir, self.name, timestamp, payload, self.segment_seconds)
+                elif kind == 'frame' and clip is not None:
+                    clip.write(timestamp, payload)
+                elif kind == 'end' and clip is not None:
+                    clip.close()
+                    self.clips_written += 1
+                    print(f"Saved clip: {clip.path}")
+                    clip = None
+            except OSError as e:
+                print(f"Error writing clip for {self.name}: {e}")
+                clip = None
+
+    def status(self):
+        return {
+            'recording': self.recording,
+            'ring_frames': len(self.ring),
+            'ring_bytes': self.ring.nbytes,
+            'clips_written': self.clips_written,
+        }
+
+
+class Clip:
+    """
+    One clip on disk: numbered MJPEG segments and a clip.json index
+    """
+
+    def __init__(self, clip_dir, name, timestamp, reason, segment_seconds):
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp))
+        base = os.path.join(clip_dir, f"{name}-{stamp}-{int(timestamp * 1000) % 1000:03d}")
+        os.makedirs(clip_dir, exist_ok=True)
+        # Clips triggered within the same millisecond get numbered directories
+        self.path = base
+        number = 1
+        while True:
+            try:
+                os.mkdir(self.path)
+                break
+            except FileExistsError:
+                number += 1
+                self.path = f"{base}-{number}"
+
+        self.segment_seconds = segment_seconds
+        self.index = {'camera': name, 'reason': reason, 'trigger_time': timestamp,
+                      'start_time': None, 'end_time': None, 'segments': []}
+        self._segment = None
+        self._segment_start = None
+
+    def write(self, timestamp, jpeg):
+        if self._segment is None or timestamp - self._segment_start >= self.segment_seconds:
+            self._next_segment(timestamp)
+        self._segment.write(jpeg)
+        self.index['segments'][-1]['frames'] += 1
+        self.index['segments'][-1]['end_time'] = timestamp
+        if self.index['start_time'] is None:
+            self.index['start_time'] = timestamp
+        self.index['end_time'] = timestamp
+
+    def _next_segment(self, timestamp):
+        if self._segment is not None:
+            self._segment.close()
+        filename = f"segment-{len(self.index['segments']):03d}.mjpeg"
+        self._segment = open(os.path.join(self.path, filename), 'wb')
+        self._segment_start = timestamp
+        self.index['segments'].append({'file': filename, 'start_time': timestamp,
+                                       'end_time': timestamp, 'frames': 0})
+
+    def close(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+        with open(os.path.join(self.path, 'clip.json'), 'w') as f:
+            json.dump(self.index, f, indent=2)
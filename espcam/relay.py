@@ -0,0 +1,193 @@
+"""
+Edge relay for the /data feed.
+
+A relay keeps one upstream connection to the detection server (or to
+another relay) and serves the latest state from memory to any number of
+local dashboards:
+
+- upstream is polled over a keep-alive session with If-None-Match, so an
+  unchanged state costs an empty 304 and nothing is parsed;
+- local /data answers come from a PayloadCache, with their own ETag, 304s
+  and gzip, so relays can be chained: a room of screens behind a relay
+  behind another relay costs the detection server one connection;
+- the state is persisted with rate-limited write-behind, at most once per
+  persist_interval and only if it changed, to a temporary file renamed into
+  place, so an SD card is not rewritten every second and a crash never
+  leaves a half-written file.
+
+    relay = Relay("http://192.168.212.44:5000", "client_data.json").start()
+    payload = relay.payloads.get('json', gzip_ok=True)
+
+Each relay sets 'connected' and 'status' for its own upstream link, and
+keeps an upstream relay's disconnection visible further down the chain.
+'relay_hops' counts the relays between the dashboard and the server.
+"""
+import json
+import os
+import threading
+import time
+
+import requests
+
+from espcam.payload import PayloadCache
+
+REFRESH_INTERVAL = 1.0    # seconds between upstream polls
+PERSIST_INTERVAL = 30.0   # seconds between writes of the data file at most
+UPSTREAM_TIMEOUT = 2.0
+
+
+def write_atomic(path, data):
+    """
+    Write JSON to a temporary file next to path and rename it into place
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Relay:
+    """
+    One upstream /data subscription, cached in memory and persisted behind
+    """
+
+    def __init__(self, upstream_url, data_file=None, initial=None, refresh_interval=REFRESH_INTERVAL,
+                 persist_interval=PERSIST_INTERVAL):
+        self.upstream_url = upstream_url.rstrip('/') + '/data'
+        self.data_file = data_file
+        self.refresh_interval = refresh_interval
+        self.persist_interval = persist_interval
+
+        self.version = 0
+        self.etag = None
+        self.last_change = None
+        self.last_persist = None
+        self.upstream_requests = 0
+        self.upstream_not_modified = 0
+        self._data = dict(initial or {}, status='Initializing', connected=False)
+        self._persisted_version = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        self.payloads = PayloadCache(lambda: self.version, self.data)
+
+    def load(self):
+        """
+        Start from the last persisted state until upstream answers
+        """
+        if not self.data_file or not os.path.exists(self.data_file):
+            return self
+        try:
+            with open(self.data_file, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable {self.data_file}: {e}")
+            return self
+        with self._lock:
+            self._data = dict(data, status='Initializing (cached data)', connected=False)
+            self.version += 1
+            self._persisted_version = self.version
+        return self
+
+    def data(self):
+        with self._lock:
+            return dict(self._data)
+
+    def _set(self, data=None, **link):
+        """
+        Replace the state, or only its link fields, bumping the version if
+        anything changed
+        """
+        with self._lock:
+            new = dict(self._data if data is None else data, **link)
+            if new != self._data:
+                self._data = new
+                self.version += 1
+                self.last_change = time.time()
+
+    def _received(self, data):
+        # An upstream relay that lost the server is passed on as disconnected
+        upstream_connected = data.get('connected', True)
+        status = 'Connected' if upstream_connected else f"Upstream: {data.get('status', 'disconnected')}"
+        self._set(dict(data, relay_hops=data.get('relay_hops', 0) + 1), status=status,
+                  connected=upstream_connected)
+
+    def poll(self, session):
+        """
+        One conditional request upstream
+        """
+        headers = {'If-None-Match': f'"{self.etag}"'} if self.etag else {}
+        self.upstream_requests += 1
+        try:
+            response = session.get(self.upstream_url, headers=headers, timeout=UPSTREAM_TIMEOUT)
+            if response.status_code == 304:
+                self.upstream_not_modified += 1
+            elif response.status_code == 200:
+                # A captive portal or proxy error page can answer 200 too
+                data = response.json()
+                if not isinstance(data, dict):
+                    raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+                self._received(data)
+                self.etag = response.headers.get('ETag', '').strip('"') or None
+            else:
+                self.etag = None
+                self._set(status=f"Error: HTTP {response.status_code}", connected=False)
+        except ValueError as e:
+            # Before RequestException: requests' JSON errors are both
+            self.etag = None
+            self._set(status=f"Invalid response: {e}", connected=False)
+        except requests.exceptions.RequestException as e:
+            self.etag = None
+            self._set(status=f"Connection error: {e}", connected=False)
+
+    def _poll_loop(self):
+        session = requests.Session()  # one kept-alive upstream connection
+        while not self._stopped.is_set():
+            self.poll(session)
+            self._stopped.wait(self.refresh_interval)
+
+    def flush(self):
+        """
+        Persist the state now if it changed since the last write
+        """
+        if not self.data_file:
+            return
+        with self._lock:
+            if self.version == self._persisted_version:
+                return
+            version, data = self.version, dict(self._data)
+        try:
+            write_atomic(self.data_file, data)
+        except OSError as e:
+            print(f"Error saving {self.data_file}: {e}")
+            return
+        self._persisted_version = version
+        self.last_persist = time.time()
+
+    def _persist_loop(self):
+        while not self._stopped.wait(self.persist_interval):
+            self.flush()
+
+    def start(self):
+        for target in (self._poll_loop, self._persist_loop):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self.flush()
+
+    def status(self):
+        return {
+            'upstream': self.upstream_url,
+            'connected': self._data['connected'],
+            'version': self.version,
+            'last_change': self.last_change,
+            'last_persist': self.last_persist,
+            'upstream_requests': self.upstream_requests,
+            'upstream_not_modified': self.upstream_not_modified,
+        }
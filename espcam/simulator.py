@@ -0,0 +1,323 @@
+"""
+Local stand-in for an ESP32-CAM running human-detection/app_httpd.cpp.
+
+Serves the same endpoints as the firmware so the detection servers can be
+load-tested without boards:
+
+    /stream   multipart MJPEG on the stream port (firmware: port 81)
+    /capture  single JPEG
+    /control  ?var=framesize|quality&val=N
+    /status   JSON sensor status
+
+Recorded frames are replayed at a configurable rate, resolution and quality,
+with optional jitter, stalls and dropped connections.
+
+Usage:
+    python -m espcam.simulator test-1/detections --port 8080 --fps 10
+    # stream at http://127.0.0.1:8081/stream, control at http://127.0.0.1:8080/control
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+
+from espcam import stages
+
+# Same boundary and part header as stream_handler in app_httpd.cpp
+PART_BOUNDARY = "123456789000000000000987654321"
+STREAM_CONTENT_TYPE = "multipart/x-mixed-replace;boundary=" + PART_BOUNDARY
+STREAM_BOUNDARY = ("\r\n--" + PART_BOUNDARY + "\r\n").encode()
+STREAM_PART = "Content-Type: image/jpeg\r\nContent-Length: {}\r\nX-Timestamp: {}.{:06d}\r\n\r\n"
+
+# framesize_t values from esp32-camera's sensor.h, numbered as in the releases
+# that added FRAMESIZE_128X128 and FRAMESIZE_320X320, i.e. the driver that
+# comes with the pin_sccb_sda camera_config_t fields human-detection.ino uses
+# (sizes past UXGA only exist on 3 and 5 MP sensors and are left out)
+FRAMESIZES = {
+    0: (96, 96),      # 96X96
+    1: (160, 120),    # QQVGA
+    2: (128, 128),    # 128X128
+    3: (176, 144),    # QCIF
+    4: (240, 176),    # HQVGA
+    5: (240, 240),    # 240X240
+    6: (320, 240),    # QVGA
+    7: (320, 320),    # 320X320
+    8: (400, 296),    # CIF
+    9: (480, 320),    # HVGA
+    10: (640, 480),   # VGA
+    11: (800, 600),   # SVGA
+    12: (1024, 768),  # XGA
+    13: (1280, 720),  # HD
+    14: (1280, 1024), # SXGA
+    15: (1600, 1200), # UXGA
+}
+
+# The same sizes as numbered by older esp32-camera releases (pin_sscb_sda
+# era), before 128X128 and 320X320 were inserted
+FRAMESIZES_LEGACY = {
+    0: (96, 96),      # 96X96
+    1: (160, 120),    # QQVGA
+    2: (176, 144),    # QCIF
+    3: (240, 176),    # HQVGA
+    4: (240, 240),    # 240X240
+    5: (320, 240),    # QVGA
+    6: (400, 296),    # CIF
+    7: (480, 320),    # HVGA
+    8: (640, 480),    # VGA
+    9: (800, 600),    # SVGA
+    10: (1024, 768),  # XGA
+    11: (1280, 720),  # HD
+    12: (1280, 1024), # SXGA
+    13: (1600, 1200), # UXGA
+}
+
+
+def framesize_for(width, height, framesizes=FRAMESIZES):
+    """
+    Return the framesize_t value for a resolution (nearest by pixel count)
+    """
+    pixels = width * height
+    return min(framesizes, key=lambda size: abs(framesizes[size][0] * framesizes[size][1] - pixels))
+
+
+class SimulatedCamera:
+    """
+    Replays recorded JPEG frames with the behaviour of a flaky ESP32-CAM
+    """
+
+    def __init__(self, frames, fps=10.0, framesize=None, quality=12, jitter=0.0,
+                 stall_probability=0.0, stall_seconds=2.0, disconnect_probability=0.0, framesizes=FRAMESIZES):
+        self.source = [stages.decode_jpeg(data) for data in frames]
+        self.source = [frame for frame in self.source if frame is not None]
+        if not self.source:
+            raise ValueError("no decodable frames to replay")
+
+        self.fps = fps
+        self.jitter = jitter
+        self.stall_probability = stall_probability
+        self.stall_seconds = stall_seconds
+        self.disconnect_probability = disconnect_probability
+
+        self.framesizes = framesizes  # FRAMESIZES_LEGACY to behave like older firmware
+        self.framesize = framesize_for(640, 480, framesizes) if framesize is None else framesize
+        self.quality = quality
+        self._encoded = {}
+        self._lock = threading.Lock()
+        self.frames_sent = 0
+        self.streams = 0
+
+    def set_control(self, variable, value):
+        """
+        Apply a /control command, returns False for unknown variables
+        """
+        if variable == 'framesize':
+            if value not in self.framesizes:
+                return False
+            self.framesize = value
+        elif variable == 'quality':
+            self.quality = max(4, min(63, value))
+        else:
+            return False
+        # Cached encodes are only valid for one framesize / quality
+        self._encoded = {}
+        return True
+
+    def status(self):
+        width, height = self.framesizes[self.framesize]
+        return {
+            'framesize': self.framesize,
+            'quality': self.quality,
+            'pixformat': 4,  # PIXFORMAT_JPEG
+            'width': width,
+            'height': height,
+            'fps': self.fps,
+        }
+
+    def frame(self, index):
+        """
+        JPEG for the given index at the current framesize and quality.
+
+        Frames are encoded once per (framesize, quality) and cached, so the
+        simulator itself does not become the bottleneck of a load test.
+        """
+        key = (self.framesize, self.quality, index % len(self.source))
+        data = self._encoded.get(key)
+        if data is None:
+            width, height = self.framesizes[self.framesize]
+            frame = cv2.resize(self.source[key[2]], (width, height), interpolation=cv2.INTER_AREA)
+            # ESP32 quality runs 0-63 with lower meaning better, OpenCV is 0-100
+            data = stages.encode_jpeg(frame, quality=100 - int(self.quality * 100 / 63))
+            with self._lock:
+                self._encoded[key] = data
+        return data
+
+    def next_delay(self):
+        delay = 1.0 / self.fps
+        if self.jitter:
+            delay = max(0.0, random.gauss(delay, delay * self.jitter))
+        return delay
+
+
+def make_handler(camera):
+    """
+    Build a request handler class bound to one simulated camera
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            route = {
+                '/stream': self.stream,
+                '/capture': self.capture,
+                '/control': self.control,
+                '/status': self.status,
+            }.get(url.path)
+            if route is None:
+                self.send_error(404)
+                return
+            route(parse_qs(url.query))
+
+        def send_body(self, body, content_type, headers=None):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_chunk(self, data):
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+
+        def capture(self, query):
+            now = time.time()
+            data = camera.frame(camera.frames_sent)
+            self.send_body(data, 'image/jpeg', {
+                'Content-Disposition': 'inline; filename=capture.jpg',
+                'X-Timestamp': f"{int(now)}.{int((now % 1) * 1e6):06d}",
+            })
+
+        def control(self, query):
+            try:
+                variable = query['var'][0]
+                value = int(query['val'][0])
+            except (KeyError, ValueError):
+                self.send_error(404)
+                return
+            if not camera.set_control(variable, value):
+                self.send_error(500)
+                return
+            self.send_body(b'', 'text/html')
+
+        def status(self, query):
+            self.send_body(json.dumps(camera.status()).encode(), 'application/json')
+
+        def stream(self, query):
+            self.send_response(200)
+            self.send_header('Content-Type', STREAM_CONTENT_TYPE)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+
+            camera.streams += 1
+            index = 0
+            try:
+                while True:
+                    if random.random() < camera.disconnect_probability:
+                        break
+                    if random.random() < camera.stall_probability:
+                        time.sleep(camera.stall_seconds)
+
+                    data = camera.frame(index)
+                    now = time.time()
+                    part = STREAM_PART.format(len(data), int(now), int((now % 1) * 1e6)).encode()
+                    self.send_chunk(STREAM_BOUNDARY)
+                    self.send_chunk(part)
+                    self.send_chunk(data)
+                    camera.frames_sent += 1
+                    index += 1
+                    time.sleep(camera.next_delay())
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                camera.streams -= 1
+                # Dropping the connection without the terminating chunk
+                # looks like a Wi-Fi drop to the reader
+                self.close_connection = True
+
+    return Handler
+
+
+def start_camera(camera, host='127.0.0.1', port=8080, stream_port=None):
+    """
+    Serve a simulated camera in background threads.
+
+    Like the firmware, control endpoints are on ``port`` and the stream on
+    ``stream_port`` (port + 1 by default). Returns the two servers.
+    """
+    handler = make_handler(camera)
+    servers = [ThreadingHTTPServer((host, port), handler),
+               ThreadingHTTPServer((host, stream_port or port + 1), handler)]
+    for server in servers:
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+    return servers
+
+
+def add_camera_arguments(parser):
+    parser.add_argument('--fps', type=float, default=10.0, help="frames per second per stream")
+    parser.add_argument('--framesize', type=int, default=None, help="initial framesize_t (default VGA)")
+    parser.add_argument('--legacy-framesizes', action='store_true',
+                        help="number framesizes like esp32-camera before 128X128 and 320X320 were added")
+    parser.add_argument('--quality', type=int, default=12, help="initial JPEG quality (0-63, lower is better)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="frame interval jitter as a fraction")
+    parser.add_argument('--stall-probability', type=float, default=0.0, help="chance per frame of a stall")
+    parser.add_argument('--stall-seconds', type=float, default=2.0, help="length of a stall")
+    parser.add_argument('--disconnect-probability', type=float, default=0.0,
+                        help="chance per frame of dropping the connection")
+
+
+def camera_from_args(frames, args):
+    return SimulatedCamera(frames, fps=args.fps, framesize=args.framesize, quality=args.quality,
+                           jitter=args.jitter, stall_probability=args.stall_probability,
+                           stall_seconds=args.stall_seconds,
+                           disconnect_probability=args.disconnect_probability,
+                           framesizes=FRAMESIZES_LEGACY if args.legacy_framesizes else FRAMESIZES)
+
+
+def main(argv=None):
+    from espcam.benchmark import load_frames
+
+    parser = argparse.ArgumentParser(description="Simulate an ESP32-CAM from recorded frames")
+    parser.add_argument('sources', nargs='+', help="image folders, MJPEG dumps or video files")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080, help="control port, the stream uses port + 1")
+    add_camera_arguments(parser)
+    args = parser.parse_args(argv)
+
+    camera = camera_from_args(load_frames(args.sources), args)
+    start_camera(camera, args.host, args.port)
+    print(f"Simulated ESP32-CAM: stream on :{args.port + 1}/stream, control on :{args.port}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
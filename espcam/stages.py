@@ -0,0 +1,171 @@
+"""
+Per-frame processing stages used by the detection servers.
+
+Every server runs the same flow on each frame:
+decode -> resize -> inference -> post-processing -> drawing -> JPEG encode,
+plus JSON serialization of the detections. Keeping the stages here lets the
+offline benchmark time exactly the code the servers run.
+"""
+import json
+import time
+
+import cv2
+import numpy as np
+
+from espcam.overlay import OverlayCompositor
+
+# Set standard resolution for the cameras
+STANDARD_WIDTH = 640
+STANDARD_HEIGHT = 480
+
+# Camera calibration parameters (you'll need to calibrate your cameras), shared
+# by test-1, the cluster workers and the offline tools
+FOCAL_LENGTH_CAM1 = 100  # focal length in pixels for camera 1
+FOCAL_LENGTH_CAM2 = 100  # focal length in pixels for camera 2
+KNOWN_WIDTH_PERSON = 0.6  # average width of a person in meters
+KNOWN_WIDTH_VEHICLE = 1.5  # average width of a vehicle in meters
+
+# Shared by every stream, so label glyphs rendered for one are reused by all
+overlay = OverlayCompositor()
+
+
+def calculate_distance(bbox_width, focal_length, known_width):
+    """
+    Distance from apparent object size, returns (original, adjusted)
+    """
+    # Using the formula: distance = (known_width * focal_length) / apparent_width
+    distance = (known_width * focal_length) / bbox_width
+    adjusted_distance = distance
+    return distance, adjusted_distance
+
+
+def cam1_distance(cls, bbox_width):
+    """
+    Distance for CAM1 obstacles (people are narrower than vehicles)
+    """
+    known_width = KNOWN_WIDTH_PERSON if cls == 0 else KNOWN_WIDTH_VEHICLE
+    return calculate_distance(bbox_width, FOCAL_LENGTH_CAM1, known_width)
+
+
+def cam2_distance(cls, bbox_width):
+    """
+    Distance for CAM2 vehicles
+    """
+    return calculate_distance(bbox_width, FOCAL_LENGTH_CAM2, KNOWN_WIDTH_VEHICLE)
+
+
+# Distance estimate of each camera, cameras without calibration use CAM1's
+DISTANCE_FUNCTIONS = {'cam1': cam1_distance, 'cam2': cam2_distance}
+
+
+def decode_jpeg(data):
+    """
+    Decode JPEG bytes into a BGR frame (None if the data is not an image)
+    """
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def resize_frame(frame, width=STANDARD_WIDTH, height=STANDARD_HEIGHT):
+    """
+    Resize frame to standard resolution
+    """
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def run_inference(model, frame, **kwargs):
+    """
+    Run the YOLO model on a frame, extra keyword arguments go to predict()
+    """
+    return model(frame, **kwargs)
+
+
+def extract_detections(results, names, classes, distance_fn, scale_box=None):
+    """
+    Turn YOLO results into detection dicts for the wanted classes.
+
+    distance_fn(cls, bbox_width) returns (original_distance, adjusted_distance).
+    scale_box(x1, y1, x2, y2) maps boxes back onto the frame when the model
+    was given a preprocessed tensor instead of the frame itself.
+    """
+    detections = []
+
+    for r in results:
+        for box in r.boxes:
+            cls = int(box.cls[0])
+            if classes is not None and cls not in classes:
+                continue
+
+            if scale_box is None:
+                x1, y1, x2, y2 = map(int, box.xyxy[0])
+            else:
+                x1, y1, x2, y2 = scale_box(*map(float, box.xyxy[0]))
+            bbox_width = x2 - x1
+            if bbox_width <= 0:
+                continue
+
+            original_distance, adjusted_distance = distance_fn(cls, bbox_width)
+
+            detections.append({
+                'class': names[cls],
+                'confidence': float(box.conf[0]),
+                'original_distance': original_distance,
+                'adjusted_distance': adjusted_distance,
+                'bbox': (x1, y1, x2, y2),
+                'timestamp': time.time()
+            })
+
+    return detections
+
+
+def scale_detections(detections, scale_x, scale_y):
+    """
+    Copies of detections with their boxes scaled, e.g. from a camera frame
+    smaller than the standard resolution into it
+    """
+    return [dict(detection, bbox=(round(detection['bbox'][0] * scale_x), round(detection['bbox'][1] * scale_y),
+                                  round(detection['bbox'][2] * scale_x), round(detection['bbox'][3] * scale_y)))
+            for detection in detections]
+
+
+def draw_detections(frame, detections, color, layers=()):
+    """
+    Draw bounding boxes, distance labels and any static overlay layers onto
+    the frame in place
+    """
+    boxes = []
+    labels = []
+    for detection in detections:
+        x1, y1, x2, y2 = detection['bbox']
+        boxes.append(((x1, y1, x2, y2), color))
+        labels.append((f"{detection['class']}: {detection['adjusted_distance']:.2f}m", (x1, y1 - 10), color))
+
+    return overlay.compose(frame, boxes, labels, layers)
+
+
+def placeholder_frame(text, width=STANDARD_WIDTH, height=STANDARD_HEIGHT):
+    """
+    Grey frame with a status message, streamed while the model is not ready
+    """
+    frame = np.full((height, width, 3), 64, dtype=np.uint8)
+    (text_width, text_height), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)
+    cv2.putText(frame, text, ((width - text_width) // 2, (height + text_height) // 2),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+    return frame
+
+
+def encode_jpeg(frame, quality=None):
+    """
+    Encode a frame as JPEG bytes (None if encoding failed)
+    """
+    params = [] if quality is None else [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    ret, buffer = cv2.imencode('.jpg', frame, params)
+    if not ret:
+        return None
+    return buffer.tobytes()
+
+
+def serialize_detections(detections):
+    """
+    Serialize detections the way they are written to the JSON data files
+    """
+    return json.dumps(detections)
@@ -0,0 +1,217 @@
+"""
+Shared resolution / frame-rate variants of a camera's MJPEG stream.
+
+Every distinct (width, fps, quality) a viewer asks for gets one encoder
+thread. It annotates nothing itself: the hub draws each published frame
+once at full size, the variant downscales and JPEG-encodes it once, and all
+viewers of that variant are sent the same bytes. The encoder stops when its
+last viewer leaves. Frames keep their tracing stamps (espcam.tracing),
+marked at 'annotate' and 'encode'.
+
+    hub = StreamHub('cam1', annotate=draw_boxes)
+    hub.publish(frame, detections, stamps)     # from the inference worker
+
+    variant = hub.subscribe(width=320, fps=5, quality=60)
+    try:
+        seq = 0
+        while True:
+            seq, jpeg, stamps = variant.read(seq, timeout=1.0)
+            ...
+    finally:
+        hub.unsubscribe(variant)
+"""
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from espcam import metrics, stages, tracing
+
+MIN_WIDTH = 160
+MAX_FPS = 30.0
+MIN_FPS = 0.5
+DEFAULT_QUALITY = 80
+MIN_QUALITY = 10
+MAX_QUALITY = 95
+
+
+def parse_variant(args, max_width=stages.STANDARD_WIDTH):
+    """
+    Read w, fps and q from request arguments into a (width, fps, quality)
+    key, raising ValueError on bad input.
+
+    Values are rounded so that near-identical requests share one variant.
+    """
+    try:
+        width = int(args.get('w', max_width))
+        fps = float(args.get('fps', 0))
+        quality = int(args.get('q', DEFAULT_QUALITY))
+    except (TypeError, ValueError):
+        raise ValueError("w and q must be integers and fps a number")
+
+    if width < MIN_WIDTH:
+        raise ValueError(f"w must be at least {MIN_WIDTH}")
+    if fps < 0:
+        raise ValueError("fps must not be negative")
+    if not MIN_QUALITY <= quality <= MAX_QUALITY:
+        raise ValueError(f"q must be between {MIN_QUALITY} and {MAX_QUALITY}")
+
+    width = min(width, max_width) // 16 * 16
+    fps = 0.0 if fps == 0 else round(min(max(fps, MIN_FPS), MAX_FPS) * 2) / 2  # 0 means every frame
+    quality = quality // 5 * 5
+    return width, fps, quality
+
+
+class StreamVariant:
+    """
+    One encoder thread producing JPEGs at a given width, frame rate and quality
+    """
+
+    def __init__(self, hub, width, fps, quality):
+        self.hub = hub
+        self.width = width
+        self.fps = fps
+        self.quality = quality
+        self.viewers = 0
+
+        self._seq = 0
+        self._jpeg = None
+        self._stamps = None
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._encode_time = metrics.STAGE_SECONDS.labels(hub.name, 'encode')
+        self._thread = threading.Thread(target=self._run, name=f"{hub.name}-{width}w-{fps}fps-q{quality}")
+        self._thread.daemon = True
+
+    @property
+    def key(self):
+        return self.width, self.fps, self.quality
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        source_seq = 0
+        while not self._stop.is_set():
+            source_seq, frame, stamps = self.hub.read(source_seq, timeout=1.0)
+            if frame is None:
+                continue
+            started = time.perf_counter()
+
+            with self._encode_time.time():
+                height, width = frame.shape[:2]
+                if self.width < width:
+                    frame = cv2.resize(frame, (self.width, round(height * self.width / width)),
+                                       interpolation=cv2.INTER_AREA)
+                jpeg = stages.encode_jpeg(frame, self.quality)
+            stamps = tracing.mark(dict(stamps) if stamps else None, 'encode', self.hub.name)
+
+            if jpeg is not None:
+                with self._condition:
+                    self._seq += 1
+                    self._jpeg = jpeg
+                    self._stamps = stamps
+                    self._condition.notify_all()
+
+            if self.fps:
+                # Frames published while waiting are skipped, not queued
+                self._stop.wait(max(0.0, 1.0 / self.fps - (time.perf_counter() - started)))
+
+    def read(self, last_seq=0, timeout=None):
+        """
+        Wait for a JPEG newer than last_seq, returns (seq, jpeg, stamps) or
+        (last_seq, None, None) on timeout
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._seq > last_seq, timeout):
+                return last_seq, None, None
+            return self._seq, self._jpeg, self._stamps
+
+
+class StreamHub:
+    """
+    Latest processed frame of one camera, fanned out to stream variants
+    """
+
+    def __init__(self, name, annotate=None):
+        self.name = name
+        self.annotate = annotate
+
+        self._seq = 0
+        self._frame = None
+        self._detections = None
+        self._stamps = None
+        self._annotated = deque(maxlen=4)  # seqs of recently annotated frames
+        self._condition = threading.Condition()
+        self._annotate_lock = threading.Lock()
+        self._variants = {}
+        self._variants_lock = threading.Lock()
+        self._variant_count = metrics.STREAM_VARIANTS.labels(name)
+        self._draw_time = metrics.STAGE_SECONDS.labels(name, 'draw')
+
+    def publish(self, frame, detections, stamps=None):
+        """
+        Hand a processed frame over to the streams; the hub owns it afterwards
+        """
+        with self._condition:
+            self._seq += 1
+            self._frame = frame
+            self._detections = detections
+            self._stamps = stamps
+            self._condition.notify_all()
+
+    def read(self, last_seq=0, timeout=None):
+        """
+        Wait for a frame newer than last_seq and return (seq, frame, stamps)
+        with the frame annotated.
+
+        The first variant to read a frame draws the annotations onto it,
+        the others get the already annotated frame.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._seq > last_seq, timeout):
+                return last_seq, None, None
+            seq, frame, detections, stamps = self._seq, self._frame, self._detections, self._stamps
+
+        if self.annotate is not None:
+            with self._annotate_lock:
+                if seq not in self._annotated:
+                    with self._draw_time.time():
+                        self.annotate(frame, detections)
+                    tracing.mark(stamps, 'annotate', self.name)
+                    self._annotated.append(seq)
+        return seq, frame, stamps
+
+    def subscribe(self, width=stages.STANDARD_WIDTH, fps=0.0, quality=DEFAULT_QUALITY):
+        """
+        Join the variant for these settings, starting its encoder if needed
+        """
+        with self._variants_lock:
+            variant = self._variants.get((width, fps, quality))
+            if variant is None:
+                variant = StreamVariant(self, width, fps, quality).start()
+                self._variants[variant.key] = variant
+                self._variant_count.set(len(self._variants))
+            variant.viewers += 1
+            return variant
+
+    def unsubscribe(self, variant):
+        """
+        Leave a variant, stopping its encoder when nobody is watching
+        """
+        with self._variants_lock:
+            variant.viewers -= 1
+            if variant.viewers <= 0:
+                variant.stop()
+                self._variants.pop(variant.key, None)
+                self._variant_count.set(len(self._variants))
+
+    def variants(self):
+        with self._variants_lock:
+            return [{'width': variant.width, 'fps': variant.fps, 'quality': variant.quality,
+                     'viewers': variant.viewers} for variant in self._variants.values()]
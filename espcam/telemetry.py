@@ -0,0 +1,213 @@
+"""
+Telemetry ingest for remote distance sensors and camera nodes.
+
+Sensors open a plain TCP connection and stream little-endian binary
+frames, any number per packet:
+
+    HELLO    <B type=1> <H channel> <B length> <name, utf-8>
+    READING  <B type=2> <H channel> <d timestamp> <f value>      15 bytes
+
+HELLO names a channel for the rest of the connection, READING sends one
+value on it. The timestamp is the sensor's Unix time, 0 when it has no
+clock (the time of arrival is used then). An unknown frame type or a
+reading on an undeclared channel closes the connection.
+
+All connections are served by one asyncio loop on a thread of its own,
+so thousands of messages per second never touch the Flask threads. The
+loop writes every reading into a LatestTable, which the web threads read
+without taking a lock:
+
+    telemetry = LatestTable()
+    TelemetryServer(telemetry, port=8765).start()
+    distance = telemetry.get('cam2-node', max_age=2.0)
+
+Sensors build their frames with encode_hello() / encode_reading().
+"""
+import asyncio
+import struct
+import threading
+import time
+
+from espcam import metrics
+
+PORT = 8765
+READ_SIZE = 65536
+
+HELLO = 1
+READING = 2
+
+_HELLO = struct.Struct('<BHB')
+_READING = struct.Struct('<BHdf')
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def encode_hello(channel, name):
+    name = name.encode('utf-8')
+    if len(name) > 255:
+        raise ValueError("channel names are at most 255 bytes")
+    return _HELLO.pack(HELLO, channel, len(name)) + name
+
+
+def encode_reading(channel, value, timestamp=0.0):
+    return _READING.pack(READING, channel, timestamp, value)
+
+
+class LatestTable:
+    """
+    Newest (value, timestamp, received) reading per name.
+
+    Every update replaces one dict entry with a new tuple, a single atomic
+    operation under the GIL, so readers on other threads see the old or
+    the new reading and never a half-written one, without any lock.
+    """
+
+    def __init__(self):
+        self._readings = {}
+
+    def update(self, name, value, timestamp=None, received=None):
+        received = time.time() if received is None else received
+        self._readings[name] = (value, timestamp or received, received)
+
+    def reading(self, name):
+        return self._readings.get(name)
+
+    def get(self, name, max_age=None):
+        """
+        Latest value of name, None if there is none or it arrived more than
+        max_age seconds ago (by our clock, sensors' clocks may be off or unset)
+        """
+        reading = self._readings.get(name)
+        if reading is None or (max_age is not None and time.time() - reading[2] > max_age):
+            return None
+        return reading[0]
+
+    def snapshot(self):
+        return {name: {'value': value, 'timestamp': timestamp, 'received': received}
+                for name, (value, timestamp, received) in dict(self._readings).items()}
+
+
+def parse(buffer, channels, table, received):
+    """
+    Apply the complete frames at the start of buffer, returns the number
+    of readings and the incomplete rest
+    """
+    view = memoryview(buffer)
+    offset = 0
+    readings = 0
+    end = len(buffer)
+
+    while offset < end:
+        kind = buffer[offset]
+        if kind == READING:
+            if end - offset < _READING.size:
+                break
+            _, channel, timestamp, value = _READING.unpack_from(view, offset)
+            name = channels.get(channel)
+            if name is None:
+                raise ProtocolError(f"reading on undeclared channel {channel}")
+            table.update(name, value, timestamp, received)
+            offset += _READING.size
+            readings += 1
+        elif kind == HELLO:
+            if end - offset < _HELLO.size:
+                break
+            _, channel, length = _HELLO.unpack_from(view, offset)
+            if end - offset < _HELLO.size + length:
+                break
+            start = offset + _HELLO.size
+            channels[channel] = bytes(view[start:start + length]).decode('utf-8', errors='replace')
+            offset = start + length
+        else:
+            raise ProtocolError(f"unknown frame type {kind}")
+
+    return readings, bytes(view[offset:])
+
+
+class TelemetryServer:
+    """
+    asyncio TCP server feeding a LatestTable, on a thread of its own
+    """
+
+    def __init__(self, table, host='0.0.0.0', port=PORT):
+        self.table = table
+        self.host = host
+        self.port = port
+
+        self.connections = 0
+        self.messages = 0
+        self.errors = 0
+        self.started = None
+        self._loop = None
+        self._listening = threading.Event()
+
+    def start(self):
+        """
+        Start serving, returns once the port is open (port=0 picks a free one)
+        """
+        thread = threading.Thread(target=self._run, name="telemetry")
+        thread.daemon = True
+        thread.start()
+        self._listening.wait(5.0)
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        except OSError as e:
+            print(f"Telemetry ingest could not listen on {self.host}:{self.port}: {e}")
+            self._listening.set()
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        self.started = time.time()
+        print(f"Telemetry ingest listening on {self.host}:{self.port}")
+        self._listening.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            server.close()
+            self._loop.close()
+
+    async def _handle(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        channels = {}
+        buffer = b''
+        readings = metrics.TELEMETRY_MESSAGES.labels('reading')
+        self.connections += 1
+        metrics.TELEMETRY_CONNECTIONS.set(self.connections)
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                count, buffer = parse(buffer + data if buffer else data, channels, self.table, time.time())
+                self.messages += count
+                readings.inc(count)
+        except ProtocolError as e:
+            self.errors += 1
+            metrics.TELEMETRY_MESSAGES.labels('invalid').inc()
+            print(f"Closing telemetry connection from {peer}: {e}")
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            metrics.TELEMETRY_CONNECTIONS.set(self.connections)
+            writer.close()
+
+    def status(self):
+        uptime = time.time() - self.started if self.started else 0.0
+        return {
+            'port': self.port,
+            'connections': self.connections,
+            'messages': self.messages,
+            'errors': self.errors,
+            'messages_per_second': round(self.messages / uptime, 1) if uptime else 0.0,
+        }
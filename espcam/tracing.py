@@ -0,0 +1,71 @@
+"""
+Per-frame latency stamps from capture to the viewer.
+
+The camera reader stamps every frame with its sequence number, wall-clock
+capture time and a monotonic capture time. Each point the frame passes
+adds its own monotonic stamp and records the frame's age there in
+espcam_frame_age_seconds{camera, point}, so a histogram per point shows
+where lag builds up:
+
+    capture -> detect -> publish -> annotate -> encode -> send
+
+Stamps are plain dicts carried with the frame. Where a frame fans out
+(several stream variants, several viewers) each branch marks a copy.
+
+    stamps = dict(stamps)
+    mark(stamps, 'send', 'cam1')
+    headers = part_headers(stamps)   # X-Frame-Seq, X-Capture-Time, X-Frame-Timing
+
+Monotonic stamps only compare within this process. Viewers on other
+machines can use the wall-clock X-Capture-Time with a synchronised clock
+for glass-to-glass latency.
+"""
+import time
+
+from espcam import metrics
+
+POINTS = ('detect', 'publish', 'annotate', 'encode', 'send')
+
+
+def new_stamps(seq, capture_time, capture_monotonic):
+    return {'seq': seq, 'capture_time': capture_time, 'capture': capture_monotonic}
+
+
+def mark(stamps, point, camera=None):
+    """
+    Stamp a frame passing a point, recording its age there for the camera
+    """
+    if stamps is None:
+        return None
+    stamps[point] = time.monotonic()
+    if camera is not None:
+        metrics.FRAME_AGE.labels(camera, point).observe(stamps[point] - stamps['capture'])
+    return stamps
+
+
+def ages_ms(stamps):
+    """
+    Milliseconds from capture to each point the frame has passed
+    """
+    return {point: round((stamps[point] - stamps['capture']) * 1000.0, 1) for point in POINTS if point in stamps}
+
+
+def summary(stamps):
+    """
+    JSON-friendly trace of a frame, for /data
+    """
+    if stamps is None:
+        return None
+    return {'seq': stamps['seq'], 'capture_time': stamps['capture_time'], 'age_ms': ages_ms(stamps)}
+
+
+def part_headers(stamps):
+    """
+    Header lines for one part of a multipart MJPEG response
+    """
+    if stamps is None:
+        return b''
+    timing = ', '.join(f"{point}={age}" for point, age in ages_ms(stamps).items())
+    return (f"X-Frame-Seq: {stamps['seq']}\r\n"
+            f"X-Capture-Time: {stamps['capture_time']:.6f}\r\n"
+            f"X-Frame-Timing: {timing}\r\n").encode()
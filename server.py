@@ -1,18 +1,32 @@
-from flask import Flask, Response, render_template
+from flask import Flask, Response, render_template, jsonify
+import os
+import time
 import cv2
 import numpy as np
-from ultralytics import YOLO
+from espcam import metrics, stages
+from espcam.alerts import AlertChannel
+from espcam.camera import get_camera, health as camera_health
+from espcam.model_loader import LazyModel
+from espcam.pipeline import LATEST_ONLY, Latest, Pipeline
+from espcam.recorder import ClipRecorder
 
 app = Flask(__name__)
 
 
-ESP32_URL = "http://192.168.184.100:81/stream"  # Update this with your ESP32-CAM IP
+ESP32_URL = os.environ.get("ESP32_URL", "http://192.168.184.100:81/stream")  # Update this with your ESP32-CAM IP
 
 
-model = YOLO("yolov8m.pt")
+model = LazyModel("yolov8m.pt")  # Loaded and warmed up in the background
 
 ROI_POINTS = np.array([[100, 300], [500, 300], [600, 480], [50, 480]])
 
+# ROI outline and warning banner are rendered once, not on every frame
+overlay = stages.overlay
+overlay.add_layer("roi", lambda canvas: cv2.polylines(canvas, [ROI_POINTS], isClosed=True, color=(255, 0, 0),
+                                                      thickness=2))
+overlay.add_layer("accident_warning", lambda canvas: cv2.putText(canvas, "Accident Can Happen!", (350, 40),
+                                                                 cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2))
+
 
 FOCAL_LENGTH = 250
 KNOWN_OBJECT_WIDTH = 1.7
@@ -33,61 +47,151 @@ def estimate_distance(bbox_width):
     return None
 
 
-def generate_frames():
+CAMERA_NAME = "cam1"
+
+# When the accident warning fires, the last CLIP_PRE_ROLL seconds of the
+# stream and the CLIP_POST_ROLL seconds after it are saved under CLIP_DIR
+CLIP_DIR = os.environ.get("CLIP_DIR", "clips")
+CLIP_PRE_ROLL = float(os.environ.get("CLIP_PRE_ROLL", "5"))
+CLIP_POST_ROLL = float(os.environ.get("CLIP_POST_ROLL", "5"))
+
+# Raised/cleared accident alerts for clients that do not watch the video
+alerts = AlertChannel(CAMERA_NAME)
+
+recorder = ClipRecorder(CAMERA_NAME, CLIP_DIR, pre_roll=CLIP_PRE_ROLL, post_roll=CLIP_POST_ROLL).start()
+
+FRAMES_STREAMED = metrics.FRAMES_STREAMED.labels(CAMERA_NAME)
+VIEWERS = metrics.VIEWERS.labels(CAMERA_NAME)
+
+# Latest encoded frame, shared by every viewer
+latest_jpeg = Latest()
+
+
+def capture_frames():
+
+    # Shared connection that reconnects with backoff, the stream waits
+    # for the camera to come back instead of ending
+    camera = get_camera(CAMERA_NAME, ESP32_URL)
+    seq = 0
+    while True:
+        seq, frame, capture_time = camera.read_timed(seq, timeout=1.0)
+        if frame is None:
+            continue
+        yield {"seq": seq, "capture_time": capture_time, "frame": frame.copy()}
+
+
+def detect(item):
+
+    if not model.wait(1.0):
+        return None
+
+    # Run YOLO detection
+    results = model(item["frame"])
+    inference_done_time = time.time()
+    accident_warning = False
+    detected_distance = None
+    boxes = []
+    labels = []
+
+    for result in results:
+        for box in result.boxes:
+            x1, y1, x2, y2 = map(int, box.xyxy[0])
+            label = model.names[int(box.cls[0])]
+            confidence = box.conf[0]
+
+            # Calculate center of bounding box
+            center_x = (x1 + x2) // 2
+            center_y = (y1 + y2) // 2
+            bbox_width = x2 - x1
+
+            # Estimate distance
+            distance = estimate_distance(bbox_width)
 
-    cap = cv2.VideoCapture(ESP32_URL)
+            # Detect objects inside ROI
+            if label in ["person", "dog", "cat", "car", "truck"] and is_inside_roi(center_x, center_y):
+                accident_warning = True
+                detected_distance = distance
 
-    while cap.isOpened():
-        success, frame = cap.read()
-        if not success:
-            break
+                boxes.append(((x1, y1, x2, y2), (0, 255, 0)))
+                labels.append((f"{label} {confidence:.2f}", (x1, y1 - 10), (0, 255, 0)))
+                labels.append((f"Dist: {distance:.2f}m", (x1, y2 + 20), (0, 255, 0)))
 
-        # Run YOLO detection
-        results = model(frame)
-        accident_warning = False
-        detected_distance = None
+    item["warning"] = bool(accident_warning and detected_distance)
+    item["distance"] = detected_distance
+    item["boxes"] = boxes
+    item["labels"] = labels
 
+    # Alert subscribers as soon as the verdict is known, before drawing
+    alerts.update(item["warning"], item["capture_time"], inference_done_time, distance=detected_distance)
+    return item
 
-        cv2.polylines(frame, [ROI_POINTS], isClosed=True, color=(255, 0, 0), thickness=2)
 
-        for result in results:
-            for box in result.boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                label = model.names[int(box.cls[0])]
-                confidence = box.conf[0]
+def draw(item):
 
-                # Calculate center of bounding box
-                center_x = (x1 + x2) // 2
-                center_y = (y1 + y2) // 2
-                bbox_width = x2 - x1
+    # Display warning message & distance at the top-right, inside frame
+    layers = ["roi"]
+    labels = item["labels"]
+    if item["warning"]:
+        layers.append("accident_warning")
+        labels.append((f"Distance: {item['distance']}m", (350, 70), (0, 255, 255), 0.8))
 
-                # Estimate distance
-                distance = estimate_distance(bbox_width)
+    # Draw the ROI, boxes and labels in one pass
+    overlay.compose(item["frame"], item["boxes"], labels, layers)
+    return item
 
-                # Detect objects inside ROI
-                if label in ["person", "dog", "cat", "car", "truck"] and is_inside_roi(center_x, center_y):
-                    accident_warning = True
-                    detected_distance = distance
 
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    cv2.putText(frame, f"{label} {confidence:.2f}", (x1, y1 - 10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                    cv2.putText(frame, f"Dist: {distance:.2f}m", (x1, y2 + 20),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+def encode(item):
 
-        # Display warning message & distance at the top-right, inside frame
-        if accident_warning and detected_distance:
-            cv2.putText(frame, "Accident Can Happen!", (350, 40),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-            cv2.putText(frame, f"Distance: {detected_distance}m", (350, 70),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2)
+    frame_bytes = stages.encode_jpeg(item["frame"])
+    if frame_bytes is None:
+        return None
 
-        
-        ret, buffer = cv2.imencode(".jpg", frame)
-        if not ret:
+    # The streamed JPEG doubles as evidence, nothing is encoded twice
+    recorder.add(time.time(), item["seq"], frame_bytes)
+    if item["warning"]:
+        recorder.trigger(f"Accident Can Happen! Distance: {item['distance']}m")
+
+    latest_jpeg.publish(frame_bytes)
+    return None
+
+
+# One capture -> inference -> draw -> encode chain for every viewer. Each
+# stage keeps only the newest frame when the next one is still busy
+pipeline = (Pipeline(CAMERA_NAME)
+            .source("capture", capture_frames)
+            .stage("inference", detect, policy=LATEST_ONLY)
+            .stage("draw", draw, policy=LATEST_ONLY)
+            .stage("encode", encode, policy=LATEST_ONLY))
+
+
+def generate_frames():
+
+    model.start()
+    pipeline.start()
+    VIEWERS.inc()
+    try:
+        yield from stream_frames()
+    finally:
+        VIEWERS.dec()
+
+
+def stream_frames():
+
+    seq = 0
+    while True:
+        if not model.ready:
+            # Keep the viewer informed while the model loads
+            frame_bytes = stages.encode_jpeg(stages.placeholder_frame(f"Model {model.state.replace('_', ' ')}..."))
+            yield (b"--frame\r\n"
+                   b"Content-Type: image/jpeg\r\n\r\n" + frame_bytes + b"\r\n")
+            model.wait(1.0)
+            continue
+
+        seq, frame_bytes = latest_jpeg.read(seq, timeout=1.0)
+        if frame_bytes is None:
             continue
 
-        frame_bytes = buffer.tobytes()
+        FRAMES_STREAMED.inc()
         yield (b"--frame\r\n"
                b"Content-Type: image/jpeg\r\n\r\n" + frame_bytes + b"\r\n")
 
@@ -102,5 +206,32 @@ def video_feed():
     return Response(generate_frames(), mimetype="multipart/x-mixed-replace; boundary=frame")
 
 
+@app.route("/alerts")
+def alert_stream():
+    # Server-Sent Events: alert_state on connect, then alert_raised / alert_cleared
+    return Response(alerts.stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/status")
+def status():
+    return jsonify({"model": model.status(), "cameras": camera_health(), "recorder": recorder.status(),
+                    "alerts": alerts.state(), "pipeline": pipeline.status()})
+
+
+@app.route("/cameras")
+def cameras_health():
+    return jsonify(camera_health())
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+
 if __name__ == "__main__":
+    # With the debug reloader only the child process serves requests
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        model.start()
+        pipeline.start()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -39,11 +39,17 @@ last_image_update = 0
 def fetch_data_thread():
     """Background thread to periodically fetch data from the admin server"""
     global latest_data, latest_monitor_image, latest_monitor_image_path, last_image_update
+    etag = None
     while True:
         try:
-            # Fetch JSON data
-            response = requests.get(f"{ADMIN_SERVER_URL}/data", timeout=2)
-            if response.status_code == 200:
+            # Fetch JSON data, unchanged data comes back as an empty 304
+            headers = {'If-None-Match': etag} if etag else {}
+            response = requests.get(f"{ADMIN_SERVER_URL}/data", headers=headers, timeout=2)
+            if response.status_code == 304:
+                latest_data['status'] = 'Connected'
+                latest_data['connected'] = True
+            elif response.status_code == 200:
+                etag = response.headers.get('ETag')
                 data = response.json()
                 # Remove closest distances
                 data.pop('closest_obstacle_distance', None)
@@ -63,6 +69,7 @@ def fetch_data_thread():
                 with open(DATA_FILE, 'w') as f:
                     json.dump(latest_data, f)
             else:
+                etag = None
                 latest_data['status'] = f"Error: HTTP {response.status_code}"
                 latest_data['connected'] = False
 
@@ -1,19 +1,25 @@
-from flask import Flask, render_template, jsonify
-import requests
+from flask import Flask, render_template, jsonify, request, Response
+import atexit
 import time
-import threading
-import json
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from espcam.payload import FULL
+from espcam.relay import Relay
 
 app = Flask(__name__)
 
 # Configuration
-ADMIN_SERVER_URL = "http://192.168.212.44:5000/"  # Change this to the admin server IP
+# Detection server, or another client.py to chain relays (one upstream connection per relay)
+ADMIN_SERVER_URL = os.environ.get("UPSTREAM_URL", "http://192.168.212.44:5000/")  # Change this to the admin server IP
 REFRESH_INTERVAL = 1.0  # Time in seconds between data refreshes
+PERSIST_INTERVAL = float(os.environ.get("PERSIST_INTERVAL", "30"))  # Seconds between writes of DATA_FILE at most
 DATA_FILE = "client_data.json"
+PORT = int(os.environ.get("PORT", "8080"))
 
-# Global variables for caching data
-latest_data = {
+# Shown until the first upstream answer (or the saved data) arrives
+INITIAL_DATA = {
     'cam1_detections': [],
     'cam2_detections': [],
     'closest_obstacle_distance': 0,
@@ -21,35 +27,11 @@ latest_data = {
     'camera_distance': 1.0,
     'total_distance': 1.0,
     'timestamp': time.time(),
-    'status': 'Initializing',
-    'connected': False
 }
 
-
-def fetch_data_thread():
-    """Background thread to periodically fetch data from the admin server"""
-    global latest_data
-
-    while True:
-        try:
-            response = requests.get(f"{ADMIN_SERVER_URL}/data", timeout=2)
-            if response.status_code == 200:
-                data = response.json()
-                data['status'] = 'Connected'
-                data['connected'] = True
-                latest_data = data
-
-                # Save to file for persistence
-                with open(DATA_FILE, 'w') as f:
-                    json.dump(latest_data, f)
-            else:
-                latest_data['status'] = f"Error: HTTP {response.status_code}"
-                latest_data['connected'] = False
-        except requests.exceptions.RequestException as e:
-            latest_data['status'] = f"Connection error: {str(e)}"
-            latest_data['connected'] = False
-
-        time.sleep(REFRESH_INTERVAL)
+# One upstream subscription shared by every local dashboard
+relay = Relay(ADMIN_SERVER_URL, DATA_FILE, INITIAL_DATA, refresh_interval=REFRESH_INTERVAL,
+              persist_interval=PERSIST_INTERVAL)
 
 
 @app.route('/')
@@ -60,8 +42,28 @@ def index():
 
 @app.route('/data')
 def get_data():
-    """API endpoint to get the latest fetched data"""
-    return jsonify(latest_data)
+    """API endpoint to get the latest fetched data, from memory, with ETag/304 and gzip"""
+    try:
+        payload = relay.payloads.get(request.args.get('format', FULL),
+                                     gzip_ok='gzip' in request.headers.get('Accept-Encoding', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except ImportError:
+        return jsonify({'error': "msgpack is not installed on the relay"}), 501
+
+    response = Response(payload.body, content_type=payload.content_type)
+    response.set_etag(payload.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    if payload.encoding:
+        response.headers['Content-Encoding'] = payload.encoding
+    return response.make_conditional(request)
+
+
+@app.route('/relay')
+def relay_status():
+    """Upstream link and persistence state of this relay"""
+    return jsonify(relay.status())
 
 
 def create_templates():
@@ -292,22 +294,12 @@ def main():
     # Create necessary template files
     create_templates()
 
-    # Try to load any previously saved data
-    global latest_data
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                latest_data = json.load(f)
-        except json.JSONDecodeError:
-            pass
-
-    # Start data fetching thread
-    data_thread = threading.Thread(target=fetch_data_thread)
-    data_thread.daemon = True
-    data_thread.start()
+    # Serve the previously saved data until upstream answers
+    relay.load().start()
+    atexit.register(relay.stop)  # save the latest state on the way out
 
     # Start Flask app
-    app.run(host='0.0.0.0', port=8080, debug=False, threaded=True)
+    app.run(host='0.0.0.0', port=PORT, debug=False, threaded=True)
 
 
 if __name__ == '__main__':
@@ -1,36 +1,73 @@
 import cv2
 import numpy as np
 import time
-from flask import Flask, render_template, Response, jsonify
-from ultralytics import YOLO
+from flask import Flask, render_template, Response, jsonify, request
 import math
 import threading
-import queue
 import json
+import hmac
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from espcam import autotune, metrics, profiler, stages, tracing
+from espcam.fusion import FusionEngine
+from espcam.heatmap import ALL, DECAY, OccupancyHeatmap
+from espcam.incremental import TiledDetector
+from espcam.model_loader import LazyModel
+from espcam.negotiate import CameraNegotiator
+from espcam.payload import FULL, PayloadCache
+from espcam.pipeline import BLOCK, DROP_OLDEST, Pipeline
+from espcam.preprocess import LetterboxBuffer
+from espcam.profiles import ProfileStore
+from espcam.streams import StreamHub, parse_variant
+from espcam.telemetry import LatestTable, TelemetryServer
+from espcam.camera import get_camera, health as camera_health
 
 app = Flask(__name__)
 
 # Configuration
-CAM1_URL = "http://192.168.212.194:81/stream"  # Using your provided URL
-CAM2_URL = "http://192.168.212.100:81/stream"  # Replace with your ESP32 CAM2 IP stream URL
+CAM1_URL = os.environ.get("CAM1_URL", "http://192.168.212.194:81/stream")  # Using your provided URL
+CAM2_URL = os.environ.get("CAM2_URL", "http://192.168.212.100:81/stream")  # Replace with your ESP32 CAM2 IP stream URL
 
 # Distance between cameras (in meters)
 CAMERA_DISTANCE = 1.0  # As specified in your requirement
 
+# Fusion of the two cameras' distances
+FUSION_MAX_SKEW = 0.5  # Max seconds between the two cameras' frames to combine them
+FUSION_MAX_AGE = 2.0  # Seconds after which a camera's detections are ignored
+
 # Set standard resolution for both cameras
-STANDARD_WIDTH = 640
-STANDARD_HEIGHT = 480
+STANDARD_WIDTH = stages.STANDARD_WIDTH
+STANDARD_HEIGHT = stages.STANDARD_HEIGHT
+
+# Initialize YOLOv8 model (loaded and warmed up in the background by main())
+MODEL_PATH = "yolov8n.pt"  # Using the nano version, you can use s, m, l, or x for better accuracy
+model = LazyModel(MODEL_PATH)
+
+# Set AUTOTUNE=1 to benchmark torch threads, inference workers and CPU affinity
+# at startup (the result is saved per host and model, AUTOTUNE_RETUNE=1 redoes it)
+AUTOTUNE = os.environ.get("AUTOTUNE", "0") == "1"
+AUTOTUNE_RETUNE = os.environ.get("AUTOTUNE_RETUNE", "0") == "1"
 
-# Initialize YOLOv8 model
-model = YOLO("yolov8n.pt")  # Using the nano version, you can use s, m, l, or x for better accuracy
+# Set INCREMENTAL=1 to re-run detection only on the parts of the frame that
+# changed since they were last inferred (the cameras are fixed, so most of
+# the picture is static); the whole frame is still inferred every few seconds
+INCREMENTAL = os.environ.get("INCREMENTAL", "0") == "1"
 
-# Camera calibration parameters (you'll need to calibrate your cameras)
-# These are placeholder values - you'll need to replace with actual calibrated values
-FOCAL_LENGTH_CAM1 = 100  # focal length in pixels for camera 1
-FOCAL_LENGTH_CAM2 = 100  # focal length in pixels for camera 2
-KNOWN_WIDTH_PERSON = 0.6  # average width of a person in meters
-KNOWN_WIDTH_VEHICLE = 1.5  # average width of a vehicle in meters
+# Bearer token for the /admin endpoints, which are disabled when it is not set
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Set CAMERA_NEGOTIATE=1 to have the cameras send frames no larger than the
+# model input and compress harder while inference is dropping frames, through
+# their /control endpoint (see espcam/negotiate.py)
+CAMERA_NEGOTIATE = os.environ.get("CAMERA_NEGOTIATE", "0") == "1"
+
+# Set TELEMETRY_PORT to accept range sensor readings next to the cameras (see
+# espcam/telemetry.py); a fresh reading named like in RANGE_SENSORS, in meters,
+# replaces that camera's vision estimate in the fused distance
+TELEMETRY_PORT = int(os.environ.get("TELEMETRY_PORT", "0"))
+RANGE_SENSORS = {'cam1': 'cam1-range', 'cam2': 'cam2-range'}
 
 # Classes for obstacle detection (CAM1) - adjust based on your needs
 OBSTACLE_CLASSES = [0, 1, 2, 3, 5, 7]  # person, bicycle, car, motorcycle, bus, truck as obstacles
@@ -38,11 +75,26 @@ OBSTACLE_CLASSES = [0, 1, 2, 3, 5, 7]  # person, bicycle, car, motorcycle, bus,
 # Classes for vehicle detection (CAM2)
 VEHICLE_CLASSES = [2, 3, 5, 7]  # car, motorcycle, bus, truck
 
-# Queues for frames and results
-cam1_queue = queue.Queue(maxsize=10)
-cam2_queue = queue.Queue(maxsize=10)
-cam1_results_queue = queue.Queue(maxsize=10)
-cam2_results_queue = queue.Queue(maxsize=10)
+# Box/label colour of each camera's stream
+CAM_COLORS = {'cam1': (0, 0, 255), 'cam2': (255, 0, 0)}  # Red for obstacles, blue for vehicles
+
+# Per-camera detection profiles, applied inside inference/NMS and
+# adjustable at runtime through /profiles/<cam>
+profiles = ProfileStore({
+    'cam1': {'classes': OBSTACLE_CLASSES},
+    'cam2': {'classes': VEHICLE_CLASSES},
+})
+
+# Capture -> detect -> publish pipeline of each camera, built by start_pipeline()
+pipelines = {}
+
+# Camera framesize / quality, matched to each profile's imgsz and the detect stage's drops
+camera_urls = {'cam1': CAM1_URL, 'cam2': CAM2_URL}
+negotiator = CameraNegotiator(camera_urls,
+                              imgsz=lambda cam_name: profiles.get(cam_name)['imgsz'],
+                              stage=lambda cam_name: pipelines[cam_name].stages[0] if cam_name in pipelines else None,
+                              reopen=lambda cam_name: get_camera(cam_name, camera_urls[cam_name]).reopen(),
+                              frame_size=lambda cam_name: get_camera(cam_name, camera_urls[cam_name]).frame_size)
 
 # File paths for storing JSON data
 DATA_DIR = 'data'
@@ -52,304 +104,469 @@ COMBINED_DATA_FILE = os.path.join(DATA_DIR, 'combined_detections.json')
 
 DETECTIONS_DIR = 'detections'  # Directory to save images
 
-os.makedirs(DETECTIONS_DIR, exist_ok=True)
+# Range sensor readings, fed by the telemetry ingest when TELEMETRY_PORT is set
+telemetry = LatestTable()
+telemetry_server = TelemetryServer(telemetry, port=TELEMETRY_PORT)
 
+# Time-aligned closest distances from both cameras
+fusion = FusionEngine('cam1', 'cam2', CAMERA_DISTANCE, max_skew=FUSION_MAX_SKEW, max_age=FUSION_MAX_AGE,
+                      measured=lambda cam_name: telemetry.get(RANGE_SENSORS[cam_name], max_age=FUSION_MAX_AGE))
+combined_file_lock = threading.Lock()
 
+# /data bodies, serialized once per fused state change instead of on every poll
+data_payloads = PayloadCache(lambda: (fusion.version, tuple(fusion.stale_cameras()), fusion.measured_distances()),
+                             fusion.snapshot)
 
-def save_obstacle_image(frame, cls_name):
-    """
-    Save detected obstacle image with timestamp.
-    """
-    timestamp = int(time.time())
-    filename = f"{cls_name}_{timestamp}.jpg"
-    filepath = os.path.join(DETECTIONS_DIR, filename)
-    cv2.imwrite(filepath, frame)
-    print(f"Saved obstacle image: {filepath}")
+os.makedirs(DETECTIONS_DIR, exist_ok=True)
 
 
-def calculate_distance(bbox_width, focal_length, known_width):
+def annotator(cam_name):
     """
-    Calculate distance based on apparent object size
+    Draws a camera's boxes and distances onto a frame in place
     """
-    # Using the formula: distance = (known_width * focal_length) / apparent_width
-    distance = (known_width * focal_length) / bbox_width
+    def annotate(frame, detections):
+        # Boxes are in standard resolution pixels, a negotiated camera's frame may be smaller
+        height, width = frame.shape[:2]
+        if (width, height) != (STANDARD_WIDTH, STANDARD_HEIGHT):
+            detections = stages.scale_detections(detections, width / STANDARD_WIDTH, height / STANDARD_HEIGHT)
+        stages.draw_detections(frame, detections, CAM_COLORS[cam_name])
+    return annotate
+
+
+# Processed frames of each camera, shared by every /video_feed variant
+stream_hubs = {cam_name: StreamHub(cam_name, annotator(cam_name)) for cam_name in CAM_COLORS}
 
-    # Add 20 meters as per requirement
-    adjusted_distance = distance
+# Where each class shows up in each camera's view, see /heatmap/<cam>
+heatmaps = {cam_name: OccupancyHeatmap(cam_name, STANDARD_WIDTH, STANDARD_HEIGHT) for cam_name in CAM_COLORS}
 
-    return distance,adjusted_distance
 
 
-def resize_frame(frame, width=STANDARD_WIDTH, height=STANDARD_HEIGHT):
+def save_obstacle_image(frame, cls_name):
     """
-    Resize frame to standard resolution
+    Save detected obstacle image with timestamp.
     """
-    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    timestamp = int(time.time())
+    filename = f"{cls_name}_{timestamp}.jpg"
+    filepath = os.path.join(DETECTIONS_DIR, filename)
+    cv2.imwrite(filepath, frame)
+    print(f"Saved obstacle image: {filepath}")
 
 
-def capture_camera_feed(cam_url, output_queue):
+def capture_camera_feed(cam_url, cam_name):
     """
-    Capture feed from IP camera and put frames into queue
+    Capture feed from IP camera, yielding frames no larger than the standard
+    resolution (a negotiated camera's smaller frames are kept as they are)
     """
-    cap = cv2.VideoCapture(cam_url)
-
-    if not cap.isOpened():
-        print(f"Error: Unable to open camera feed at {cam_url}")
-        return
+    # The connection manager reconnects with backoff while the camera is down
+    camera = get_camera(cam_name, cam_url)
+    seq = 0
 
     while True:
-        ret, frame = cap.read()
-        if not ret:
-            print(f"Error: Could not read frame from {cam_url}")
-            time.sleep(1)  # Wait before retrying
-            cap = cv2.VideoCapture(cam_url)  # Try to reconnect
+        seq, frame, stamps = camera.read_stamped(seq, timeout=1.0)
+        if frame is None:
             continue
 
-        # Resize frame to standard resolution
-        frame = resize_frame(frame, STANDARD_WIDTH, STANDARD_HEIGHT)
-
-        # If queue is full, remove old frame
-        if output_queue.full():
-            try:
-                output_queue.get_nowait()
-            except queue.Empty:
-                pass
+        # Shrink larger frames to standard resolution; smaller ones are not scaled
+        # up, the detect stage maps their boxes into it instead
+        if frame.shape[0] > STANDARD_HEIGHT or frame.shape[1] > STANDARD_WIDTH:
+            frame = stages.resize_frame(frame, STANDARD_WIDTH, STANDARD_HEIGHT)
+        else:
+            frame = frame.copy()  # the camera's frame is shared with other readers
 
-        output_queue.put(frame)
+        # The stamps follow the frame to the viewers (see espcam.tracing)
+        yield {'capture_time': stamps['capture_time'], 'frame': frame, 'stamps': stamps}
         time.sleep(0.1)  # Reduce CPU usage
 
 
-def process_frames(input_queue, output_queue, is_cam1, json_file_path):
+def frame_detector(is_cam1, detector=None, worker_index=0, inference_config=autotune.DEFAULT_CONFIG):
     """
-    Process frames with YOLOv8 and calculate distances
+    Detection stage function of one worker: runs YOLOv8 on a frame and
+    calculates distances
     """
-    while True:
-        if not input_queue.empty():
-            frame = input_queue.get()
+    # Workers running in parallel each need their own model instance
+    detector = detector or model
+    autotune.pin_worker(inference_config, worker_index)
+
+    cam_name = 'cam1' if is_cam1 else 'cam2'
+    # CAM1 - Obstacles, CAM2 - Vehicles; calibration in espcam/stages.py
+    camera_distance = stages.cam1_distance if is_cam1 else stages.cam2_distance
+
+    # Size of the frame being detected and its scale to the standard
+    # resolution, which the distance calibration and the heatmaps are in
+    frame_shape = (STANDARD_HEIGHT, STANDARD_WIDTH)
+    frame_scale = (1.0, 1.0)
+
+    def distance_fn(cls, bbox_width):
+        return camera_distance(cls, bbox_width * frame_scale[0])
+
+    preprocess_time = metrics.STAGE_SECONDS.labels(cam_name, 'preprocess')
+    inference_time = metrics.STAGE_SECONDS.labels(cam_name, 'inference')
+    postprocess_time = metrics.STAGE_SECONDS.labels(cam_name, 'postprocess')
+
+    # This worker's reusable model input, frames are letterboxed into it in place
+    input_buffer = None
+
+    # Profile settings of the frame being detected
+    predict_kwargs = {}
+
+    def predict(images, imgsz):
+        """
+        Detections of each image; a single full frame goes through the
+        preallocated input, crops from incremental mode are batched as is
+        """
+        nonlocal input_buffer
+        start = time.perf_counter()
+        if len(images) == 1 and images[0].shape[:2] == frame_shape:
+            # An exported model only takes the square input it was exported at
+            square = detector.static_shape == (imgsz, imgsz)
+            if input_buffer is None or input_buffer.imgsz != imgsz or input_buffer.square != square:
+                input_buffer = LetterboxBuffer(imgsz, square=square)
+            model_input = input_buffer.fill(images[0])
+            scale_box = input_buffer.scale_box
+        else:
+            model_input = images
+            scale_box = None
+        preprocess_done = time.perf_counter()
+        preprocess_time.observe(preprocess_done - start)
+
+        results = stages.run_inference(detector, model_input, imgsz=imgsz, **predict_kwargs)
+        inference_done = time.perf_counter()
+        inference_time.observe(inference_done - preprocess_done)
+
+        # The profile already limited the results to this camera's classes
+        detections = [stages.extract_detections([result], detector.names, None, distance_fn, scale_box=scale_box)
+                      for result in results]
+        postprocess_time.observe(time.perf_counter() - inference_done)
+        return detections
+
+    # Each worker keeps its own cache, it compares frames with the ones it inferred
+    tiled = TiledDetector(predict, cam_name) if INCREMENTAL else None
+
+    def detect(item):
+        nonlocal predict_kwargs, frame_shape, frame_scale
+        if not detector.wait(1.0):
+            return None  # still loading, the frame is dropped
+
+        kwargs = dict(profiles.predict_kwargs(cam_name, detector.names))
+        imgsz = kwargs.pop('imgsz')
+        if tiled is not None and kwargs != predict_kwargs:
+            tiled.reset()  # cached detections were made under the old profile
+        predict_kwargs = kwargs
+        frame_shape = item['frame'].shape[:2]
+        frame_scale = (STANDARD_WIDTH / frame_shape[1], STANDARD_HEIGHT / frame_shape[0])
+        if tiled is not None:
+            detections = tiled.detect(item['frame'], imgsz)
+        else:
+            detections = predict([item['frame']], imgsz)[0]
+        if frame_scale != (1.0, 1.0):
+            detections = stages.scale_detections(detections, *frame_scale)
+        item['detections'] = detections
+        tracing.mark(item['stamps'], 'detect', cam_name)
+        return item
 
-            # Run YOLOv8 on the frame
-            results = model(frame)
+    return detect
 
-            # Process results
-            processed_frame = frame.copy()
-            detections = []
 
-            for r in results:
-                boxes = r.boxes
+def result_publisher(cam_name, hub, json_file_path):
+    """
+    Last stage: saves the detections, hands the frame to the video feeds
+    and fuses the distances with the other camera's
+    """
+    frames_processed = metrics.FRAMES_PROCESSED.labels(cam_name)
 
-                for box in boxes:
-                    cls = int(box.cls[0])
-                    conf = float(box.conf[0])
+    def publish(item):
+        detections = item['detections']
+        stamps = tracing.mark(item['stamps'], 'publish', cam_name)
 
-                    # Check if the class is what we're looking for
-                    if (is_cam1 and cls in OBSTACLE_CLASSES) or (not is_cam1 and cls in VEHICLE_CLASSES):
-                        x1, y1, x2, y2 = map(int, box.xyxy[0])
+        # Save detections to JSON file
+        with open(json_file_path, 'w') as f:
+            f.write(stages.serialize_detections(detections))
+        frames_processed.inc()
 
-                        # Calculate width of bounding box
-                        bbox_width = x2 - x1
+        # Boxes are drawn by the video feeds, only on frames a viewer actually gets
+        hub.publish(item['frame'], detections, dict(stamps))  # the streams mark their own copy
+        heatmaps[cam_name].update(detections, item['capture_time'])
 
-                        # Determine which objects to track
-                        if is_cam1:  # CAM1 - Obstacles
-                            known_width = KNOWN_WIDTH_PERSON if cls == 0 else KNOWN_WIDTH_VEHICLE
-                            focal_length = FOCAL_LENGTH_CAM1
-                            color = (0, 0, 255)  # Red for obstacles
-                        else:  # CAM2 - Vehicles
-                            known_width = KNOWN_WIDTH_VEHICLE
-                            focal_length = FOCAL_LENGTH_CAM2
-                            color = (255, 0, 0)  # Blue for vehicles
+        # Fuse with the other camera's detections and update the combined file
+        fusion.update(cam_name, item['capture_time'], detections, stamps)
+        update_combined_data()
 
-                        # Calculate distances
-                        original_distance, adjusted_distance = calculate_distance(bbox_width, focal_length, known_width)
+    return publish
 
-                        # Draw bounding box
-                        cv2.rectangle(processed_frame, (x1, y1), (x2, y2), color, 2)
 
-                        # Get class name
-                        cls_name = model.names[cls]
+def update_combined_data():
+    """
+    Update the combined data file with the latest fused total distance
+    """
+    try:
+        combined_data = fusion.snapshot()
 
-                        # Draw text with distance
-                        text = f"{cls_name}: {adjusted_distance:.2f}m"
-                        cv2.putText(processed_frame, text, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+        # Save to combined file
+        with combined_file_lock:
+            with open(COMBINED_DATA_FILE, 'w') as f:
+                json.dump(combined_data, f)
 
-                        # Store detection info
-                        detections.append({
-                            'class': cls_name,
-                            'confidence': conf,
-                            'original_distance': original_distance,
-                            'adjusted_distance': adjusted_distance,
-                            'bbox': (x1, y1, x2, y2),
-                            'timestamp': time.time()
-                        })
+    except Exception as e:
+        print(f"Error updating combined data: {e}")
 
-            # Save detections to JSON file
-            with open(json_file_path, 'w') as f:
-                json.dump(detections, f)
 
-            # Put processed frame and detections in output queue
-            if output_queue.full():
-                try:
-                    output_queue.get_nowait()
-                except queue.Empty:
-                    pass
+def generate_frames(hub, variant_key):
+    """
+    Generator function for streaming processed frames of one variant
+    """
+    viewers = metrics.VIEWERS.labels(hub.name)
+    frames_streamed = metrics.FRAMES_STREAMED.labels(hub.name)
 
-            output_queue.put((processed_frame, detections))
+    viewers.inc()
+    variant = None
+    try:
+        seq = 0
+        while True:
+            if not model.ready:
+                # Show the viewer something while the model loads
+                frame_bytes = stages.encode_jpeg(stages.placeholder_frame(f"Model {model.state.replace('_', ' ')}..."))
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+                model.wait(1.0)
+                continue
+
+            if variant is None:
+                variant = hub.subscribe(*variant_key)
+
+            # Every viewer of the variant is sent the same encoded frame
+            seq, frame_bytes, stamps = variant.read(seq, timeout=1.0)
+            if frame_bytes is None:
+                continue
+
+            # Each part carries the frame's seq, capture time and ages (ms since capture)
+            stamps = tracing.mark(dict(stamps) if stamps else None, 'send', hub.name)
+            frames_streamed.inc()
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n' + tracing.part_headers(stamps) + b'\r\n' + frame_bytes + b'\r\n')
+    finally:
+        if variant is not None:
+            hub.unsubscribe(variant)
+        viewers.dec()
 
-            # Update combined data file with total distance calculation
-            update_combined_data()
 
-        time.sleep(0.05)  # Small delay to reduce CPU usage
+@app.route('/')
+def index():
+    """
+    Main dashboard page
+    """
+    return render_template('index.html')
 
 
-def update_combined_data():
+@app.route('/video_feed/<cam>')
+def video_feed(cam):
     """
-    Update the combined data file with calculations for total distance
+    Route for streaming CAM1 (obstacles) or CAM2 (vehicles).
+
+    Optional ?w= (width), ?fps= and ?q= (JPEG quality) pick a lighter
+    variant, e.g. /video_feed/cam1?w=320&fps=5&q=60 for phones.
     """
+    if cam not in stream_hubs:
+        return jsonify({'error': f"unknown camera {cam}"}), 404
     try:
-        # Read cam1 data
-        if os.path.exists(CAM1_DATA_FILE):
-            with open(CAM1_DATA_FILE, 'r') as f:
-                cam1_data = json.load(f)
-        else:
-            cam1_data = []
+        variant_key = parse_variant(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-        # Read cam2 data
-        if os.path.exists(CAM2_DATA_FILE):
-            with open(CAM2_DATA_FILE, 'r') as f:
-                cam2_data = json.load(f)
-        else:
-            cam2_data = []
+    return Response(generate_frames(stream_hubs[cam], variant_key),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
-        # Calculate closest obstacles and vehicles
-        closest_obstacle_distance = float('inf')
-        closest_vehicle_distance = float('inf')
 
-        for detection in cam1_data:
-            if detection['adjusted_distance'] < closest_obstacle_distance:
-                closest_obstacle_distance = detection['adjusted_distance']
+@app.route('/video_feed/variants')
+def video_feed_variants():
+    """
+    Stream variants currently being encoded, with their viewer counts
+    """
+    return jsonify({cam: hub.variants() for cam, hub in stream_hubs.items()})
 
-        for detection in cam2_data:
-            if detection['adjusted_distance'] < closest_vehicle_distance:
-                closest_vehicle_distance = detection['adjusted_distance']
 
-        # Handle cases where no detections are available
-        if closest_obstacle_distance == float('inf'):
-            closest_obstacle_distance = 0
+@app.route('/status')
+def status():
+    """
+    Model loading state, so clients can show "warming up" instead of an error
+    """
+    return jsonify({'model': model.status(), 'cameras': camera_health(),
+                    'pipelines': {name: pipeline.status() for name, pipeline in pipelines.items()},
+                    'negotiation': negotiator.status() if CAMERA_NEGOTIATE else None,
+                    'telemetry': telemetry_server.status() if TELEMETRY_PORT else None})
 
-        if closest_vehicle_distance == float('inf'):
-            closest_vehicle_distance = 0
 
-        # Calculate total distance
-        total_distance = closest_obstacle_distance + closest_vehicle_distance + CAMERA_DISTANCE
+@app.route('/profiles')
+def get_profiles():
+    """
+    Detection profiles of every camera
+    """
+    return jsonify(profiles.all())
 
-        # Create combined data
-        combined_data = {
-            'cam1_detections': cam1_data,
-            'cam2_detections': cam2_data,
-            'closest_obstacle_distance': closest_obstacle_distance,
-            'closest_vehicle_distance': closest_vehicle_distance,
-            'camera_distance': CAMERA_DISTANCE,
-            'total_distance': total_distance,
-            'timestamp': time.time()
-        }
 
-        # Save to combined file
-        with open(COMBINED_DATA_FILE, 'w') as f:
-            json.dump(combined_data, f)
+@app.route('/profiles/<cam>', methods=['GET', 'PUT'])
+def camera_profile(cam):
+    """
+    Read or change a camera's classes, conf, iou, max_det and imgsz
+    """
+    if cam not in ('cam1', 'cam2'):
+        return jsonify({'error': f"unknown camera {cam}"}), 404
+    if request.method == 'GET':
+        return jsonify(profiles.get(cam))
 
-    except Exception as e:
-        print(f"Error updating combined data: {e}")
+    try:
+        return jsonify(profiles.update(cam, request.get_json(force=True) or {}))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
 
 
-def generate_frames(cam_results_queue):
+@app.route('/cameras')
+def cameras_health():
     """
-    Generator function for streaming processed frames
+    Connection state of each camera (connecting/live/stalled/down)
     """
-    while True:
-        if not cam_results_queue.empty():
-            processed_frame, _ = cam_results_queue.get()
+    return jsonify(camera_health())
 
-            # Encode frame to JPEG
-            ret, buffer = cv2.imencode('.jpg', processed_frame)
-            frame_bytes = buffer.tobytes()
 
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+@app.route('/heatmap/<cam>')
+def camera_heatmap(cam):
+    """
+    Per-class counters of a camera (default), or its occupancy grid for
+    ?class= (default all) and ?window=decay|total|1m|5m|15m as ?format=png
+    or ?format=npy
+    """
+    heatmap = heatmaps.get(cam)
+    if heatmap is None:
+        return jsonify({'error': f"unknown camera {cam}"}), 404
+
+    fmt = request.args.get('format', 'json')
+    cls = request.args.get('class', ALL)
+    window = request.args.get('window', DECAY)
+    try:
+        if fmt == 'json':
+            return jsonify(heatmap.counters())
+        if fmt == 'png':
+            response = Response(heatmap.png(cls, window), mimetype='image/png')
+        elif fmt == 'npy':
+            response = Response(heatmap.npy(cls, window), mimetype='application/octet-stream')
         else:
-            time.sleep(0.1)
+            return jsonify({'error': f"unknown format {fmt}, use json, png or npy"}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
-@app.route('/')
-def index():
+@app.route('/admin/profile')
+def admin_profile():
     """
-    Main dashboard page
+    Sample the pipeline threads for ?seconds= (default 5) and return per-function
+    totals and collapsed stacks. ?threads=cam1,camera- picks threads by name,
+    ?idle=1 keeps waiting threads, ?format=collapsed returns only the stacks
+    as text for flamegraph.pl/speedscope. Needs "Authorization: Bearer $ADMIN_TOKEN".
     """
-    return render_template('index.html')
+    if not ADMIN_TOKEN:
+        return jsonify({'error': "profiling is disabled, set ADMIN_TOKEN to enable it"}), 404
+    auth = request.headers.get('Authorization', '')
+    if not auth.startswith('Bearer ') or not hmac.compare_digest(auth[7:].encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'error': "unauthorized"}), 401, {'WWW-Authenticate': 'Bearer'}
 
+    threads = [name for name in request.args.get('threads', '').split(',') if name]
+    try:
+        report = profiler.profile(float(request.args.get('seconds', 5)),
+                                  float(request.args.get('interval', profiler.INTERVAL)),
+                                  threads, idle=request.args.get('idle') == '1')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
 
-@app.route('/video_feed/cam1')
-def video_feed_cam1():
-    """
-    Route for streaming CAM1 (obstacles)
-    """
-    return Response(generate_frames(cam1_results_queue),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+    if request.args.get('format') == 'collapsed':
+        return Response(report['collapsed'], mimetype='text/plain')
+    return jsonify(report)
 
 
-@app.route('/video_feed/cam2')
-def video_feed_cam2():
+@app.route('/metrics')
+def metrics_endpoint():
     """
-    Route for streaming CAM2 (vehicles)
+    Prometheus scrape endpoint with per-camera pipeline metrics
     """
-    return Response(generate_frames(cam2_results_queue),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
 
 
 @app.route('/data')
 def get_data():
     """
-    API endpoint to get the latest detection data as JSON
+    API endpoint to get the latest detection data.
+
+    ?format=compact (rounded, short detections) or ?format=msgpack trim the
+    payload. Responses carry an ETag, so a poll with If-None-Match gets a
+    304 until the data changes, and are gzipped for clients that accept it.
+    """
+    try:
+        payload = data_payloads.get(request.args.get('format', FULL),
+                                    gzip_ok='gzip' in request.headers.get('Accept-Encoding', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except ImportError:
+        return jsonify({'error': "msgpack is not installed on the server"}), 501
+
+    response = Response(payload.body, content_type=payload.content_type)
+    response.set_etag(payload.etag)
+    response.headers['Cache-Control'] = 'no-cache'  # always revalidate, the ETag makes that cheap
+    response.vary.add('Accept-Encoding')
+    if payload.encoding:
+        response.headers['Content-Encoding'] = payload.encoding
+    return response.make_conditional(request)
+
+
+def build_pipeline(cam_name, cam_url, is_cam1, data_file, inference_config, first_worker):
+    """
+    capture -> detect -> publish for one camera. Frames wait in a bounded
+    queue in front of detection, the oldest is dropped when it falls behind
     """
-    # Check if combined data file exists
-    if os.path.exists(COMBINED_DATA_FILE):
-        with open(COMBINED_DATA_FILE, 'r') as f:
-            combined_data = json.load(f)
-        return jsonify(combined_data)
-    else:
-        # Fallback if file doesn't exist yet
-        return jsonify({
-            'cam1_detections': [],
-            'cam2_detections': [],
-            'closest_obstacle_distance': 0,
-            'closest_vehicle_distance': 0,
-            'camera_distance': CAMERA_DISTANCE,
-            'total_distance': CAMERA_DISTANCE,
-            'timestamp': time.time()
-        })
+    workers = inference_config['workers']
 
+    def setup(index):
+        detector = LazyModel(MODEL_PATH).start() if workers > 1 else model
+        return frame_detector(is_cam1, detector, first_worker + index, inference_config)
 
+    return (Pipeline(cam_name)
+            .source('capture', lambda: capture_camera_feed(cam_url, cam_name))
+            .stage('detect', setup=setup, workers=workers, policy=DROP_OLDEST)
+            .stage('publish', result_publisher(cam_name, stream_hubs[cam_name], data_file), policy=BLOCK, maxsize=2))
 
 
+def start_pipeline():
+    """
+    Start capture and inference pipelines (runs in the background so the
+    web server is up while cameras connect and the model warms up)
+    """
+    # Pick torch threads, worker count and affinity for this host
+    inference_config = dict(autotune.DEFAULT_CONFIG)
+    if AUTOTUNE:
+        warmup_frames = autotune.collect_frames([get_camera('cam1', CAM1_URL), get_camera('cam2', CAM2_URL)])
+        inference_config = autotune.load_or_tune(MODEL_PATH, warmup_frames, cameras=2,
+                                                 retune=AUTOTUNE_RETUNE)
+        autotune.apply_process_settings(inference_config)
 
-def main():
+    # Worker indexes are numbered across both cameras for CPU pinning
+    workers = inference_config['workers']
+    pipelines['cam1'] = build_pipeline('cam1', CAM1_URL, True, CAM1_DATA_FILE, inference_config, 0).start()
+    pipelines['cam2'] = build_pipeline('cam2', CAM2_URL, False, CAM2_DATA_FILE, inference_config, workers).start()
 
+    if CAMERA_NEGOTIATE:
+        negotiator.start()
 
-    # Start camera feed threads
-    cam1_thread = threading.Thread(target=capture_camera_feed, args=(CAM1_URL, cam1_queue))
-    cam2_thread = threading.Thread(target=capture_camera_feed, args=(CAM2_URL, cam2_queue))
-    cam1_thread.daemon = True
-    cam2_thread.daemon = True
-    cam1_thread.start()
-    cam2_thread.start()
-
-    # Start processing threads
-    cam1_processing_thread = threading.Thread(target=process_frames,
-                                              args=(cam1_queue, cam1_results_queue, True, CAM1_DATA_FILE))
-    cam2_processing_thread = threading.Thread(target=process_frames,
-                                              args=(cam2_queue, cam2_results_queue, False, CAM2_DATA_FILE))
-    cam1_processing_thread.daemon = True
-    cam2_processing_thread.daemon = True
-    cam1_processing_thread.start()
-    cam2_processing_thread.start()
+
+def main():
+    # Load and warm up the model in the background
+    model.start()
+    if TELEMETRY_PORT:
+        telemetry_server.start()
+
+    pipeline_thread = threading.Thread(target=start_pipeline)
+    pipeline_thread.daemon = True
+    pipeline_thread.start()
 
     # Start Flask app
     app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
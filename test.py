@@ -1,23 +1,37 @@
 from flask import Flask, Response, render_template
+import os
 import cv2
 import numpy as np
-from ultralytics import YOLO
+from espcam import stages
+from espcam.camera import get_camera
+from espcam.model_loader import LazyModel
+from espcam.pipeline import LATEST_ONLY, Latest, Pipeline
 
 app = Flask(__name__)
 
 # Webcam index (0 for built-in camera)
 WEBCAM_INDEX = 0
 
-# Load YOLOv8m model
-model = YOLO("yolov8m.pt")
+# Load YOLOv8m model (in the background, the server answers while it warms up)
+model = LazyModel("yolov8m.pt")
 
 # Define Trapezium ROI
 ROI_POINTS = np.array([[100, 300], [500, 300], [600, 480], [50, 480]])
 
 # Focal length for distance calculation
-FOCAL_LENGTH = 250 Z21  # Adjust this for accuracy
+FOCAL_LENGTH = 250  # Adjust this for accuracy
 KNOWN_OBJECT_WIDTH = 1.7  # Average width of a human in meters
 
+# ROI outline and warning banner are rendered once, not on every frame
+overlay = stages.overlay
+overlay.add_layer("roi", lambda canvas: cv2.polylines(canvas, [ROI_POINTS], isClosed=True, color=(255, 0, 0),
+                                                      thickness=2))
+overlay.add_layer("accident_warning", lambda canvas: cv2.putText(canvas, "Accident Can Happen!", (350, 40),
+                                                                 cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2))
+
+# Latest encoded frame, shared by every viewer
+latest_jpeg = Latest()
+
 
 def is_inside_roi(x, y):
     """Check if a point is inside the trapezium ROI."""
@@ -34,61 +48,109 @@ def estimate_distance(bbox_width):
     return None
 
 
+def capture_frames():
+    """Capture webcam frames."""
+    # Shared connection that reopens the webcam with backoff, so the source
+    # never ends when a read fails
+    camera = get_camera("webcam", WEBCAM_INDEX)
+    seq = 0
+
+    while True:
+        seq, frame = camera.read(seq, timeout=1.0)
+        if frame is None:
+            continue
+        yield {"frame": frame.copy()}  # drawn on in place downstream
+
+
+def detect(item):
+    """Detect objects and check them against the ROI."""
+    frame = item["frame"]
+    if not model.wait(1.0):
+        return None
+
+    # Run YOLO detection
+    results = model(frame)
+    accident_warning = False
+    detected_distance = None
+    boxes = []
+    labels = []
+
+    for result in results:
+        for box in result.boxes:
+            x1, y1, x2, y2 = map(int, box.xyxy[0])
+            label = model.names[int(box.cls[0])]
+            confidence = box.conf[0]
+
+            # Calculate center of bounding box
+            center_x = (x1 + x2) // 2
+            center_y = (y1 + y2) // 2
+            bbox_width = x2 - x1
+
+            # Estimate distance
+            distance = estimate_distance(bbox_width)
+
+            # Detect objects inside ROI
+            if label in ["person", "dog", "cat", "car", "truck"] and is_inside_roi(center_x, center_y):
+                accident_warning = True
+                detected_distance = distance
+
+                boxes.append(((x1, y1, x2, y2), (0, 255, 0)))
+                labels.append((f"{label} {confidence:.2f}", (x1, y1 - 10), (0, 255, 0)))
+                labels.append((f"Dist: {distance:.2f}m", (x1, y2 + 20), (0, 255, 0)))
+
+    # Display warning message & distance at the top-right, inside frame
+    layers = ["roi"]
+    if accident_warning and detected_distance:
+        layers.append("accident_warning")
+        labels.append((f"Distance: {detected_distance}m", (350, 70), (0, 255, 255), 0.8))
+
+    item["boxes"] = boxes
+    item["labels"] = labels
+    item["layers"] = layers
+    return item
+
+
+def draw(item):
+    """Draw the ROI, boxes and labels in one pass."""
+    overlay.compose(item["frame"], item["boxes"], item["labels"], item["layers"])
+    return item
+
+
+def encode(item):
+    """Encode frame as JPEG for the viewers."""
+    frame_bytes = stages.encode_jpeg(item["frame"])
+    if frame_bytes is not None:
+        latest_jpeg.publish(frame_bytes)
+
+
+# Webcam -> inference -> draw -> encode, keeping only the newest frame
+# whenever the next stage is still busy
+pipeline = (Pipeline("webcam")
+            .source("capture", capture_frames)
+            .stage("inference", detect, policy=LATEST_ONLY)
+            .stage("draw", draw, policy=LATEST_ONLY)
+            .stage("encode", encode, policy=LATEST_ONLY))
+
+
 def generate_frames():
-    """Capture webcam frames, detect objects, and display results."""
-    cap = cv2.VideoCapture(WEBCAM_INDEX)
-
-    while cap.isOpened():
-        success, frame = cap.read()
-        if not success:
-            break
-
-        # Run YOLO detection
-        results = model(frame)
-        accident_warning = False
-        detected_distance = None
-
-        # Draw ROI
-        cv2.polylines(frame, [ROI_POINTS], isClosed=True, color=(255, 0, 0), thickness=2)
-
-        for result in results:
-            for box in result.boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                label = model.names[int(box.cls[0])]
-                confidence = box.conf[0]
-
-                # Calculate center of bounding box
-                center_x = (x1 + x2) // 2
-                center_y = (y1 + y2) // 2
-                bbox_width = x2 - x1
-
-                # Estimate distance
-                distance = estimate_distance(bbox_width)
-
-                # Detect objects inside ROI
-                if label in ["person", "dog", "cat", "car", "truck"] and is_inside_roi(center_x, center_y):
-                    accident_warning = True
-                    detected_distance = distance
-
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    cv2.putText(frame, f"{label} {confidence:.2f}", (x1, y1 - 10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                    cv2.putText(frame, f"Dist: {distance:.2f}m", (x1, y2 + 20),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-
-        # Display warning message & distance at the top-right, inside frame
-        if accident_warning and detected_distance:
-            cv2.putText(frame, "Accident Can Happen!", (350, 40),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-            cv2.putText(frame, f"Distance: {detected_distance}m", (350, 70),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2)
-
-        # Encode frame as JPEG
-        ret, buffer = cv2.imencode(".jpg", frame)
-        if not ret:
+    """Stream the latest processed webcam frame."""
+    model.start()
+    pipeline.start()
+    seq = 0
+
+    while True:
+        if not model.ready:
+            # Show the viewer something while the model loads
+            frame_bytes = stages.encode_jpeg(stages.placeholder_frame(f"Model {model.state.replace('_', ' ')}..."))
+            yield (b"--frame\r\n"
+                   b"Content-Type: image/jpeg\r\n\r\n" + frame_bytes + b"\r\n")
+            model.wait(1.0)
+            continue
+
+        seq, frame_bytes = latest_jpeg.read(seq, timeout=1.0)
+        if frame_bytes is None:
             continue
 
-        frame_bytes = buffer.tobytes()
         yield (b"--frame\r\n"
                b"Content-Type: image/jpeg\r\n\r\n" + frame_bytes + b"\r\n")
 
@@ -104,4 +166,7 @@ def video_feed():
 
 
 if __name__ == "__main__":
+    # With the debug reloader only the child process serves requests
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        model.start()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,32 @@
+import time
+
+from espcam.alerts import AlertChannel
+
+
+def test_raises_after_streak_and_clears_after_absence():
+    alerts = AlertChannel('cam1', raise_frames=2, clear_seconds=1.0)
+    now = time.time()
+    assert alerts.update(True, now, now) is None
+    assert alerts.update(True, now + 0.1, now)['type'] == 'alert_raised'
+    assert alerts.update(False, now + 0.5, now) is None
+    assert alerts.update(False, now + 1.2, now)['type'] == 'alert_cleared'
+
+
+def test_slow_verdicts_do_not_expire_the_alert():
+    alerts = AlertChannel('cam1', raise_frames=1, no_frames_seconds=5.0)
+    captured = time.time() - 3.0  # verdicts arrive long after capture
+    alerts.update(True, captured, time.time())
+
+    assert alerts.expire(time.time() + 1.0) is None
+    assert alerts.active
+
+
+def test_expires_without_verdicts():
+    alerts = AlertChannel('cam1', raise_frames=1, no_frames_seconds=5.0)
+    alerts.update(True, time.time(), time.time())
+
+    event = alerts.expire(time.time() + 6.0)
+    assert event['type'] == 'alert_cleared'
+    assert event['reason'] == "no frames"
+    assert not alerts.active
+    assert alerts.state()['last_event'] is event
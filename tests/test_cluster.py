@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip('requests')
+
+from espcam.cluster import Coordinator  # noqa: E402
+
+CAMERAS = {'cam1': {'url': 'http://cam1/stream'}, 'cam2': {'url': 'http://cam2/stream'}}
+
+
+def test_cameras_spread_over_workers():
+    coordinator = Coordinator(CAMERAS)
+    coordinator.register('a', 'http://a', 1)
+    coordinator.register('b', 'http://b', 1)
+
+    assert sorted(coordinator.owners().values()) == ['a', 'b']
+
+
+def test_dead_worker_cameras_fail_over():
+    coordinator = Coordinator(CAMERAS, worker_timeout=5.0)
+    coordinator.register('a', 'http://a', 2)
+    coordinator.register('b', 'http://b', 2)
+    assert set(coordinator.owners().values()) == {'a'}
+
+    coordinator.workers['a']['last_seen'] -= 10.0  # no heartbeat for longer than the timeout
+    coordinator.rebalance()
+
+    assert 'a' not in coordinator.workers
+    assert coordinator.owners() == {'cam1': 'b', 'cam2': 'b'}
+    assert coordinator.heartbeat('a', {}) is None  # it has to register again
+    assert coordinator.stream_url('cam1') == 'http://b/video_feed/cam1'
+
+
+def test_reports_only_accepted_from_owner():
+    coordinator = Coordinator({'cam1': CAMERAS['cam1']})
+    coordinator.register('a', 'http://a', 1)
+    coordinator.register('b', 'http://b', 1)
+
+    assert coordinator.accepts('a', 'cam1')
+    assert not coordinator.accepts('b', 'cam1')
+
+
+def test_overloaded_camera_moves_once_per_cooldown():
+    coordinator = Coordinator({'cam1': CAMERAS['cam1']}, move_cooldown=30.0)
+    coordinator.register('a', 'http://a', 1)
+    coordinator.register('b', 'http://b', 1)
+    coordinator._moved.clear()  # pretend the first assignment is long past
+
+    assert coordinator.assigned('a')
+    coordinator.heartbeat('a', {'cam1': {'overloaded': True}})
+    assert coordinator.owners() == {'cam1': 'b'}
+
+    coordinator.heartbeat('b', {'cam1': {'overloaded': True}})
+    assert coordinator.owners() == {'cam1': 'b'}  # still cooling down
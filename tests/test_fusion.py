@@ -0,0 +1,69 @@
+import time
+
+from espcam.fusion import FusionEngine
+
+
+def detection(distance):
+    return {'class': 'car', 'adjusted_distance': distance}
+
+
+def test_pairs_frames_within_skew():
+    fusion = FusionEngine('cam1', 'cam2', 1.0, max_skew=0.5)
+    now = time.time()
+    fusion.update('cam1', now - 1.0, [detection(9.0)])
+    fusion.update('cam1', now - 0.1, [detection(4.0)])
+    fused = fusion.update('cam2', now, [detection(2.0)])
+
+    assert fused['paired']
+    assert fused['cam1_timestamp'] == now - 0.1  # the nearest frame, not the older one
+    assert fused['closest_obstacle_distance'] == 4.0
+    assert fused['total_distance'] == 4.0 + 2.0 + 1.0
+    assert abs(fused['skew'] - 0.1) < 1e-6
+
+
+def test_falls_back_to_fresh_frame_beyond_skew():
+    fusion = FusionEngine('cam1', 'cam2', 1.0, max_skew=0.2, max_age=2.0)
+    now = time.time()
+    fusion.update('cam1', now - 1.0, [detection(5.0)])
+    fused = fusion.update('cam2', now, [detection(3.0)])
+
+    assert not fused['paired']
+    assert fused['closest_obstacle_distance'] == 5.0
+    assert fused['total_distance'] == 9.0
+
+
+def test_ignores_stale_camera():
+    fusion = FusionEngine('cam1', 'cam2', 1.0, max_skew=0.2, max_age=0.5)
+    now = time.time()
+    fusion.update('cam1', now - 3.0, [detection(5.0)])
+    fused = fusion.update('cam2', now, [detection(3.0)])
+
+    assert fused['closest_obstacle_distance'] == 0
+    snapshot = fusion.snapshot()
+    assert snapshot['stale'] == ['cam1']
+    assert snapshot['total_distance'] == 4.0
+
+
+def test_late_frame_does_not_replace_newer_result():
+    fusion = FusionEngine('cam1', 'cam2', 1.0)
+    now = time.time()
+    fusion.update('cam1', now, [detection(4.0)])
+    version = fusion.version
+    fused = fusion.update('cam1', now - 0.2, [detection(8.0)])
+
+    assert fused['closest_obstacle_distance'] == 4.0
+    assert fusion.version == version
+
+
+def test_measured_distance_replaces_estimate():
+    readings = {'cam2': 2.5}
+    fusion = FusionEngine('cam1', 'cam2', 1.0, measured=readings.get)
+    now = time.time()
+    fusion.update('cam1', now, [detection(4.0)])
+    fusion.update('cam2', now, [detection(9.0)])
+
+    snapshot = fusion.snapshot()
+    assert snapshot['closest_vehicle_distance'] == 2.5
+    assert snapshot['cam1_distance_source'] == 'camera'
+    assert snapshot['cam2_distance_source'] == 'sensor'
+    assert snapshot['total_distance'] == 4.0 + 2.5 + 1.0
@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+pytest.importorskip('cv2')
+
+from espcam.heatmap import ALL, TOTAL, OccupancyHeatmap  # noqa: E402
+
+
+def person(x, y):
+    return {'class': 'person', 'bbox': [x - 5, y - 5, x + 5, y + 5]}
+
+
+def test_counts_box_centres_per_class():
+    heatmap = OccupancyHeatmap('cam1', cell=16)
+    heatmap.update([person(8, 8), person(8, 8), {'class': 'car', 'bbox': [100, 100, 120, 120]}], time.time())
+
+    assert heatmap.grid('person', TOTAL)[0, 0] == 2
+    assert heatmap.grid('car', TOTAL)[110 // 16, 110 // 16] == 1
+    assert heatmap.grid(ALL, TOTAL).sum() == 3
+    assert heatmap.counters()['current'] == {'person': 2, 'car': 1, ALL: 3}
+
+
+def test_windows_expire_old_buckets():
+    heatmap = OccupancyHeatmap('cam1', windows={'short': 20.0, 'long': 60.0}, bucket_seconds=10.0)
+    now = time.time()
+    heatmap.update([person(8, 8)], now - 45.0)
+    heatmap.update([person(8, 8)], now)
+
+    counters = heatmap.counters()
+    assert counters['windows']['short'] == {'person': 1, ALL: 1}
+    assert counters['windows']['long'] == {'person': 2, ALL: 2}
+    assert counters['total'] == {'person': 2, ALL: 2}
+
+
+def test_windows_empty_once_every_bucket_left():
+    heatmap = OccupancyHeatmap('cam1', windows={'short': 20.0}, bucket_seconds=10.0)
+    heatmap.update([person(8, 8)], time.time() - 100.0)
+
+    assert heatmap.grid('person', 'short').sum() == 0
+    assert heatmap.grid('person', TOTAL).sum() == 1
+    assert not heatmap._buckets
+
+
+def test_unknown_window_is_rejected():
+    with pytest.raises(ValueError):
+        OccupancyHeatmap('cam1').grid(ALL, '2h')
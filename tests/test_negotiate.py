@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip('requests')
+
+from espcam.negotiate import CameraNegotiator, framesize_for_imgsz  # noqa: E402
+from espcam.simulator import FRAMESIZES, FRAMESIZES_LEGACY  # noqa: E402
+
+
+def negotiator(delivered):
+    return CameraNegotiator({'cam1': 'http://cam1:81/stream'}, imgsz=lambda cam: 320, stage=lambda cam: None,
+                            frame_size=lambda cam: delivered)
+
+
+def test_framesize_for_imgsz_in_both_numberings():
+    assert FRAMESIZES[framesize_for_imgsz(320)] == (320, 240)
+    assert FRAMESIZES_LEGACY[framesize_for_imgsz(320, framesizes=FRAMESIZES_LEGACY)] == (320, 240)
+    assert FRAMESIZES[framesize_for_imgsz(1280)] == (640, 480)  # capped at the standard width
+
+
+def test_switches_to_the_numbering_the_frames_match():
+    cameras = negotiator((640, 480))
+    assert cameras.check_delivered('cam1', 8)  # VGA in older firmware, CIF in current
+    assert cameras.state['cam1']['numbering'] == 'legacy'
+
+    assert cameras.check_delivered('cam1', 8)
+    assert cameras.state['cam1']['numbering'] == 'legacy'
+
+
+def test_unexplained_frame_size_is_reported():
+    cameras = negotiator((333, 222))
+    assert not cameras.check_delivered('cam1', 10)
+    assert cameras.state['cam1']['numbering'] == 'current'
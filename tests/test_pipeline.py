@@ -0,0 +1,98 @@
+import threading
+import time
+
+from espcam.pipeline import BLOCK, DROP_OLDEST, LATEST_ONLY, Pipeline, StageQueue
+
+
+def drain(queue):
+    items = []
+    while queue.qsize():
+        items.append(queue.get(timeout=0))
+    return items
+
+
+def test_block_queue_times_out_when_full():
+    queue = StageQueue(maxsize=2, policy=BLOCK)
+    assert queue.put(1) and queue.put(2)
+    assert queue.put(3, timeout=0.05) is False
+    assert drain(queue) == [1, 2]
+
+
+def test_block_queue_waits_for_room():
+    queue = StageQueue(maxsize=1, policy=BLOCK)
+    queue.put(1)
+    threading.Timer(0.05, queue.get).start()
+    assert queue.put(2, timeout=1.0)
+    assert drain(queue) == [2]
+
+
+def test_drop_oldest_keeps_newest_items():
+    drops = []
+    queue = StageQueue(maxsize=3, policy=DROP_OLDEST, on_drop=lambda: drops.append(1))
+    for item in range(5):
+        assert queue.put(item)
+    assert drain(queue) == [2, 3, 4]
+    assert len(drops) == 2
+
+
+def test_latest_only_holds_one_item():
+    drops = []
+    queue = StageQueue(maxsize=10, policy=LATEST_ONLY, on_drop=lambda: drops.append(1))
+    for item in range(4):
+        queue.put(item)
+    assert queue.maxsize == 1
+    assert drain(queue) == [3]
+    assert len(drops) == 3
+
+
+def test_get_times_out_on_empty_queue():
+    assert StageQueue().get(timeout=0.01) is None
+
+
+def test_stage_counts_drops():
+    pipeline = Pipeline('test-drops').stage('slow', lambda item: item, policy=DROP_OLDEST, maxsize=2)
+    for item in range(5):
+        pipeline.put(item)
+    assert pipeline.stages[0].dropped == 3
+
+
+def test_pipeline_start_is_idempotent():
+    sources = []
+    results = []
+    done = threading.Event()
+
+    def produce():
+        sources.append(1)
+        yield from range(3)
+
+    def collect(item):
+        results.append(item)
+        if len(results) == 3:
+            done.set()
+
+    pipeline = Pipeline('test-start').source('numbers', produce).stage('collect', collect, policy=BLOCK)
+    try:
+        assert pipeline.start() is pipeline
+        pipeline.start()
+        assert done.wait(2.0)
+        time.sleep(0.1)
+    finally:
+        pipeline.stop()
+    assert sources == [1]
+    assert results == [0, 1, 2]
+
+
+def test_workers_count_every_item():
+    total = 2000
+    pipeline = Pipeline('test-workers').stage('work', lambda item: None, workers=4, policy=BLOCK, maxsize=total)
+    for item in range(total):
+        pipeline.put(item)
+    try:
+        pipeline.start()
+        deadline = time.time() + 5.0
+        while pipeline.stages[0].processed < total and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        pipeline.stop()
+    assert pipeline.stages[0].processed == total
+    assert pipeline.stages[0].status()['processed'] == total
@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from espcam.telemetry import LatestTable, ProtocolError, encode_hello, encode_reading, parse
+
+
+def test_parses_hello_and_readings():
+    table = LatestTable()
+    channels = {}
+    data = encode_hello(7, 'cam2-node') + encode_reading(7, 3.5, 100.0) + encode_reading(7, 2.5)
+
+    count, rest = parse(data, channels, table, received=200.0)
+
+    assert (count, rest) == (2, b'')
+    assert channels == {7: 'cam2-node'}
+    assert table.reading('cam2-node') == (2.5, 200.0, 200.0)  # no sensor clock, time of arrival
+
+
+def test_keeps_partial_frames_for_the_next_packet():
+    table = LatestTable()
+    channels = {}
+    data = encode_hello(1, 'range') + encode_reading(1, 1.25, 50.0)
+
+    count, rest = parse(data[:-4], channels, table, received=60.0)
+    assert count == 0
+    assert rest == data[len(encode_hello(1, 'range')):-4]
+
+    count, rest = parse(rest + data[-4:], channels, table, received=60.0)
+    assert (count, rest) == (1, b'')
+    assert table.reading('range') == (1.25, 50.0, 60.0)
+
+
+def test_keeps_partial_hello():
+    hello = encode_hello(3, 'node')
+    count, rest = parse(hello[:5], {}, LatestTable(), received=0.0)
+    assert (count, rest) == (0, hello[:5])
+
+
+def test_rejects_undeclared_channel():
+    with pytest.raises(ProtocolError):
+        parse(encode_reading(9, 1.0), {}, LatestTable(), received=0.0)
+
+
+def test_rejects_unknown_frame_type():
+    with pytest.raises(ProtocolError):
+        parse(b'\x7f' + bytes(20), {}, LatestTable(), received=0.0)
+
+
+def test_max_age_uses_arrival_time():
+    table = LatestTable()
+    table.update('node', 4.0, timestamp=12.0)  # the sensor's clock is far off
+    assert table.get('node', max_age=2.0) == 4.0
+
+    table.update('node', 4.0, timestamp=time.time(), received=time.time() - 5.0)
+    assert table.get('node', max_age=2.0) is None
+    assert table.get('node') == 4.0
@@ -132,30 +132,53 @@
 #     loop = asyncio.get_event_loop()
 #     loop.create_task(receive_cam2_distance())
 #     app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
-import cv2
-import numpy as np
-from flask import Flask, render_template, Response
+import os
+import sys
+from flask import Flask, render_template, Response, jsonify, request
 from flask_cors import CORS
-from ultralytics import YOLO
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from espcam import stages
+from espcam.camera import get_camera, health as camera_health
+from espcam.model_loader import LazyModel
+from espcam.pipeline import LATEST_ONLY, Latest, Pipeline
+from espcam.profiles import ProfileStore
+from espcam.telemetry import LatestTable, TelemetryServer
 
 # Initialize Flask App
 app = Flask(__name__)
 CORS(app)  # Enable CORS
 
 # ESP32-CAM URLs
-ESP32_CAM1_URL = "http://192.168.123.100:81/stream"  # Vehicle Detector
-ESP32_CAM2_URL = "http://192.168.123.194:81/stream"  # Obstacle Detector
+ESP32_CAM1_URL = os.environ.get("CAM1_URL", "http://192.168.123.100:81/stream")  # Vehicle Detector
+ESP32_CAM2_URL = os.environ.get("CAM2_URL", "http://192.168.123.194:81/stream")  # Obstacle Detector
 
-# Load YOLOv8 Model
-model = YOLO("yolov8m.pt")
+# Load YOLOv8 Model (in the background, the server answers while it warms up)
+model = LazyModel("yolov8m.pt")
 
 # Object Categories
 ANIMALS_HUMANS = ["person", "dog", "cat", "cow", "horse", "sheep"]  # CAM2
-VEHICLES = ["car", "truck", "bus", "motorbike"]  # CAM1
+VEHICLES = ["car", "truck", "bus", "motorcycle"]  # CAM1
+
+# Detection profiles, classes are filtered inside NMS (see /profiles/<cam>)
+profiles = ProfileStore({
+    'cam1': {'classes': VEHICLES},
+    'cam2': {'classes': ANIMALS_HUMANS},
+})
 
 # Constants for Distance Calculation
 KNOWN_HEIGHT_OBJ = 1.5  # Example: Average vehicle height in meters
 FOCAL_LENGTH = 50  # Estimated focal length from camera calibration
+CAMERA_DISTANCE = 1  # ft between the two cameras
+
+# Distance readings of the local detectors (as 'local-cam1'/'local-cam2') and
+# of remote sensor nodes under their own names, see espcam/telemetry.py. A
+# fresh reading of a camera's remote node wins over the local estimate
+TELEMETRY_PORT = int(os.environ.get("TELEMETRY_PORT", 8765))
+READING_MAX_AGE = 2.0  # seconds after which a distance reading is ignored
+REMOTE_SENSORS = {'cam1': os.environ.get("CAM1_SENSOR", "cam1-node"),
+                  'cam2': os.environ.get("CAM2_SENSOR", "cam2-node")}
+telemetry = LatestTable()
+telemetry_server = TelemetryServer(telemetry, port=TELEMETRY_PORT)
 
 
 def calculate_distance(bbox_height):
@@ -166,35 +189,109 @@ def calculate_distance(bbox_height):
     return None
 
 
-def generate_feed(cam_url, object_classes):
-    """Generates the camera feed with bounding boxes and distances."""
-    cap = cv2.VideoCapture(cam_url)
+def latest_distance(cam_name):
+    """Fresh distance of a camera's remote sensor node, else of the local detector."""
+    distance = telemetry.get(REMOTE_SENSORS[cam_name], max_age=READING_MAX_AGE)
+    if distance is None:
+        distance = telemetry.get(f"local-{cam_name}", max_age=READING_MAX_AGE)
+    return distance
+
+
+def capture_frames(cam_name, cam_url):
+    """Reads frames from an ESP32-CAM."""
+    # Shared connection, reconnects with backoff instead of spinning on read()
+    camera = get_camera(cam_name, cam_url)
+    seq = 0
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
+    while True:
+        seq, frame = camera.read(seq, timeout=1.0)
+        if frame is None:
             continue
+        yield {'frame': frame.copy()}  # the camera's frame is shared with other readers
 
-        results = model(frame)
+
+def detector(cam_name):
+    """Detection stage: bounding boxes and distances under the camera's profile."""
+    def detect(item):
+        if not model.wait(1.0):
+            return None
+
+        detections = []
+        results = model(item['frame'], **profiles.predict_kwargs(cam_name, model.names))
         for r in results:
             for box in r.boxes:
                 x1, y1, x2, y2 = map(int, box.xyxy[0])
                 label = r.names[int(box.cls[0])]
 
-                if label in object_classes:
-                    bbox_height = y2 - y1
-                    distance = calculate_distance(bbox_height)
+                bbox_height = y2 - y1
+                distance = calculate_distance(bbox_height)
+                detections.append((label, distance, (x1, y1, x2, y2)))
+
+        distances = [distance for _, distance, _ in detections if distance is not None]
+        if distances:
+            telemetry.update(f"local-{cam_name}", min(distances))
+        item['detections'] = detections
+        return item
+
+    return detect
 
-                    # Draw Bounding Box & Label
-                    color = (0, 255, 0)
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                    text = f"{label}: {distance} ft" if distance else label
-                    cv2.putText(frame, text, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
 
-        _, buffer = cv2.imencode('.jpg', frame)
-        yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+def draw(item):
+    """Draws bounding boxes and labels."""
+    color = (0, 255, 0)
+    boxes = []
+    labels = []
+    for label, distance, (x1, y1, x2, y2) in item['detections']:
+        boxes.append(((x1, y1, x2, y2), color))
+        text = f"{label}: {distance} ft" if distance else label
+        labels.append((text, (x1, y1 - 10), color, 0.6))
 
-    cap.release()
+    stages.overlay.compose(item['frame'], boxes, labels)
+    return item
+
+
+def publisher(latest):
+    """Encodes each frame once for every viewer."""
+    def encode(item):
+        frame_bytes = stages.encode_jpeg(item['frame'])
+        if frame_bytes is not None:
+            latest.publish(frame_bytes)
+
+    return encode
+
+
+# Latest encoded frame of each camera, shared by every viewer
+latest_jpegs = {'cam1': Latest(), 'cam2': Latest()}
+
+# capture -> inference -> draw -> encode for each camera, started by its first
+# viewer; every stage keeps only the newest frame while the next one is busy
+pipelines = {
+    cam_name: (Pipeline(cam_name)
+               .source('capture', lambda cam_name=cam_name, cam_url=cam_url: capture_frames(cam_name, cam_url))
+               .stage('inference', detector(cam_name), policy=LATEST_ONLY)
+               .stage('draw', draw, policy=LATEST_ONLY)
+               .stage('encode', publisher(latest_jpegs[cam_name]), policy=LATEST_ONLY))
+    for cam_name, cam_url in (('cam1', ESP32_CAM1_URL), ('cam2', ESP32_CAM2_URL))
+}
+
+
+def generate_feed(cam_name):
+    """Generates the camera feed with bounding boxes and distances."""
+    model.start()
+    pipelines[cam_name].start()
+    seq = 0
+
+    while True:
+        if not model.ready:
+            frame = stages.placeholder_frame(f"Model {model.state.replace('_', ' ')}...")
+            yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + stages.encode_jpeg(frame) + b'\r\n')
+            model.wait(1.0)
+            continue
+
+        seq, frame_bytes = latest_jpegs[cam_name].read(seq, timeout=1.0)
+        if frame_bytes is None:
+            continue
+        yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
 
 
 @app.route('/')
@@ -204,13 +301,59 @@ def index():
 
 @app.route('/video_feed/cam1')
 def video_feed_cam1():
-    return Response(generate_feed(ESP32_CAM1_URL, VEHICLES), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return Response(generate_feed('cam1'), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
 @app.route('/video_feed/cam2')
 def video_feed_cam2():
-    return Response(generate_feed(ESP32_CAM2_URL, ANIMALS_HUMANS), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return Response(generate_feed('cam2'), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+@app.route('/status')
+def status():
+    return jsonify({'model': model.status(), 'cameras': camera_health(),
+                    'pipelines': {name: pipeline.status() for name, pipeline in pipelines.items()}})
+
+
+@app.route('/profiles/<cam>', methods=['GET', 'PUT'])
+def camera_profile(cam):
+    if cam not in ('cam1', 'cam2'):
+        return jsonify({'error': f"unknown camera {cam}"}), 404
+    if request.method == 'GET':
+        return jsonify(profiles.get(cam))
+    try:
+        return jsonify(profiles.update(cam, request.get_json(force=True) or {}))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/cameras')
+def cameras_health():
+    return jsonify(camera_health())
+
+
+@app.route('/get_distances')
+def get_distances():
+    """Closest vehicle (CAM1) and obstacle (CAM2) distances in feet."""
+    vehicle_distance = latest_distance('cam1') or 0
+    obstacle_distance = latest_distance('cam2') or 0
+    total_distance = vehicle_distance + obstacle_distance + CAMERA_DISTANCE
+
+    return jsonify({
+        "vehicle_distance": round(vehicle_distance, 2),
+        "obstacle_distance": round(obstacle_distance, 2),
+        "total_distance": round(total_distance, 2)
+    })
+
+
+@app.route('/telemetry')
+def telemetry_status():
+    return jsonify({'ingest': telemetry_server.status(), 'readings': telemetry.snapshot()})
 
 
 if __name__ == "__main__":
+    # With the debug reloader only the child process serves requests
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        model.start()
+        telemetry_server.start()
     app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)